@@ -1,6 +1,13 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+"""
+Serial logger of the MPU-9250 firmware.
+
+Requires pyserial, click and influxdb, and the inertial package for its
+write-ahead `Spool`: install it with `pip install -e ../pyinertial`.
+"""
+
 import serial
 import click
 import platform
@@ -8,17 +15,25 @@ import glob
 import json
 import signal
 import sys
+import time
 from itertools import cycle
 from influxdb import InfluxDBClient
+from inertial.spool import Spool
 
 serial_port = serial.Serial()
 client = None
 progress_pool = cycle(["_  ", "__ ", "___"])
+#: Write-ahead spool of the points, drained into the InfluxDB by a background thread.
+spool = None
+last_stamp = 0
+
+SPOOL_DIR = "/data/_inertial_db/_spool/log/"
 
 @click.command()
 @click.option('--baud_rate', default = 19200, help='Override the default baud_rate value.')
 @click.option('--verbose', default = False, help='Prints the retrieved json on console.')
-def routine(verbose, baud_rate):
+@click.option('--spool_dir', default = SPOOL_DIR, help='Directory of the write-ahead spool of the points.')
+def routine(verbose, baud_rate, spool_dir):
     """
     This script intends to log the data output from an Arduino connected to the PC
     and running the MPU-9250 firmware provided.
@@ -28,20 +43,31 @@ def routine(verbose, baud_rate):
     here.
     """
 
+    global spool
+
+    spool = Spool(spool_dir, lambda points: client.write_points(points, time_precision = 'u'))
+
     open_serial_port(baud_rate)
     click.secho("[INF] ", fg = 'cyan', nl = False)
     click.secho("Serial Port '{0}' opened.".format(serial_port.name))
     while True:
         try:
-            line = serial_port.readline().decode('utf-8')
-            act_upon(line)
-        except Exception:
+            line = serial_port.readline().decode('utf-8', errors = 'replace')
+        except serial.SerialException:
             click.secho("\n[ERR] ", fg = 'cyan', nl = False, err = True)
             click.secho("Connection Lost.", err = True, fg = 'red')
             click.secho("[INF] ", fg = 'cyan', nl = False)
             click.secho("Terminating Process.")
+            spool.close()
             sys.exit(1)
 
+        #: A bad line is skipped, the port is still good.
+        try:
+            act_upon(line)
+        except Exception as e:
+            click.secho("\n[ERR] ", fg = 'cyan', nl = False, err = True)
+            click.secho("Skipped a line: {0}".format(e), err = True, fg = 'red')
+
 def open_serial_port(baud_rate):
     """
     Prompts to select the correct Serial Port and then uses that to gather the
@@ -70,6 +96,17 @@ def open_serial_port(baud_rate):
         click.secho("Terminating Process.".format(index))
         sys.exit(1)
 
+def stamp():
+    """
+    Returns the read time of a sample, in microseconds since epoch, strictly
+    increasing. The points are spooled with it, so that they keep their time
+    however late they are written.
+    """
+    global last_stamp
+
+    last_stamp = max(int(time.time() * 1e6), last_stamp + 1)
+    return last_stamp
+
 def act_upon(line):
     """
     Acts upon the lines received from the Device.
@@ -85,9 +122,11 @@ def act_upon(line):
             inf = click.style("[LOGGING DATA] {0}".format(next(progress_pool)), fg = 'cyan')
             click.secho('\r{0}'.format(inf), nl = False)
             # Add data in influx now
+            read_time = stamp()
             json_body = [
                 {
                     "measurement": "accelerometer",
+                    "time": read_time,
                     "tags": {
                         "host": "server01",
                     },
@@ -99,6 +138,7 @@ def act_upon(line):
                 },
                 {
                     "measurement": "gyroscope",
+                    "time": read_time,
                     "tags": {
                         "host": "server01",
                     },
@@ -110,6 +150,7 @@ def act_upon(line):
                 },
                 {
                     "measurement": "magnetometer",
+                    "time": read_time,
                     "tags": {
                         "host": "server01",
                     },
@@ -120,7 +161,7 @@ def act_upon(line):
                     }
                 }
             ]
-            client.write_points(json_body)
+            spool.put(json_body)
 
     except ValueError:
         if "ok" in line:
@@ -141,6 +182,8 @@ def signal_handler(signal, frame):
     click.secho("\n[INF] ", fg = 'cyan', nl = False)
     click.secho("Closing Ports and Exiting.")
     serial_port.close()
+    if spool is not None:
+        spool.close()
     sys.exit(0)
 
 def list_serial_ports():
@@ -1,4 +1,4 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-__all__ = ["cli", "influx", "udp", "routines", "helper", "sample_dump", "colormap"]
+__all__ = ["cli", "influx", "udp", "routines", "helper", "sample_dump", "colormap", "cache", "timeseries", "spool"]
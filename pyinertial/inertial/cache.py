@@ -0,0 +1,526 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import calendar
+import hashlib
+import itertools
+import json
+import numbers
+import os
+import threading
+import time
+import click
+import numpy as np
+
+from .routines import Routines
+from .sample_dump import ChainProbes, Datasets, WINDOWLEN, STEP
+
+class FeatureCache(object):
+    """
+    Persistent store of the Feature Matrices computed from the datasets.
+
+    Every entry is keyed by dataset, tag, window length, step and the version
+    of the feature routine (see `Routines.feature_version`), and is kept in a
+    .npy shard which is loaded back as a memory map. The shards are listed in
+    a JSON manifest along with their size and last access time, which is used
+    to evict the least recently used shards past `max_bytes`.
+
+    This class assumes that the cache is located in /data/_inertial_db/_features
+    directory. This behaviour may be changed by changing the constant CACHE_DIR.
+    """
+
+    CACHE_DIR = "/data/_inertial_db/_features/"
+    MANIFEST = "manifest.json"
+
+    def __init__(self, cache_dir = None, max_bytes = 2 * 1024 ** 3):
+        """
+        Args:
+            cache_dir (str): Cache directory. Default: CACHE_DIR.
+            max_bytes (int): Size bound of the shards, in bytes.
+        """
+        self.cache_dir = cache_dir or self.CACHE_DIR
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok = True)
+        self._load_manifest()
+
+    def get(self, dataset, tag, window_len, step, version):
+        """
+        Returns the cached Feature Matrix.
+
+        Args:
+            dataset (str): Dataset Name.
+            tag (str): Label tag.
+            window_len (int): Samples per window.
+            step (int): Samples between consecutive windows.
+            version (str): Feature routine version.
+        Returns:
+            (numpy.ndarray or None): Read-only Feature Matrix, None if not cached.
+        """
+
+        key = self._key(dataset, tag, window_len, step, version)
+
+        if key not in self.entries:
+            return None
+
+        try:
+            path = os.path.join(self.cache_dir, self.entries[key]["file"])
+            out = np.load(path, mmap_mode = 'r' if self.entries[key]["bytes"] else None)
+        except (IOError, ValueError):
+            self._drop(key)
+            self._save_manifest()
+            return None
+
+        self.entries[key]["accessed"] = time.time()
+        self._save_manifest()
+
+        return out
+
+    def put(self, dataset, tag, window_len, step, version, features):
+        """
+        Stores a Feature Matrix. Entries of the same dataset, tag, window
+        length and step with a different version are stale, and are removed.
+
+        Args:
+            See `get`.
+            features (numpy.ndarray): Feature Matrix.
+        """
+
+        key = self._key(dataset, tag, window_len, step, version)
+        features = np.asarray(features)
+        file_name = key + ".npy"
+        path = os.path.join(self.cache_dir, file_name)
+
+        #: Written aside and renamed, hence readers never see partial shards.
+        with open(path + ".tmp", "wb") as minion:
+            np.save(minion, features)
+        os.replace(path + ".tmp", path)
+
+        for stale in self._match(dataset = dataset, tag = tag, window_len = window_len, step = step):
+            if stale != key:
+                self._drop(stale)
+
+        self.entries[key] = {
+            "dataset": dataset,
+            "tag": tag,
+            "window_len": window_len,
+            "step": step,
+            "version": version,
+            "file": file_name,
+            "bytes": features.nbytes,
+            "accessed": time.time(),
+        }
+
+        self.evict()
+
+    def get_or_compute(self, dataset, tag, window_len, step, version, compute):
+        """
+        Returns the cached Feature Matrix, computing and storing it if needed.
+
+        Args:
+            See `get`.
+            compute (callable): Returns the Feature Matrix. Takes no arguments.
+        Returns:
+            (numpy.ndarray): Feature Matrix.
+        """
+
+        out = self.get(dataset, tag, window_len, step, version)
+
+        if out is None:
+            self.put(dataset, tag, window_len, step, version, compute())
+            out = self.get(dataset, tag, window_len, step, version)
+
+        return out
+
+    def invalidate(self, **kwargs):
+        """
+        Removes the entries matching all of the given fields, see `get` for
+        the field names. Removes everything if called without arguments.
+
+        Returns:
+            (int): Number of entries removed.
+        """
+
+        keys = self._match(**kwargs)
+
+        for key in keys:
+            self._drop(key)
+        self._save_manifest()
+
+        return len(keys)
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the shards fit in `max_bytes`.
+        """
+
+        lru = sorted(self.entries, key = lambda _: self.entries[_]["accessed"])
+        size = sum(self.entries[_]["bytes"] for _ in lru)
+
+        while lru and size > self.max_bytes:
+            key = lru.pop(0)
+            size -= self.entries[key]["bytes"]
+            self._drop(key)
+
+        self._save_manifest()
+
+    def _key(self, *args):
+        """
+        File name safe key of the entry.
+        """
+        return hashlib.sha1(json.dumps(args).encode()).hexdigest()
+
+    def _match(self, **kwargs):
+        """
+        Keys of the entries matching all of the given fields.
+        """
+        return [key for key, meta in self.entries.items() if all(meta[_] == __ for _, __ in kwargs.items())]
+
+    def _drop(self, key):
+        """
+        Removes an entry and its shard. The manifest is not saved.
+        """
+        meta = self.entries.pop(key)
+        try:
+            os.remove(os.path.join(self.cache_dir, meta["file"]))
+        except FileNotFoundError:
+            pass
+
+    def _load_manifest(self):
+        """
+        Loads the manifest, starting afresh if it's missing or unreadable.
+        """
+        try:
+            with open(os.path.join(self.cache_dir, self.MANIFEST)) as minion:
+                self.entries = json.loads(minion.read())["entries"]
+        except (IOError, ValueError, KeyError):
+            self.entries = {}
+
+    def _save_manifest(self):
+        path = os.path.join(self.cache_dir, self.MANIFEST)
+        with open(path + ".tmp", "w") as minion:
+            minion.write(json.dumps({"entries": self.entries}))
+        os.replace(path + ".tmp", path)
+
+class QueryCache(object):
+    """
+    Persistent store of the InfluxDB query results, see `Influx`.
+
+    Every entry is keyed by the normalized query text, and is kept as a
+    compressed .npz of the result times and (n, 4) array. A query whose
+    upper time bound is over `settle` seconds in the past is of a closed
+    range, and is kept until evicted. Any other query may see new points,
+    and expires after `ttl` seconds. The entries are listed in a JSON
+    manifest, which is used to evict the least recently used entries past
+    `max_bytes`, as in `FeatureCache`.
+
+    This class assumes that the cache is located in /data/_inertial_db/_queries
+    directory. This behaviour may be changed by changing the constant CACHE_DIR.
+    """
+
+    CACHE_DIR = "/data/_inertial_db/_queries/"
+    MANIFEST = "manifest.json"
+
+    def __init__(self, cache_dir = None, max_bytes = 1024 ** 3, ttl = 60, settle = 300):
+        """
+        Args:
+            cache_dir (str): Cache directory. Default: CACHE_DIR.
+            max_bytes (int): Size bound of the entries on disk, in bytes.
+            ttl (float): Lifetime (seconds) of the open range queries.
+            settle (float): Age (seconds) past which a range is closed.
+        """
+        self.cache_dir = cache_dir or self.CACHE_DIR
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.settle = settle
+        self.lock = threading.RLock()
+        os.makedirs(self.cache_dir, exist_ok = True)
+        self._load_manifest()
+
+    def get(self, query):
+        """
+        Returns the cached result of a query.
+
+        Args:
+            query (str): InfluxQL query.
+        Returns:
+            (tuple or None): The times (int64, nanoseconds) and the (n, 4)
+                array, None if not cached or expired.
+        """
+
+        key = self._key(query)
+
+        with self.lock:
+            meta = self.entries.get(key)
+
+            if meta is None:
+                return None
+
+            if meta["expires"] is not None and meta["expires"] < time.time():
+                self._drop(key)
+                self._save_manifest()
+                return None
+
+            try:
+                with np.load(os.path.join(self.cache_dir, meta["file"])) as dat:
+                    out = dat["stamps"], dat["block"]
+            except (IOError, ValueError, KeyError):
+                self._drop(key)
+                self._save_manifest()
+                return None
+
+            meta["accessed"] = time.time()
+            self._save_manifest()
+
+        return out
+
+    def put(self, query, stamps, block, time_upper = None):
+        """
+        Stores the result of a query.
+
+        Args:
+            query (str): InfluxQL query.
+            stamps (numpy.ndarray): Result times, int64 nanoseconds.
+            block (numpy.ndarray): Result array, shaped (n, 4).
+            time_upper (int or str): Upper time bound of the query, epoch
+                nanoseconds or an InfluxDB format string. None if open ended.
+        """
+
+        key = self._key(query)
+        file_name = key + ".npz"
+        path = os.path.join(self.cache_dir, file_name)
+
+        #: Written aside and renamed, hence readers never see partial entries.
+        with open(path + ".tmp", "wb") as minion:
+            np.savez_compressed(minion, stamps = stamps, block = block)
+        os.replace(path + ".tmp", path)
+
+        with self.lock:
+            self.entries[key] = {
+                "query": self._normalize(query),
+                "file": file_name,
+                "bytes": os.path.getsize(path),
+                "accessed": time.time(),
+                "expires": None if self._closed(time_upper) else time.time() + self.ttl,
+            }
+
+            self.evict()
+
+    def invalidate(self):
+        """
+        Removes all the entries.
+
+        Returns:
+            (int): Number of entries removed.
+        """
+
+        with self.lock:
+            keys = list(self.entries)
+
+            for key in keys:
+                self._drop(key)
+            self._save_manifest()
+
+        return len(keys)
+
+    def evict(self):
+        """
+        Removes the expired entries, and the least recently used entries until
+        the rest fit in `max_bytes`.
+        """
+
+        with self.lock:
+            now = time.time()
+
+            for key in [_ for _, meta in self.entries.items() if meta["expires"] is not None and meta["expires"] < now]:
+                self._drop(key)
+
+            lru = sorted(self.entries, key = lambda _: self.entries[_]["accessed"])
+            size = sum(self.entries[_]["bytes"] for _ in lru)
+
+            while lru and size > self.max_bytes:
+                key = lru.pop(0)
+                size -= self.entries[key]["bytes"]
+                self._drop(key)
+
+            self._save_manifest()
+
+    def _closed(self, time_upper):
+        """
+        Whether the range ending at `time_upper` no longer receives points.
+        """
+
+        if time_upper is None:
+            return False
+
+        if isinstance(time_upper, numbers.Integral):
+            upper = int(time_upper) / 1e9
+        else:
+            base = str(time_upper).rstrip("Z").split(".")[0].replace("T", " ")
+            try:
+                upper = calendar.timegm(time.strptime(base, "%Y-%m-%d %H:%M:%S"))
+            except ValueError:
+                return False
+
+        return upper < time.time() - self.settle
+
+    def _normalize(self, query):
+        """
+        Collapses the whitespace and the trailing semicolon of a query.
+        """
+        return " ".join(query.split()).rstrip(";").strip()
+
+    def _key(self, query):
+        """
+        File name safe key of the entry.
+        """
+        return hashlib.sha1(self._normalize(query).encode()).hexdigest()
+
+    def _drop(self, key):
+        """
+        Removes an entry and its file. The manifest is not saved.
+        """
+        meta = self.entries.pop(key)
+        try:
+            os.remove(os.path.join(self.cache_dir, meta["file"]))
+        except FileNotFoundError:
+            pass
+
+    def _load_manifest(self):
+        """
+        Loads the manifest, starting afresh if it's missing or unreadable.
+        """
+        try:
+            with open(os.path.join(self.cache_dir, self.MANIFEST)) as minion:
+                self.entries = json.loads(minion.read())["entries"]
+        except (IOError, ValueError, KeyError):
+            self.entries = {}
+
+    def _save_manifest(self):
+        path = os.path.join(self.cache_dir, self.MANIFEST)
+        with open(path + ".tmp", "w") as minion:
+            minion.write(json.dumps({"entries": self.entries}))
+        os.replace(path + ".tmp", path)
+
+def ChainFeatures(tag, cache = None, window_len = WINDOWLEN, step = STEP, jobs = 1, prefetch = 256, limit = None,
+                  store_dir = None):
+    """
+    Feature Matrix of the windows of `tag` across the datasets, in the order
+    of `ChainProbes`. The per dataset matrices are loaded from `cache`, if
+    given, and computed (and stored) otherwise. They're cached under the
+    source of the dataset, hence the features of a converted (float32)
+    dataset are kept apart from those of its raw files.
+
+    The windows are read through `ChainProbes`, whose reader threads
+    prefetch them while the features of the previous ones are computed.
+    With `limit`, only the leading windows are read when nothing is cached,
+    and the datasets past the limit are neither read nor cached otherwise.
+
+    Args:
+        tag (str): Label tag.
+        cache (FeatureCache): Feature cache. Default: None, nothing is cached.
+        window_len (int): Samples per window.
+        step (int): Samples between consecutive windows.
+        jobs (int): Number of worker processes computing the features.
+        prefetch (int): Windows buffered per dataset, see `ChainProbes`.
+        limit (int): Number of leading windows. Default: None, all of them.
+        store_dir (str): Store directory of the converted datasets.
+            Default: ColumnStore.STORE_DIR.
+    Returns:
+        (numpy.ndarray): Feature Matrix, shaped (N, 5), or (limit, 5).
+    """
+
+    if cache is None:
+        click.echo("Computing {0}".format(tag))
+        return _featurise(ChainProbes(tag, window_len, step, prefetch, store_dir = store_dir), jobs, tag, limit)
+
+    version = Routines.feature_version()
+    out = [np.empty((0, 5))]
+    count = 0
+
+    for probe in Datasets(store_dir):
+        if not probe.provides(tag):
+            continue
+
+        if limit is not None and count >= limit:
+            break
+
+        label = "{0} {1}".format(probe.NAME, tag)
+        compute = lambda: _featurise(
+            ChainProbes(tag, window_len, step, prefetch, datasets = [probe], store_dir = store_dir), jobs, label)
+
+        ftr = cache.get_or_compute(probe.source, tag, window_len, step, version, compute)
+        ftr = ftr if limit is None else ftr[:limit - count]
+        count += len(ftr)
+        out.append(ftr)
+
+    return np.vstack(out)
+
+def SampledFeatures(tag, sampler, ids, cache = None, jobs = 1):
+    """
+    Feature Matrix of the windows of `tag` drawn by a `WindowSampler`. The
+    rows of the datasets in `cache` are looked up, and only the sampled
+    windows of the others are read and featurised. Nothing is cached, as
+    the matrices of a sample are partial.
+
+    Args:
+        tag (str): Label tag.
+        sampler (WindowSampler): The sampler `ids` were drawn by.
+        ids (numpy.ndarray): Window numbers, see `WindowSampler.draw`.
+        cache (FeatureCache): Feature cache. Default: None.
+        jobs (int): Number of worker processes computing the features.
+    Returns:
+        (numpy.ndarray): Feature Matrix, shaped (len(ids), 5).
+    """
+
+    index = sampler.index
+    version = Routines.feature_version()
+    out = np.empty((len(ids), 5))
+    missing = np.ones(len(ids), dtype = bool)
+
+    for probe, mask, rows in sampler.split(tag, ids):
+        cached = None if cache is None else cache.get(probe.source, tag, index.window_len, index.step, version)
+
+        if cached is not None and len(cached) == index.count(probe.NAME, tag):
+            out[mask] = cached[rows]
+            missing[mask] = False
+
+    if missing.any():
+        out[missing] = Routines.feature_vector_parallel(sampler.windows(tag, ids[missing]), jobs, label = tag)
+
+    return out
+
+def _featurise(windows, jobs, label, limit = None, chunk_size = 1024):
+    """
+    Feature Matrix of a stream of windows. On a single job, the windows
+    are featurised a chunk at a time, as they are read.
+
+    Args:
+        windows (generator): Windows, shaped (window_len, 3).
+        jobs (int): Number of worker processes computing the features.
+        label (str): Progress label.
+        limit (int): Windows read, at most. Default: None, all of them.
+        chunk_size (int): Windows per chunk.
+    Returns:
+        (numpy.ndarray): Feature Matrix, shaped (N, 5).
+    """
+
+    stream = windows if limit is None else itertools.islice(windows, limit)
+
+    try:
+        if jobs > 1:
+            block = list(stream)
+            if not block:
+                return np.empty((0, 5))
+            return Routines.feature_vector_parallel(block, jobs, chunk_size, label = label)
+
+        out = [np.empty((0, 5))]
+        chunk = list(itertools.islice(stream, chunk_size))
+
+        while chunk:
+            out.append(Routines.feature_vector_batch(np.asarray(chunk, dtype = np.float64), chunk_size))
+            chunk = list(itertools.islice(stream, chunk_size))
+
+        return np.vstack(out)
+    finally:
+        #: Stops the reader threads of a stream left unfinished.
+        windows.close()
@@ -28,45 +28,253 @@ from itertools import chain
 from pandas.tools.plotting import lag_plot, autocorrelation_plot
 from pandas.tools.plotting import parallel_coordinates, andrews_curves, scatter_matrix, radviz
 
-from .udp import UDP
+from .udp import UDP, AsyncUDP, Sessions
 from .influx import Influx
+from .points import BufferedWriter
+from .timeseries import Backend
 from .helper import Helper
 from .helper import Stupidity
 from .helper import Tools
-from .routines import Routines
+from .routines import Routines, FeatureStream, Inference
+from .cache import FeatureCache, QueryCache, ChainFeatures, SampledFeatures
+from .sample_dump import ColumnStore, WindowSampler, UCI, Twenté, TwentéTwo
 from .sample_dump import ChainProbes, LabelDict, Labels, LabelDictC, LabelsC, LabelDictD, LabelsD, LabelDictE, LabelsE
 
 from grafana_annotation_server.cli import Annotation
 
-buffer = []
-
 @click.group()
+@click.option('--backend',
+    type = str,
+    default = None,
+    help = "Time series backend, `influx` or `local[:<directory>]`. Default: $INERTIAL_BACKEND, or `influx`."
+)
 @click.pass_context
-def main(ctx):
+def main(ctx, backend):
     """
     """
-    pass
+    ctx.obj = backend
+
+def cache_options(func):
+    """
+    Decorator function, adds the feature cache options to a command.
+    """
+    func = click.option('--no-cache', is_flag = True, default = False,
+        help = "Recomputes the features, bypassing the feature cache."
+    )(func)
+    func = click.option('--cache-dir',
+        type = click.Path(file_okay = False),
+        default = None,
+        help = "Feature cache directory. Default: {0}".format(FeatureCache.CACHE_DIR)
+    )(func)
+    return func
+
+def store_options(func):
+    """
+    Decorator function, adds the columnar store directory option to a command.
+    """
+    return click.option('--store-dir',
+        type = click.Path(file_okay = False),
+        default = None,
+        help = "Columnar store directory. Default: {0}".format(ColumnStore.STORE_DIR)
+    )(func)
+
+def query_cache_options(func):
+    """
+    Decorator function, adds the InfluxDB query cache options to a command.
+    """
+    func = click.option('--no-query-cache', is_flag = True, default = False,
+        help = "Queries the InfluxDB every time, bypassing the query cache."
+    )(func)
+    func = click.option('--query-cache-dir',
+        type = click.Path(file_okay = False),
+        default = None,
+        help = "Query cache directory. Default: {0}".format(QueryCache.CACHE_DIR)
+    )(func)
+    return func
+
+def batch_options(func):
+    """
+    Decorator function, adds the InfluxDB write batching and spooling options to a command.
+    """
+    func = click.option('--fsync',
+        type = click.Choice(['always', 'interval', 'never']),
+        default = 'interval',
+        help = "When the spool is synced to disk: every write, every flush interval, or never."
+    )(func)
+    func = click.option('--spool-dir',
+        type = click.Path(file_okay = False),
+        default = None,
+        help = "Spools the points in this directory, and writes them to the InfluxDB in the background."
+    )(func)
+    func = click.option('--flush-interval',
+        type = float,
+        default = BufferedWriter.FLUSH_INTERVAL,
+        help = "Longest time (seconds) a point is kept before being written."
+    )(func)
+    func = click.option('--batch-size',
+        type = int,
+        default = BufferedWriter.BATCH_SIZE,
+        help = "Points written to the InfluxDB per request. 1 disables batching."
+    )(func)
+    return func
+
+def server_options(func):
+    """
+    Decorator function, adds the UDP server options to a command.
+    """
+    func = click.option('--rcvbuf',
+        type = int,
+        default = AsyncUDP.RCVBUF,
+        help = "Socket receive buffer (SO_RCVBUF) in bytes, capped by the system (net.core.rmem_max on Linux)."
+    )(func)
+    func = click.option('--budget',
+        type = int,
+        default = 64,
+        help = "Most datagrams received per wakeup of the socket, and handled as a batch."
+    )(func)
+    func = click.option('--report',
+        type = float,
+        default = None,
+        help = "Seconds between the server metrics (packets per second, drops) printed on stderr."
+    )(func)
+    func = click.option('--threads',
+        type = int,
+        default = 1,
+        help = "Threads running the handler concurrently, off the receive loop, the devices split among them. "
+               "0 runs it on the loop."
+    )(func)
+    func = click.option('--queue-size',
+        type = int,
+        default = 4096,
+        help = "Datagrams held between receive and processing. The ones past it are dropped."
+    )(func)
+    return func
+
+def writer_status(influx_client):
+    """
+    Formats the write queue depth and flush latency of the Influx client.
+    """
+    metrics = influx_client.metrics()
+    if metrics is None:
+        return ""
+    out = " queue: {0} flush: {1:.1f}ms".format(metrics["depth"], metrics["last_flush_seconds"] * 1000)
+    if "spool_bytes" in metrics:
+        out += " spool: {0}B lag: {1:.1f}s".format(metrics["spool_bytes"], metrics["lag_seconds"])
+    return out
 
 @main.command()
-def scratch_f():
+@click.option('--port', '-p',
+    type = int,
+    required = True,
+    prompt = True,
+    help = "UDP Broadcast Port Number"
+)
+@batch_options
+@server_options
+@click.pass_obj
+def log_udp(backend, port, batch_size, flush_interval, spool_dir, fsync, queue_size, threads, report, budget, rcvbuf):
+    """
+    Logs the raw sensor data incoming through UDP in the InfluxDB.
+    """
+    mmt_class = Helper.gather_class()
+
+    influx_client = Backend(backend, batch_size = batch_size, flush_interval = flush_interval,
+                            spool_dir = spool_dir, fsync = fsync)
+
+    @UDP.handler
+    def put_in(**kwargs):
+        if 'block' in kwargs:
+            for dat in kwargs['block']:
+                influx_client.write(dat, mmt_class, dat.unix_time)
+            click.secho('\rLogging: {0}{1}'.format(next(Helper.pool), writer_status(influx_client)), nl = False)
+
+    try:
+        UDP.start_async('', port, queue_size = queue_size, executor = threads, report = report,
+                        budget = budget, rcvbuf = rcvbuf, blocks = True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        influx_client.close()
+        click.echo("\n{0}".format(influx_client.metrics()))
+
+@main.command()
+@click.argument('csv', type = click.File('r'))
+@batch_options
+@click.pass_obj
+def log_csv(backend, csv, batch_size, flush_interval, spool_dir, fsync):
+    """
+    Logs the CSV formatted sensor data in the InfluxDB.
+    """
+    mmt_class = Helper.gather_class()
+
+    influx_client = Backend(backend, batch_size = batch_size, flush_interval = flush_interval,
+                            spool_dir = spool_dir, fsync = fsync)
+
+    probes = {
+        'accelerometer': ['Accel_X', 'Accel_Y', 'Accel_Z'],
+        'gyroscope':     ['RotRate_X', 'RotRate_Y', 'RotRate_Z'],
+        'magnetometer':  ['MagX', 'MagY', 'MagZ'],
+        'ahrs':          ['Roll', 'Pitch', 'Yaw'],
+    }
+
+    #: Only the used columns are parsed, a chunk of rows at a time.
+    for chunk in Helper.load_csv_chunks(csv, list(chain(*probes.values()))):
+        block = {_: np.column_stack([chunk[c] for c in cols]).tolist() for _, cols in probes.items()}
+
+        for row in zip(*block.values()):
+            influx_client.write(dict(zip(block, row)), mmt_class)
+
+        click.secho('\rLogging: {0}{1}'.format(next(Helper.pool), writer_status(influx_client)), nl = False)
+
+    influx_client.close()
+
+@main.command()
+@click.option('--batch-size',
+    type = int,
+    default = 5000,
+    help = "Rows written to the InfluxDB per request."
+)
+@click.option('--jobs', '-j',
+    type = int,
+    default = 1,
+    help = "Number of writer threads."
+)
+@click.option('--checkpoint',
+    type = click.Path(dir_okay = False),
+    default = None,
+    help = "Checkpoint file, the import resumes from it. Default: <JSON_DUMP>.checkpoint"
+)
+@click.argument('json_dump', type = click.File('r'))
+@click.pass_obj
+def influx_import(backend, json_dump, batch_size, jobs, checkpoint):
+    """
+    Imports an InfluxDB JSON query dump.
+    """
+
+    if checkpoint is None and json_dump.name != '<stdin>':
+        checkpoint = json_dump.name + ".checkpoint"
+
+    influx_client = Backend(backend)
+    if (influx_client.import_json(json_dump, batch_size = batch_size, jobs = jobs, checkpoint = checkpoint)):
+        click.echo("Import Successful")
+
+    else:
+        click.echo("Import Unsuccessful")
+
+@main.command()
+@cache_options
+@store_options
+def scratch_f(cache_dir, no_cache, store_dir):
     plt.figure()
     # plt.style.use(['bmh','ggplot'])
     # plt.xkcd()
     ftr = []
+    cache = None if no_cache else FeatureCache(cache_dir)
 
     lab = ["WALKING", "RUNNING", "JOGGING", "SITTING", "BIKING", "WALKING_UPSTAIRS"]
     for i in lab:
-        w = ChainProbes(i)
-        fv_pr = []
-        c = 0
         print(i)
-        for row in w:
-            c += 1
-            if c == 1000:
-                break
-            f = Routines.feature_vector(zip(*row)) + [i]
-            #print(f)
-            ftr.append(f)
+        ftr += [list(_) + [i] for _ in ChainFeatures(i, cache, limit = 999, store_dir = store_dir)]
 
     hdr = ["w_e", "tssq", "gradient", "gradient_binned", "moving_mean", "Name"]
 
@@ -80,8 +288,21 @@ def scratch_f():
     # plt.show()
 
 @main.command()
+@cache_options
+@store_options
+@click.option('--jobs', '-j',
+    type = int,
+    default = 1,
+    help = "Number of worker processes computing the features."
+)
+@click.option('--sample', '-n',
+    type = int,
+    default = None,
+    help = "Draws this many random windows per label from the converted datasets, instead of the leading ones."
+)
+@click.option('--seed', type = int, default = 0, help = "Random seed of --sample.")
 @click.argument('dmp', type=click.File('wb'))
-def train_tree(dmp):
+def train_tree(dmp, cache_dir, no_cache, store_dir, jobs, sample, seed):
 
     click.echo("😐  Creating features.")
 
@@ -89,21 +310,21 @@ def train_tree(dmp):
     Y = []
 
     lab_use, lab_use_dict = LabelsE, LabelDictE
+    cache = None if no_cache else FeatureCache(cache_dir)
 
     cnts = []
 
+    sampler = None if sample is None else WindowSampler(seed = seed, store_dir = store_dir)
+
     for i in lab_use_dict:
-        w = ChainProbes(i)
-        fv_pr = []
-        c = 0
-        for row in w:
-            c += 1
-            if c == 2000:
-                break
-            X.append(Routines.feature_vector(zip(*row)))
-            Y.append(int(lab_use_dict[i]))
-        cnts.append([i, c, lab_use_dict[i]])
-        print([i, c, lab_use_dict[i]])
+        if sampler is None:
+            ftr = ChainFeatures(i, cache, jobs = jobs, limit = 1999, store_dir = store_dir)
+        else:
+            ftr = SampledFeatures(i, sampler, sampler.draw(i, sample), cache, jobs = jobs)
+        X += list(ftr)
+        Y += [int(lab_use_dict[i])] * len(ftr)
+        cnts.append([i, len(ftr), lab_use_dict[i]])
+        print([i, len(ftr), lab_use_dict[i]])
 
     print(cnts)
 
@@ -128,6 +349,53 @@ def train_tree(dmp):
 
     pickle.dump(DRS, dmp)
 
+@main.group()
+def dataset():
+    """
+    Manages the binary columnar copies of the datasets.
+    """
+    pass
+
+@dataset.command()
+@store_options
+def convert(store_dir):
+    """
+    Converts the raw dataset files into the binary columnar format, once.
+    """
+    for source in (UCI, Twenté, TwentéTwo):
+        click.echo("Converting {0}".format(source.NAME))
+        count = ColumnStore.convert(source(columnar = False), store_dir)
+        click.echo("Stored {0} samples.".format(count))
+
+@main.command()
+@click.option('--dataset', type = str, default = None, help = "Dataset Name. Default: all.")
+@click.option('--tag', type = str, default = None, help = "Label tag. Default: all.")
+@click.option('--cache-dir',
+    type = click.Path(file_okay = False),
+    default = None,
+    help = "Feature cache directory. Default: {0}".format(FeatureCache.CACHE_DIR)
+)
+@click.option('--queries', is_flag = True, default = False,
+    help = "Removes all the cached InfluxDB query results instead."
+)
+@click.option('--query-cache-dir',
+    type = click.Path(file_okay = False),
+    default = None,
+    help = "Query cache directory. Default: {0}".format(QueryCache.CACHE_DIR)
+)
+def cache_invalidate(dataset, tag, cache_dir, queries, query_cache_dir):
+    """
+    Removes the cached features, or the cached query results.
+    """
+    if queries:
+        count = QueryCache(query_cache_dir).invalidate()
+        click.echo("Removed {0} cached query results.".format(count))
+        return
+
+    fields = {_: __ for _, __ in [("dataset", dataset), ("tag", tag)] if __ is not None}
+    count = FeatureCache(cache_dir).invalidate(**fields)
+    click.echo("Removed {0} cached feature sets.".format(count))
+
 @main.command()
 @click.option('--port', '-p',
     type = int,
@@ -135,28 +403,63 @@ def train_tree(dmp):
     prompt = True,
     help = "UDP Broadcast Port Number"
 )
+@click.option('--idle',
+    type = float,
+    default = 60.0,
+    help = "Seconds of silence after which the session of a device is dropped."
+)
+@click.option('--max-latency',
+    type = float,
+    default = None,
+    help = "Seconds after which a window still waiting for the classifiers is dropped. "
+           "Default: every window is classified."
+)
+@server_options
 @click.argument('dmp', type=click.File('rb'))
-def f_test(dmp, port):
+def f_test(dmp, port, idle, max_latency, queue_size, threads, report, budget, rcvbuf):
+    """
+    Classifies the live streams of many devices, each on its own windows.
+
+    A window is emitted every STEP samples of a device, and classified by
+    a background thread, off the receive path.
+    """
     DRS = pickle.load(dmp)
 
-    @UDP.handler
-    def svm_test(**kwargs):
-        global buffer
-        if 'dat' in kwargs:
-            click.echo(".", nl=False)
-            buffer.append(kwargs['dat']['accelerometer'])
+    def dropped(session):
+        click.echo("{0}: idle, session dropped".format(device_name(session.device)), err = True)
 
-        if len(buffer) == 100:
-            buf_ftr = Routines.feature_vector(zip(*buffer))
+    sessions = Sessions(lambda device: FeatureStream(), idle = idle, on_evict = dropped)
 
-            out = []
+    def device_name(device):
+        return "{0}:{1}".format(*device) if isinstance(device, tuple) else "device {0}".format(device)
 
-            for clsfr in DRS:
-                out.append(clsfr.predict(buf_ftr))
+    def predicted(device, out, latency):
+        click.echo("{0}: {1}".format(device_name(device), out))
 
-            print(out)
+    inference = Inference(DRS, predicted, max_latency = max_latency)
 
-    UDP.start_routine('', port)
+    @UDP.handler
+    def svm_test(**kwargs):
+        if 'block' not in kwargs:
+            return
+
+        session = sessions.get(kwargs['device'])
+
+        with session.lock:
+            features = session.state.extend(kwargs['block']['accelerometer'])
+
+        for buf_ftr in features:
+            inference.put(kwargs['device'], buf_ftr)
+
+    try:
+        UDP.start_async('', port, queue_size = queue_size, executor = threads, report = report,
+                        budget = budget, rcvbuf = rcvbuf, blocks = True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        inference.close()
+        click.echo("Sessions: {0}".format(sessions.metrics()), err = True)
+        click.echo("Inference: {0}".format(inference.metrics()), err = True)
 
 if __name__ == "__main__":
     main()
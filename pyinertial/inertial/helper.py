@@ -5,12 +5,14 @@
 """
 
 import click
+import itertools
 import math
 import time
 import numpy as np
 import matplotlib.pyplot as plt
 import inspect
 
+from numpy.lib.stride_tricks import as_strided
 from scipy.optimize import curve_fit
 from scipy.signal import argrelmax, argrelmin
 from sklearn.metrics import confusion_matrix, accuracy_score, classification_report
@@ -90,6 +92,79 @@ class Helper(object):
                 dat_map = {column_headers[i]: float(column_data[i]) for i in range(0, len(column_headers))}
                 yield dat_map
 
+    @staticmethod
+    def load_csv_chunks(handle, columns = None, chunk_size = 65536, column_delim = ","):
+        """
+        Loads the CSV data in chunks of column arrays. The columns are read from
+        the first line of the CSV data file, like `load_csv`. Only `chunk_size`
+        rows are held in memory at once, hence files larger than the memory can
+        be streamed.
+        Rows with a wrong number of fields, or with non-float data in the
+        selected columns, are skipped.
+
+        Args:
+            handle (File): File handler. The handle should be opened as "r", or "rw".
+            columns (list): Names of the columns to load. Default: all of them.
+            chunk_size (int): Rows per chunk.
+            column_delim (str): Column Delimiter Symbol. Default: ",".
+        Returns:
+            (generator): Dicts mapping the column names to numpy.ndarray chunks.
+        Raises:
+            ValueError: A column is not in the CSV header.
+        """
+
+        # Reach the beginning of the file
+        handle.seek(0)
+
+        column_headers = handle.readline().rstrip().split(column_delim)
+        columns = column_headers if columns is None else list(columns)
+
+        if not set(columns) <= set(column_headers):
+            raise ValueError("Unknown columns: {0}".format(set(columns) - set(column_headers)))
+
+        indices = [column_headers.index(_) for _ in columns]
+
+        while True:
+            lines = list(itertools.islice(handle, chunk_size))
+            if not lines:
+                break
+
+            rows = [_.rstrip().split(column_delim) for _ in lines]
+            rows = [[_[i] for i in indices] for _ in rows if len(_) == len(column_headers)]
+
+            try:
+                #: NumPy parses the whole chunk of strings at once.
+                data = np.array(rows, dtype = np.float64).reshape(-1, len(columns))
+            except ValueError:
+                #: Malformed data in the chunk, falls back to parsing it row by row.
+                data = []
+                for row in rows:
+                    try:
+                        data.append([float(_) for _ in row])
+                    except ValueError:
+                        pass
+                data = np.array(data, dtype = np.float64).reshape(-1, len(columns))
+
+            yield {_: data[:, i] for i, _ in enumerate(columns)}
+
+    @staticmethod
+    def load_csv_columns(handle, columns = None, column_delim = ","):
+        """
+        Loads the whole CSV data as column arrays. See `load_csv_chunks`.
+
+        Returns:
+            (dict): Maps the column names to numpy.ndarray.
+        """
+
+        chunks = list(Helper.load_csv_chunks(handle, columns, column_delim = column_delim))
+
+        if not chunks:
+            handle.seek(0)
+            columns = columns or handle.readline().rstrip().split(column_delim)
+            return {_: np.empty(0) for _ in columns}
+
+        return {_: np.concatenate([__[_] for __ in chunks]) for _ in chunks[0]}
+
     @staticmethod
     def autocorrelation(x):
         """
@@ -108,53 +183,44 @@ class Helper(object):
     def discreet_wave_energy(l):
         """
         Finds the Discrete Wave energry (extrapolated points).
+        For every adjacent pair of points (a, b), the absolute area below the
+        line (b - a)x - a is summed with a left Riemann sum of STEP_CNT steps
+        of width 1 / STEP_CNT over x in [0, 1).
+        The line is linear, so |line| changes sign at most once and the sum is
+        evaluated in closed form from the partial sums on either side of the
+        root. It agrees with the stepped sum up to floating point rounding
+        (relative error below 1e-12).
 
         Args:
-            l (list): Points
+            l (list or numpy.ndarray): Points. A 2-D array is treated as
+                (windows x samples), and the energy is found per window.
 
         Returns:
-            (float): Energy Representation
+            (float or numpy.ndarray): Energy Representation
         """
 
-        def area_under(a, b):
-            """
-            Calculates absolute area contained below a straight line joining a and b from a to b.
-            Mathematically, this is Integral(|line(x, a, b)|)dx from a to b.
-            The integral is calculated numerically, with the precision defined by STEP_VAL (default: 0.01).
-            STEP_VAL can be decreased for increased precision, however, it has number of times while loop is ran is 1/STEP_VAL, hence, this parameter must be changed manually - directly in source.
-            Args:
-                a (float): y1 value
-                b (float): y2 value
-            Returns:
-                (float) Area
-            """
-
-            def line(x):
-                """
-                Using two - point equation for the straight line
-                x1, and x2 are assumed to be 0 and 1 respectively due to parent.
-                y - a = (b - a)x
-                Args:
-                    x (float): function variable
-                Returns:
-                    (float) y value at x
-                """
-                return ((b - a) * x - a)
+        STEP_CNT = 100
 
-            STEP_VAL = 0.01
+        l = np.asarray(l, dtype = np.float64)
+        a = l[..., :-1]
+        c = np.diff(l, axis = -1)
 
-            area = 0
-            x = 0
-
-            while x <= 1:
-                area += STEP_VAL * abs(line(x))
-                x += STEP_VAL
+        def partial_sum(m):
+            """
+            Sum of line(k / STEP_CNT) for k in [0, m).
+            """
+            return c * m * (m - 1) / (2 * STEP_CNT) - m * a
 
-            return area
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            root = STEP_CNT * a / c
+            #: Steps below the root where the line is negative.
+            neg_rising = partial_sum(np.clip(np.ceil(root), 0, STEP_CNT))
+            neg_falling = partial_sum(STEP_CNT) - partial_sum(np.clip(np.floor(root) + 1, 0, STEP_CNT))
 
-        pairs = zip(l[0::], l[1::])
+        neg = np.where(c > 0, neg_rising, np.where(c < 0, neg_falling, 0))
+        area = np.where(c == 0, np.abs(a) * STEP_CNT, partial_sum(STEP_CNT) - 2 * neg) / STEP_CNT
 
-        return sum([area_under(*_) for _ in pairs])
+        return area.sum(axis = -1)
 
     @staticmethod
     def sine_wave_energy(m, n, a, b, c, d):
@@ -171,11 +237,23 @@ class Helper(object):
     @staticmethod
     def sliding_window(sequence, win_size, step = 1):
         """
-        Returns a generator that will iterate through
-        the defined chunks of input sequence.
-        Input sequence must be iterable.
+        Returns a read-only strided view of the overlapping windows of the input
+        sequence. The windows share the memory of the sequence, so the overlap
+        costs nothing: only a list (or other non-array) input is copied, once.
+
+        Args:
+            sequence (list or numpy.ndarray): Samples, shaped (len,) or (len, channels).
+            win_size (int): Samples per window.
+            step (int): Samples between the start of consecutive windows.
+        Returns:
+            (numpy.ndarray): Windows, shaped (num_windows, win_size) or
+                (num_windows, win_size, channels).
+        Raises:
+            ValueError: step is larger than win_size, or win_size is larger than the sequence.
         """
 
+        sequence = np.asarray(sequence)
+
         if step > win_size:
             raise ValueError("step should be lesser than win_size")
         if win_size > len(sequence):
@@ -183,11 +261,25 @@ class Helper(object):
 
         # Pre-compute number of chunks to emit
         num_of_chunks = int((len(sequence) - win_size) / step) + 1
-        # print(num_of_chunks)
 
-        # Do the work
-        for i in range(0, num_of_chunks * step, step):
-            yield sequence[i:i + win_size]
+        return as_strided(sequence,
+                          shape = (num_of_chunks, win_size) + sequence.shape[1:],
+                          strides = (sequence.strides[0] * step, ) + sequence.strides,
+                          writeable = False)
+
+    @staticmethod
+    def worker_progress(label, done, total):
+        """
+        Shows the progress of a task shared by worker processes, in place.
+
+        Args:
+            label (str): Task label.
+            done (dict): Units of work done, per worker id.
+            total (int): Units of work in the task.
+        """
+
+        workers = " ".join("[{0}: {1}]".format(_, done[_]) for _ in sorted(done))
+        click.echo("\r{0}: {1}/{2} {3}".format(label, sum(done.values()), total, workers), nl = False)
 
     @staticmethod
     def pooled_variance(sequence):
@@ -323,32 +415,59 @@ class Stupidity(object):
             (float): Frechet Distance
         """
 
-        def _c(ca, i, j, P, Q):
-            """
-            Calculates the infinite norm of matrix `ca` recursively. The norm is the coupling here.
-            """
+        return float(Stupidity.frechet_dist_batch([P], Q, remap)[0])
+
+    @staticmethod
+    def frechet_dist_batch(Ps, Q, remap = True):
+        """
+        Computes the discrete frechet distance between each of the polygonal
+        lines in `Ps` and the polygonal line `Q`.
+
+        The coupling matrix is filled bottom-up, one anti-diagonal at a time:
+        every cell of an anti-diagonal only depends on the previous two, so
+        each of them is computed as a single vector over all the lines in `Ps`.
+        Only the last two anti-diagonals are kept, hence memory is linear in
+        the length of the lines, and there's no recursion.
+
+        Args:
+            Ps (list): Polygon lines, all of the same length. See `frechet_dist`.
+            Q (list or list of touples): Polygon line. See `frechet_dist`.
+            remap (bool, default: True): See `frechet_dist`.
+        Returns:
+            (numpy.ndarray): Frechet Distance per line in `Ps`.
+        Raises:
+            ValueError: Ps and Q are not comparable.
+        """
 
-            if ca[i, j] > -1:
-                return ca[i, j]
-            elif i == 0 and j == 0:
-                ca[i, j] = Stupidity.euc_dist(P[0], Q[0])
-            elif i > 0 and j == 0:
-                ca[i, j] = max(_c(ca, i - 1, 0, P, Q), Stupidity.euc_dist(P[i], Q[0]))
-            elif i == 0 and j > 0:
-                ca[i, j] = max(_c(ca, 0, j - 1, P, Q), Stupidity.euc_dist(P[0], Q[j]))
-            elif i > 0 and j > 0:
-                ca[i, j] = max(min(_c(ca, i - 1, j, P, Q), _c(ca, i - 1, j - 1, P, Q), _c(ca, i, j - 1, P, Q)), Stupidity.euc_dist(P[i], Q[j]))
-            else:
-                ca[i, j] = float("inf")
-            return ca[i, j]
+        Ps = np.asarray(Ps, dtype = np.float64)
+        Q  = np.asarray(Q, dtype = np.float64)
 
         if remap:
-            P = list(zip(range(len(P)), P))
-            Q = list(zip(range(len(Q)), Q))
+            Ps = np.stack([np.broadcast_to(np.arange(Ps.shape[1]), Ps.shape), Ps], axis = -1)
+            Q  = np.column_stack([np.arange(len(Q)), Q])
 
-        ca = np.ones((len(P), len(Q)))
-        ca = np.multiply(ca, -1)
-        return _c(ca, len(P) - 1, len(Q) - 1, P, Q)
+        if Ps.ndim != 3 or Q.ndim != 2 or Ps.shape[2] != Q.shape[1]:
+            raise ValueError
+
+        k_cnt, n, m = Ps.shape[0], Ps.shape[1], Q.shape[0]
+
+        #: Couplings of the last two anti-diagonals. Cell (i, j) is stored at
+        #  index i + 1, index 0 stays infinite and stands in for i = -1.
+        prev2 = np.full((k_cnt, n + 1), float("inf"))
+        prev  = np.full((k_cnt, n + 1), float("inf"))
+        prev[:, 1] = np.sqrt(((Ps[:, 0] - Q[0])**2).sum(axis = -1))
+
+        for k in range(1, n + m - 1):
+            #: Cells (i, k - i) for i in [lo, hi).
+            lo, hi = max(0, k - m + 1), min(k, n - 1) + 1
+            d = np.sqrt(((Ps[:, lo:hi] - Q[k - hi + 1:k - lo + 1][::-1])**2).sum(axis = -1))
+
+            cur = np.full((k_cnt, n + 1), float("inf"))
+            cur[:, lo + 1:hi + 1] = np.maximum(np.minimum(np.minimum(prev[:, lo:hi], prev2[:, lo:hi]),
+                                                          prev[:, lo + 1:hi + 1]), d)
+            prev2, prev = prev, cur
+
+        return prev[:, n]
 
     @staticmethod
     def normalise_dist(l):
@@ -428,7 +547,7 @@ class Stupidity(object):
         control_points = Helper.sliding_window(l, 4, 1)
 
         for w in control_points:
-            fun.append([range(w[0][0], w[1][0]), bezier(w)])
+            fun.append([range(int(w[0][0]), int(w[1][0])), bezier(w)])
 
         # for pair in point_pairs:
         #     fun.append([range(pair[0][0], pair[1][0]), cubic_func(*pair)])
@@ -541,7 +660,7 @@ class Stupidity(object):
 class Gradient(object):
 
     def __init__(self, r = 3):
-        self.bins = Gradient.gradient_bin(r)
+        self.boundaries, self.first_bin = Gradient.gradient_boundaries(r)
 
     @staticmethod
     def gradient_bin(r):
@@ -573,28 +692,114 @@ class Gradient(object):
 
         return list(bins)
 
-    def bin(self, m, absolute = False):
+    @staticmethod
+    def gradient_boundaries(r):
         """
+        Creates the sorted lookup table equivalent to `gradient_bin`.
+        Bin `first_bin + i` holds the slopes in [boundaries[i - 1], boundaries[i]),
+        with the outermost bins open towards -inf and inf.
+
+        Args:
+            r (int): Step value in degrees.
+        Returns:
+            (numpy.ndarray, int): Inner interval boundaries, and the first Bin_Number.
         """
-        rule_index = 2 if absolute else 1
 
-        for rule in self.bins:
-            if rule[rule_index](m):
-                return rule[0]
+        boundaries = np.tan(np.radians(r * np.arange(int(-90 / r) + 1, int(90 / r))))
 
-        raise ValueError
+        return boundaries, int(-90 / r)
+
+    def bin(self, m, absolute = False):
+        """
+        Bins a single gradient. See `remap`.
+        """
+        return int(self.remap([m], absolute)[0])
 
     def remap(self, m, absolute = False):
         """
         Remaps m with its corresponding bin values.
+        The whole of m is binned with a single sorted search on the boundaries.
 
         Args:
-            m (list): The list of gradients.
+            m (list or numpy.ndarray): The list of gradients.
             absolute (bool): Bins positive value of gradients (mirror)
         Returns:
-            (list): Binned list.
+            (numpy.ndarray): Binned array.
+        Raises:
+            ValueError: A gradient is NaN, or does not fall in any bin.
+        """
+
+        m = np.asarray(m, dtype = np.float64)
+
+        if absolute:
+            m = np.abs(m)
+
+        #: Only inf and NaN are outside of [-inf, inf).
+        if np.any(np.isnan(m) | (m == float("inf"))):
+            raise ValueError
+
+        return np.searchsorted(self.boundaries, m, side = 'right') + self.first_bin
+
+class RingBuffer(object):
+    """
+    Fixed capacity FIFO of samples, backed by a NumPy array.
+    Every sample is written twice, `capacity` rows apart, hence the latest
+    samples are always available as a single ordered view, without copies.
+    """
+
+    def __init__(self, capacity, width):
+        """
+        Args:
+            capacity (int): Maximum number of samples held.
+            width (int): Number of values per sample.
+        """
+        self.capacity = capacity
+        self.data = np.zeros((2 * capacity, width))
+        #: (int) Next row to be written, in [0, capacity).
+        self.pos = 0
+        #: (int) Number of samples ever written.
+        self.total = 0
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def append(self, sample):
+        """
+        Appends one sample. See `extend`.
+        """
+        self.extend([sample])
+
+    def extend(self, block):
+        """
+        Appends a block of samples, dropping the oldest ones past capacity.
+
+        Args:
+            block (list or numpy.ndarray): Samples, shaped (n, width).
+        """
+        block = np.asarray(block, dtype = np.float64).reshape(-1, self.data.shape[1])
+        self.total += len(block)
+        block = block[-self.capacity:]
+
+        head = min(len(block), self.capacity - self.pos)
+        tail = len(block) - head
+
+        for offset in (0, self.capacity):
+            self.data[offset + self.pos:offset + self.pos + head] = block[:head]
+            self.data[offset:offset + tail] = block[head:]
+
+        self.pos = (self.pos + len(block)) % self.capacity
+
+    def view(self):
+        """
+        Returns the held samples, oldest first.
+
+        Returns:
+            (numpy.ndarray): Read-only view, shaped (len(self), width).
         """
-        return [self.bin(_, absolute) for _ in m]
+        end = self.pos + self.capacity
+        out = self.data[end - len(self):end]
+        out.flags.writeable = False
+        return out
 
 class Tools(object):
     @staticmethod
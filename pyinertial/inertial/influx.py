@@ -3,22 +3,84 @@
 
 import json
 import click
+import math
+import os
+import queue
+import threading
 import time
+import numpy as np
 
-from influxdb import InfluxDBClient
+from concurrent.futures import ThreadPoolExecutor
 from itertools import chain
 from .helper import Helper
+from .points import BufferedWriter, JSONSeries
+from .spool import Spool
 
 class Influx(object):
     """
     Proxy for Influx DB.
     """
 
-    def __init__(self):
+    def __init__(self, batch_size = 1, flush_interval = BufferedWriter.FLUSH_INTERVAL, query_cache = None,
+                 spool_dir = None, fsync = "interval"):
         """
+        Args:
+            batch_size (int): Points written per request. With a batch size
+                above 1, `write` goes through a `BufferedWriter`.
+            flush_interval (float): Longest time (seconds) a point is kept
+                pending by the `BufferedWriter`, or the sync interval of the
+                `Spool`.
+            query_cache (QueryCache): Cache of the query results. With a
+                cache, the database is only contacted once a query misses it,
+                or on a write.
+            spool_dir (str): Directory of a write-ahead `Spool`. With a
+                spool, `write` only appends to it, and the points are written
+                to the database by its drainer thread, in batches of
+                `batch_size` (`BufferedWriter.BATCH_SIZE` if 1).
+            fsync (str): Sync policy of the spool, see `Spool`.
         """
-        self.client = InfluxDBClient('localhost', 8086, 'root', 'root', 'imu_data')
-        self._init_client()
+        self.client = self._connect()
+        self.client_ready = False
+        self.query_cache = query_cache
+
+        if query_cache is None and spool_dir is None:
+            self._init_client()
+
+        self.writer = None
+        self.last_stamp = 0
+        self.stamp_lock = threading.Lock()
+
+        if spool_dir is not None:
+            drain_client = self._connect()
+
+            def sink(points):
+                self._init_client()
+                drain_client.write_points(points, time_precision = 'u')
+
+            self.writer = Spool(spool_dir, sink, batch_size if batch_size > 1 else BufferedWriter.BATCH_SIZE,
+                                fsync, flush_interval)
+
+        elif batch_size > 1:
+            self.writer = BufferedWriter(self.client, batch_size, flush_interval)
+
+    def _connect(self):
+        """
+        Returns a new InfluxDB client. The influxdb package is imported here,
+        hence the other backends work without it.
+        """
+        from influxdb import InfluxDBClient
+
+        return InfluxDBClient('localhost', 8086, 'root', 'root', 'imu_data')
+
+    def _stamp(self):
+        """
+        Returns a strictly increasing timestamp, in microseconds since epoch.
+        The points of a batch are stamped here instead of by the server, which
+        would give the whole batch a single time.
+        """
+        with self.stamp_lock:
+            self.last_stamp = max(int(time.time() * 1e6), self.last_stamp + 1)
+            return self.last_stamp
 
     def _flatten(self, dat):
         """
@@ -42,40 +104,54 @@ class Influx(object):
                 """
                 yield [row['yaw'], row['pitch'], row['roll']]
 
-    def _measurement(self, measurement, arguments):
+    def _measurement(self, measurement, arguments, epoch = None):
         """
         Returns the Measurement for a specific tag.
         Args:
             measurement (str): The measurement.
             arguments (dict): Dictionary of the Arguments passed on to the function.
+            epoch (str): Precision of the returned times, as epoch integers.
+                Default: RFC3339 strings.
         Returns:
             ResultSet: The InfluxDB result instance.
         """
 
-        args = {_: arguments[_] if _ in arguments else None for _ in ['tag', 'time_lower', 'time_upper', 'limit', 'offset']}
+        q = self._query(measurement, arguments)
+        self._init_client()
 
-        q = "SELECT * FROM {0}".format(measurement)
+        if epoch is None:
+            return self.client.query(q)
+        return self.client.query(q, epoch = epoch)
 
-        if any([args['tag'], args['time_lower'], args['time_upper']]):
-            q += " WHERE "
+    @staticmethod
+    def _query(measurement, arguments):
+        """
+        Returns the InfluxQL query of `_measurement`. The time limits are
+        either InfluxDB format strings, or epoch integers in nanoseconds.
+        `time_from` is an inclusive lower limit, used in place of `time_lower`.
+        """
 
-        if args['tag']:
-            q += "mmt_class='{0}'".format(args['tag'])
+        args = {_: arguments[_] if _ in arguments else None
+                for _ in ['tag', 'time_lower', 'time_from', 'time_upper', 'limit', 'offset']}
 
-        if args['tag'] and any([args['time_upper'], args['time_lower']]):
-            q += " AND "
+        literal = lambda x: str(x) if isinstance(x, int) else "'{0}'".format(x)
+        where = []
 
-        if args['time_lower']:
-            q += "time > '{0}'".format(args['time_lower'])
+        if args['tag']:
+            where.append("mmt_class='{0}'".format(args['tag']))
 
-        if args['time_lower'] and args['time_upper']:
-            q += " AND "
+        if args['time_from'] is not None:
+            where.append("time >= {0}".format(literal(args['time_from'])))
+        elif args['time_lower']:
+            where.append("time > {0}".format(literal(args['time_lower'])))
 
         if args['time_upper']:
-            q += "time < '{0}'".format(args['time_upper'])
+            where.append("time < {0}".format(literal(args['time_upper'])))
+
+        q = "SELECT * FROM {0}".format(measurement)
 
-        if args['time_upper'] and args['limit']:
-            q += " AND "
+        if where:
+            q += " WHERE " + " AND ".join(where)
 
         if args['limit'] and args['offset']:
             q += " limit {0} offset {1};".format(args['limit'], args['offset'])
@@ -84,9 +160,74 @@ class Influx(object):
         else:
             q += ";"
 
-        return self.client.query(q)
+        return q
+
+    def _run_queries(self, client, queries):
+        """
+        Runs the queries as the statements of a single request, fetching the
+        times as nanosecond epochs. The queries found in the `query_cache`
+        are not sent, and the results of the others are stored in it.
+
+        Args:
+            client (InfluxDBClient): The client the request is sent with.
+            queries (list): (query, arguments) pairs, see `_query`.
+        Returns:
+            (list): The `_block` of every query.
+        """
+
+        cache = self.query_cache
+        out = [None if cache is None else cache.get(_) for _, __ in queries]
+        missing = [_ for _, __ in enumerate(out) if __ is None]
+
+        if not missing:
+            return out
+
+        self._init_client()
+        results = client.query("".join(queries[_][0] for _ in missing), epoch = 'ns')
+        if not isinstance(results, list):
+            results = [results]
+
+        for i, result in zip(missing, results):
+            out[i] = self._block(result)
+            if cache is not None:
+                cache.put(queries[i][0], *out[i], time_upper = queries[i][1].get('time_upper'))
+
+        return out
+
+    @staticmethod
+    def _block(result):
+        """
+        Converts a query result, fetched with nanosecond epoch times, to an
+        array. The axes are picked as in `_flatten`.
+
+        Returns:
+            (tuple): The times (int64, nanoseconds), and the (n, 4) array of
+                the time in seconds since epoch and the three axes.
+        """
+
+        series = result.raw.get('series') or [{'columns': [], 'values': []}]
+        columns, values = series[0]['columns'], series[0]['values']
+
+        if not values:
+            return np.empty(0, dtype = np.int64), np.empty((0, 4))
+
+        axes = ['x', 'y', 'z'] if 'x' in columns else ['yaw', 'pitch', 'roll']
+        index = [columns.index(_) for _ in axes]
+
+        stamps = np.array([_[0] for _ in values], dtype = np.int64)
+        block = np.empty((len(values), 4))
+        block[:, 0] = stamps / 1e9
+        block[:, 1:] = np.array([[row[_] for _ in index] for row in values], dtype = np.float64)
+
+        return stamps, block
 
     def _init_client(self):
+        """
+        Logs in, creating the database if needed. Runs once.
+        """
+        if self.client_ready:
+            return
+
         json_body = [{
             "measurement": "meta",
             "fields": {
@@ -100,11 +241,16 @@ class Influx(object):
             self.client.write_points(json_body)
             click.echo("Created a New Database `imu_data`.")
 
-    def write(self, dat, data_class):
+        self.client_ready = True
+
+    def write(self, dat, data_class, timestamp = None):
         """
         Logs `dat` to the InfluxDB database.
         Args:
             dat (dict): Data dictionary. The missing fields are auto set to float(0)
+            data_class (str): The mmt_class tag attached to the measurement.
+            timestamp (float): Unix time (seconds) of the sample, as given by
+                the device. Default: None, the time it's written at.
         """
         xyz = ['x', 'y', 'z']
         ypr = ['yaw', 'pitch', 'roll']
@@ -148,7 +294,52 @@ class Influx(object):
             }
         ]
 
-        self.client.write_points(json_body)
+        if self.writer is None and timestamp is None:
+            self._init_client()
+            self.client.write_points(json_body)
+            return
+
+        stamp = self._stamp() if timestamp is None else int(round(timestamp * 1e6))
+        for point in json_body:
+            point["time"] = stamp
+
+        if self.writer is None:
+            self._init_client()
+            self.client.write_points(json_body, time_precision = 'u')
+            return
+
+        if not isinstance(self.writer, Spool):
+            self._init_client()
+
+        self.writer.put(json_body)
+
+    def flush(self):
+        """
+        Writes the points pending in the `BufferedWriter` or the `Spool`, if any.
+        """
+        if self.writer is not None:
+            self.writer.flush()
+
+    def close(self):
+        """
+        Flushes the pending points and stops the `BufferedWriter` or the
+        `Spool`, if any. The points left in a spool are drained on its next
+        open.
+        """
+        if self.writer is not None:
+            self.writer.close()
+
+    def metrics(self):
+        """
+        Returns the `BufferedWriter` or the `Spool` metrics, see
+        `BufferedWriter.metrics` and `Spool.metrics`.
+
+        Returns:
+            (dict or None): The metrics, None if the writes are not buffered.
+        """
+        if self.writer is None:
+            return None
+        return self.writer.metrics()
 
     def probe(self, name, *args, **kwargs):
         """
@@ -162,33 +353,177 @@ class Influx(object):
         Returns:
             generator: Generator of the probe columns.
         """
+        if self.query_cache is not None:
+            return iter(self.probe_columns(name, **kwargs)[:, 1:].tolist())
+
         out = self._measurement(name, kwargs).get_points()
         return self._flatten(out)
 
-    def import_json(self, file_handle, relative_time = True):
+    def probe_blocks(self, name, chunk_size = 10000, *args, **kwargs):
+        """
+        Yields the measurements taken on a particular "probe" in blocks.
+
+        The range is paged through with a query of `chunk_size` rows at a
+        time, so only a single block is held in memory. A page starts at the
+        last time of the previous one, inclusive, and skips the rows of that
+        time already yielded. The rows of a time shared by several series
+        (e.g. of every mmt_class) are thus not lost at a page boundary.
+
+        Args:
+            name (str): The name of the Probe.
+            chunk_size (int): Rows per query, and per block.
+            tag, time_lower, time_upper, limit, offset: See `probe`.
+        Returns:
+            (generator): numpy.ndarray blocks shaped (n, 4), the time in
+                seconds since epoch and the three axes.
+        """
+
+        query = dict(kwargs)
+        remaining = query.pop('limit', None)
+        #: Rows yielded at the last time seen, skipped by the next page.
+        last, seen = None, 0
+
+        while remaining is None or remaining > 0:
+            query['limit'] = chunk_size if remaining is None else min(chunk_size, remaining)
+            stamps, block = self._run_queries(self.client, [(self._query(name, query), query)])[0]
+
+            if not len(block):
+                return
+
+            yield block
+
+            if len(block) < query['limit']:
+                return
+
+            if remaining is not None:
+                remaining -= len(block)
+
+            tail = int((stamps == stamps[-1]).sum())
+            seen = seen + tail if stamps[-1] == last and tail == len(block) else tail
+            last = int(stamps[-1])
+
+            query['time_from'] = last
+            query['offset'] = seen
+
+    def probe_columns(self, name, *args, **kwargs):
+        """
+        Returns the measurements taken on a particular "probe" as one array,
+        with a single query. Meant for the short ranges, see `probe_blocks`.
+
+        Args:
+            name (str): The name of the Probe.
+            tag, time_lower, time_upper, limit, offset: See `probe`.
+        Returns:
+            (numpy.ndarray): Measurements shaped (n, 4), the time in seconds
+                since epoch and the three axes.
+        """
+        return self._run_queries(self.client, [(self._query(name, kwargs), kwargs)])[0][1]
+
+    def import_json(self, file_handle, relative_time = True, batch_size = 5000, jobs = 1, checkpoint = None):
         """
+        Imports an InfluxDB JSON query dump.
+
+        The dump is parsed incrementally (see `JSONSeries`), and its rows are
+        written as line protocol in batches of `batch_size` rows, by `jobs`
+        writer threads. With a `checkpoint` file, the number of leading rows
+        written is recorded after every batch, and a later import of the same
+        dump skips them. Rows past the checkpoint may be written twice, which
+        leaves the points as they are.
+
+        Args:
+            file_handle (file): The JSON dump.
+            relative_time (bool): Unused.
+            batch_size (int): Rows written per request.
+            jobs (int): Writer threads.
+            checkpoint (str): Checkpoint file. Removed once the import completes.
+        Returns:
+            (bool): True if the import completed.
         """
+        self._init_client()
+        source = self._dump_source(file_handle)
+        done = self._load_checkpoint(checkpoint, source)
+
+        if done:
+            click.echo("Resuming after {0} rows.".format(done))
+
+        work = queue.Queue(maxsize = 2 * jobs)
+        lock = threading.Lock()
+        state = {"next": 0, "finished": {}, "rows": done, "error": None, "skipped": 0}
+
+        def writer():
+            """
+            Writes the batches off the queue, and moves the checkpoint past
+            the leading batches written.
+            """
+            client = self._connect()
+            while True:
+                item = work.get()
+                if item is None:
+                    return
+
+                seq, count, lines = item
+
+                if state["error"] is None:
+                    try:
+                        if lines:
+                            client.write_points(lines, time_precision = 'n', protocol = 'line')
+                    except Exception as e:
+                        state["error"] = e
+                        continue
+
+                with lock:
+                    state["finished"][seq] = count
+                    while state["next"] in state["finished"]:
+                        state["rows"] += state["finished"].pop(state["next"])
+                        state["next"] += 1
+                    self._save_checkpoint(checkpoint, source, state["rows"])
+
+        threads = [threading.Thread(target = writer, name = "influx-import-{0}".format(_), daemon = True)
+                   for _ in range(jobs)]
+
+        for thread in threads:
+            thread.start()
+
+        start = time.monotonic()
+        ok = False
+
         try:
-            dat = json.loads(file_handle.read())
-
-            for result in dat['results']:
-                for series in result['series']:
-                    col = series['columns']
-                    tags = series['tags']
-                    name = series['name']
-
-                    for i in series['values']:
-                        json_body = [{
-                            "measurement": name,
-                            "tags": tags,
-                            "time": i[0],
-                            "fields": {
-                                _: float(__) for (_, __) in zip(col[1:], i[1:])
-                            }
-                        }]
-                        self.client.write_points(json_body)
-                        click.echo('\rImporting: {0}'.format(next(Helper.pool)), nl = False)
-            return True
+            lines = []
+            count = 0
+            seq = 0
+            series_line = None
+            last_series = None
+
+            for row_no, (series, row) in enumerate(JSONSeries(file_handle)):
+                if row_no < done:
+                    continue
+
+                if state["error"] is not None:
+                    break
+
+                if series is not last_series:
+                    last_series = series
+                    series_line = self._line_series(series)
+
+                stamp = JSONSeries.nanoseconds(row[0])
+
+                fields, skipped = self._line_fields(series_line[1], row[1:])
+                state["skipped"] += skipped
+                if fields:
+                    lines.append("{0} {1} {2}".format(series_line[0], fields, stamp))
+                count += 1
+
+                if count == batch_size:
+                    work.put((seq, count, lines))
+                    lines, count, seq = [], 0, seq + 1
+                    rate = (state["rows"] - done) / max(time.monotonic() - start, 1e-9)
+                    click.echo('\rImporting: {0}{1} rows, {2:.0f} rows/s'.format(
+                        next(Helper.pool), state["rows"], rate), nl = False)
+
+            if count and state["error"] is None:
+                work.put((seq, count, lines))
+
+            ok = True
 
         except json.decoder.JSONDecodeError:
             click.echo("Invalid JSON.")
@@ -196,23 +531,222 @@ class Influx(object):
         except Exception as e:
             click.echo("ERR:" + str(e))
 
-        return False
+        finally:
+            for _ in threads:
+                work.put(None)
+            for thread in threads:
+                thread.join()
+
+        if state["error"] is not None:
+            click.echo("ERR:" + str(state["error"]))
+            return False
+
+        if not ok:
+            return False
+
+        elapsed = max(time.monotonic() - start, 1e-9)
+        imported = state["rows"] - done
+        click.echo("\rImported {0} rows in {1:.1f}s, {2:.0f} rows/s.".format(imported, elapsed, imported / elapsed))
+
+        if state["skipped"]:
+            click.echo("Skipped {0} NaN or infinite values, line protocol has no literal for them.".format(
+                state["skipped"]))
+
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        return True
 
-    def probe_annotation(self, name, annotation_dict, wouldchain = False, *args, **kwargs):
+    @staticmethod
+    def _line_series(series):
+        """
+        Returns the line protocol prefix of the series (measurement and tags),
+        and its escaped field keys.
+        """
+        def escape(text, chars):
+            for char in chars:
+                text = text.replace(char, "\\" + char)
+            return text
+
+        prefix = escape(series["name"], ", ")
+        for tag in sorted(series["tags"] or {}):
+            value = series["tags"][tag]
+            if value not in (None, ""):
+                prefix += ",{0}={1}".format(escape(tag, ",= "), escape(str(value), ",= "))
+
+        return prefix, [escape(_, ",= ") for _ in series["columns"][1:]]
+
+    @staticmethod
+    def _line_fields(keys, values):
+        """
+        Returns the line protocol field set of a row, and the number of its
+        values left out. The null values are left out, and so are NaN and
+        infinities, which would fail the whole batch.
+
+        Args:
+            keys (list): Escaped field keys, see `_line_series`.
+            values (list): Values of the row.
+        Returns:
+            (tuple): The field set, empty if no value is left, and the
+                number of NaN or infinite values left out.
+        """
+        fields = []
+        skipped = 0
+
+        for key, value in zip(keys, values):
+            if value is None:
+                continue
+            value = float(value)
+            if not math.isfinite(value):
+                skipped += 1
+                continue
+            fields.append("{0}={1!r}".format(key, value))
+
+        return ",".join(fields), skipped
+
+    @staticmethod
+    def _dump_source(file_handle):
+        """
+        Identifies a dump by its name and size, for the checkpoints.
+        """
+        try:
+            size = os.fstat(file_handle.fileno()).st_size
+        except (AttributeError, OSError, ValueError):
+            size = None
+        return [getattr(file_handle, "name", None), size]
+
+    @staticmethod
+    def _load_checkpoint(checkpoint, source):
+        """
+        Returns the rows of `source` recorded in the checkpoint, 0 if none.
+        """
+        if not checkpoint or not os.path.exists(checkpoint):
+            return 0
+
+        with open(checkpoint) as minion:
+            dat = json.load(minion)
+
+        if dat.get("source") != source:
+            click.echo("Ignoring the checkpoint of another dump.")
+            return 0
+
+        return dat["rows"]
+
+    @staticmethod
+    def _save_checkpoint(checkpoint, source, rows):
+        """
+        Records the rows written, atomically.
+        """
+        if not checkpoint:
+            return
+
+        with open(checkpoint + ".tmp", "w") as minion:
+            json.dump({"source": source, "rows": rows}, minion)
+
+        os.replace(checkpoint + ".tmp", checkpoint)
+
+    def probe_annotation(self, name, annotation_dict, wouldchain = False, merge_gap = 60, per_request = 32, jobs = 1,
+                         columns = False, *args, **kwargs):
         """
         Returns annotation data dicts.
+
+        The time ranges are fetched with a few requests instead of one per
+        range: ranges closer than `merge_gap` seconds are merged into a
+        single time window, and up to `per_request` window queries are sent
+        as the statements of a single request. The rows of every range are
+        then split off its window with a binary search on the sorted times.
+        InfluxQL can't OR time ranges, hence the windows. With a `limit` or
+        an `offset`, which apply per range, every range is queried on its own.
+
+        Args:
+            name (str): The name of the Probe.
+            annotation_dict (list): Time ranges, [lower, upper] in milliseconds
+                since epoch. The bounds are truncated to seconds.
+            wouldchain (bool): Yields the rows of all the ranges as a single
+                chain, instead of per range.
+            merge_gap (float): Largest gap (seconds) between two ranges
+                fetched with the same query.
+            per_request (int): Queries sent per request.
+            jobs (int): Threads running the requests.
+            columns (bool): Yields the (n, 4) arrays of `probe_columns`,
+                instead of the [x, y, z] rows of `probe`.
+            tag, limit, offset: See `probe`.
+        Returns:
+            (generator): The rows of every range, in the order of `annotation_dict`.
         """
 
-        time_format = lambda x: time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(float(x) / 1000))
-        gen = []
+        if kwargs.get('limit') or kwargs.get('offset'):
+            time_format = lambda x: time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(float(x) / 1000))
+            fetch = self.probe_columns if columns else self.probe
+            out = []
 
-        for time_range in annotation_dict:
-            kwargs['time_lower'] = time_format(time_range[0])
-            kwargs['time_upper'] = time_format(time_range[1])
+            for time_range in annotation_dict:
+                kwargs['time_lower'] = time_format(time_range[0])
+                kwargs['time_upper'] = time_format(time_range[1])
+                out.append(fetch(name, **kwargs))
+        else:
+            out = self._probe_ranges(name, annotation_dict, merge_gap, per_request, jobs, kwargs)
+            if not columns:
+                out = [_[:, 1:].tolist() for _ in out]
+
+        if wouldchain is True:
+            yield chain(*out)
+        else:
+            yield from out
+
+    def _probe_ranges(self, name, annotation_dict, merge_gap, per_request, jobs, arguments):
+        """
+        Fetches the time ranges of `probe_annotation` with the merged window
+        queries.
+
+        Returns:
+            (list): numpy.ndarray (n, 4) per range, see `probe_columns`.
+        """
+
+        #: Seconds, as the time strings of `probe` were.
+        ranges = [(int(float(_[0]) // 1000) * 10 ** 9, int(float(_[1]) // 1000) * 10 ** 9) for _ in annotation_dict]
+
+        windows = []
+        window_of = [None] * len(ranges)
 
-            if wouldchain is True:
-                gen.append(self.probe(name, **kwargs))
+        for i in sorted(range(len(ranges)), key = lambda _: ranges[_]):
+            lower, upper = ranges[i]
+            if windows and lower <= windows[-1][1] + merge_gap * 10 ** 9:
+                windows[-1][1] = max(windows[-1][1], upper)
             else:
-                yield self.probe(name, **kwargs)
+                windows.append([lower, upper])
+            window_of[i] = len(windows) - 1
+
+        bounds = (dict(arguments, time_lower = _, time_upper = __) for _, __ in windows)
+        queries = [(self._query(name, _), _) for _ in bounds]
+        requests = [queries[_:_ + per_request] for _ in range(0, len(queries), per_request)]
+
+        local = threading.local()
+
+        def fetch(request):
+            """
+            Runs the queries of a request, on the client of the thread.
+            """
+            if jobs <= 1:
+                client = self.client
+            else:
+                if not hasattr(local, 'client'):
+                    local.client = self._connect()
+                client = local.client
+
+            return self._run_queries(client, request)
+
+        if jobs <= 1 or len(requests) <= 1:
+            fetched = [fetch(_) for _ in requests]
+        else:
+            with ThreadPoolExecutor(jobs) as pool:
+                fetched = list(pool.map(fetch, requests))
+
+        blocks = list(chain(*fetched))
+        out = []
+
+        for (lower, upper), window in zip(ranges, window_of):
+            stamps, block = blocks[window]
+            out.append(block[np.searchsorted(stamps, lower, 'right'):np.searchsorted(stamps, upper, 'left')])
 
-        return gen
+        return out
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Batching and parsing of the points, shared by the time series backends.
+Unlike `influx`, this module does not need the influxdb package.
+"""
+
+import atexit
+import calendar
+import click
+import functools
+import json
+import re
+import threading
+import time
+
+class BufferedWriter(object):
+    """
+    Accumulates the points and writes them to the InfluxDB in batches.
+
+    A batch is written by a background thread as soon as `batch_size` points
+    are pending, or `flush_interval` seconds after the oldest pending point
+    was added, whichever comes first. The pending points are flushed on
+    `close`, which is also registered to run at the interpreter exit.
+
+    The writers of a batch do not wait on the network. They only wait if
+    `max_pending` points are already pending, that is, if the InfluxDB does
+    not keep up.
+    """
+
+    #: (int) Points written per request.
+    BATCH_SIZE = 5000
+    #: (float) Longest time (seconds) a point waits before being written.
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self, client, batch_size = BATCH_SIZE, flush_interval = FLUSH_INTERVAL, max_pending = None):
+        """
+        Args:
+            client (InfluxDBClient): The client the batches are written with.
+            batch_size (int): Points written per request.
+            flush_interval (float): Longest time (seconds) a point is kept pending.
+            max_pending (int): Bound of the pending points. Default: 20 batches.
+        """
+        self.client = client
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending or 20 * batch_size
+
+        self.pending = []
+        self.oldest = None
+        self.closed = False
+        self.flushing = 0
+        self.cond = threading.Condition()
+
+        self.stats = {
+            "points": 0,
+            "written": 0,
+            "dropped": 0,
+            "flushes": 0,
+            "errors": 0,
+            "flush_seconds": 0.0,
+            "last_flush_seconds": 0.0,
+            "max_flush_seconds": 0.0,
+        }
+
+        self.thread = threading.Thread(target = self._run, name = "influx-writer", daemon = True)
+        self.thread.start()
+
+        atexit.register(self.close)
+
+    def put(self, points):
+        """
+        Adds the points to the pending batch.
+
+        Args:
+            points (list): InfluxDB JSON points. The points should carry
+                their `time`, as a batch is stamped by the server otherwise.
+        Raises:
+            ValueError: If the writer is closed.
+        """
+        with self.cond:
+            if self.closed:
+                raise ValueError("Writing to a closed BufferedWriter.")
+
+            while len(self.pending) >= self.max_pending and not self.closed:
+                self.cond.wait()
+
+            if not self.pending:
+                self.oldest = time.monotonic()
+
+            self.pending.extend(points)
+            self.stats["points"] += len(points)
+
+            if len(self.pending) >= self.batch_size:
+                self.cond.notify_all()
+
+    def flush(self):
+        """
+        Writes all the pending points, and waits for the writes to finish.
+        """
+        with self.cond:
+            self.oldest = -float("inf") if self.pending else None
+            self.cond.notify_all()
+
+            while self.pending or self.flushing:
+                self.cond.wait()
+
+    def close(self):
+        """
+        Flushes the pending points, and stops the writer thread.
+        """
+        with self.cond:
+            if self.closed:
+                return
+            self.closed = True
+            self.cond.notify_all()
+
+        self.thread.join()
+        atexit.unregister(self.close)
+
+    def metrics(self):
+        """
+        Returns the writer metrics.
+
+        Returns:
+            (dict): `depth` (points pending), `points` (points added),
+                `written`, `dropped` (points of the failed writes), `flushes`,
+                `errors`, and the mean, last and max flush latency in seconds.
+        """
+        with self.cond:
+            out = dict(self.stats)
+            out["depth"] = len(self.pending)
+
+        out["mean_flush_seconds"] = out["flush_seconds"] / max(out["flushes"], 1)
+        return out
+
+    def _due(self):
+        """
+        Returns the seconds until the pending points are due, 0 if due now,
+        and None if nothing is pending.
+        """
+        if not self.pending:
+            return None
+        if self.closed or len(self.pending) >= self.batch_size:
+            return 0
+        return max(0, self.oldest + self.flush_interval - time.monotonic())
+
+    def _run(self):
+        """
+        Writer thread. Takes the due batches off the pending points.
+        """
+        while True:
+            with self.cond:
+                due = self._due()
+                while due != 0:
+                    if self.closed and due is None:
+                        return
+                    self.cond.wait(due)
+                    due = self._due()
+
+                batch = self.pending[:self.batch_size]
+                del self.pending[:self.batch_size]
+                if not self.pending:
+                    self.oldest = None
+                self.flushing += 1
+                self.cond.notify_all()
+
+            self._write(batch)
+
+            with self.cond:
+                self.flushing -= 1
+                self.cond.notify_all()
+
+    def _write(self, batch):
+        """
+        Writes a batch, and records its latency.
+        """
+        start = time.monotonic()
+        try:
+            self.client.write_points(batch, time_precision = 'u')
+            failed = False
+        except Exception as e:
+            click.echo("\nERR: Dropped {0} points: {1}".format(len(batch), e), err = True)
+            failed = True
+        elapsed = time.monotonic() - start
+
+        with self.cond:
+            self.stats["flushes"] += 1
+            self.stats["flush_seconds"] += elapsed
+            self.stats["last_flush_seconds"] = elapsed
+            self.stats["max_flush_seconds"] = max(self.stats["max_flush_seconds"], elapsed)
+            if failed:
+                self.stats["errors"] += 1
+                self.stats["dropped"] += len(batch)
+            else:
+                self.stats["written"] += len(batch)
+
+class JSONSeries(object):
+    """
+    Incremental reader of the InfluxDB JSON query dumps, shaped
+    {"results": [{"series": [{"name", "tags", "columns", "values"}]}]}.
+
+    The dump is read `chunk_size` characters at a time, and the rows of the
+    "values" are decoded one by one, so the memory use does not depend on the
+    size of the dump. The rows are streamed if the "name" and "columns" of the
+    series come before its "values", as in the InfluxDB output, and are kept
+    until the end of the series otherwise.
+    """
+
+    #: (regex) JSON whitespace.
+    WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+    def __init__(self, handle, chunk_size = 1 << 20):
+        """
+        Args:
+            handle (file): The JSON dump, opened in text mode.
+            chunk_size (int): Characters read at a time.
+        """
+        self.handle = handle
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def __iter__(self):
+        """
+        Yields the rows of the dump.
+
+        Returns:
+            (generator): (series, row) pairs, where `series` is the dict of
+                the series "name", "tags" and "columns". It's the same dict
+                for all the rows of a series.
+        """
+        for key in self._members():
+            if key != "results":
+                self._value()
+                continue
+            for _ in self._items():
+                for key in self._members():
+                    if key != "series":
+                        self._value()
+                        continue
+                    for _ in self._items():
+                        yield from self._series()
+
+    @staticmethod
+    def nanoseconds(stamp):
+        """
+        Converts a time to nanoseconds since epoch.
+
+        Args:
+            stamp (int or str): Nanoseconds, or an RFC3339 UTC time. The
+                "YYYY-MM-DD HH:MM:SS" format of the queries is accepted too.
+        Returns:
+            (int): Nanoseconds since epoch.
+        """
+        if isinstance(stamp, int):
+            return stamp
+
+        base, _, frac = stamp.rstrip("Z").partition(".")
+        return JSONSeries._second(base) + int((frac + "000000000")[:9])
+
+    @staticmethod
+    @functools.lru_cache(maxsize = 1024)
+    def _second(base):
+        """
+        Nanoseconds since epoch of a time, up to the seconds. strptime is
+        slow, and the rows of a second share its result.
+        """
+        return calendar.timegm(time.strptime(base.replace("T", " "), "%Y-%m-%d %H:%M:%S")) * 10 ** 9
+
+    def _series(self):
+        """
+        Yields the (series, row) pairs of a single series.
+        """
+        series = {"tags": {}}
+        pending = []
+
+        for key in self._members():
+            if key != "values":
+                series[key] = self._value()
+                continue
+
+            ready = "name" in series and "columns" in series
+            for _ in self._items():
+                if ready:
+                    yield series, self._value()
+                else:
+                    pending.append(self._value())
+
+        for row in pending:
+            yield series, row
+
+    def _fill(self):
+        """
+        Appends the next chunk to the buffer, dropping the consumed part.
+
+        Returns:
+            (bool): False at the end of the dump.
+        """
+        if self.eof:
+            return False
+
+        chunk = self.handle.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        """
+        Skips the whitespace, and returns the next character.
+        """
+        while True:
+            self.pos = self.WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise json.JSONDecodeError("Unexpected end of the dump", self.buf, self.pos)
+
+    def _take(self, chars):
+        """
+        Consumes the next character, which is one of `chars`.
+        """
+        char = self._peek()
+        if char not in chars:
+            raise json.JSONDecodeError("Expecting one of '{0}'".format(chars), self.buf, self.pos)
+        self.pos += 1
+        return char
+
+    def _value(self):
+        """
+        Decodes the next value. A value running to the end of the buffer is
+        decoded again with the next chunk, since it may be cut short.
+        """
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def _members(self):
+        """
+        Yields the keys of the next object. The value of every key must be
+        consumed before the next key is taken.
+        """
+        self._take("{")
+        if self._peek() == "}":
+            self.pos += 1
+            return
+
+        while True:
+            key = self._value()
+            self._take(":")
+            yield key
+            if self._take(",}") == "}":
+                return
+
+    def _items(self):
+        """
+        Yields once per item of the next array. Every item must be consumed
+        before the next one.
+        """
+        self._take("[")
+        if self._peek() == "]":
+            self.pos += 1
+            return
+
+        while True:
+            yield
+            if self._take(",]") == "]":
+                return
@@ -4,9 +4,17 @@
 """
 """
 
+import click
+import hashlib
+import inspect
+import multiprocessing
+import os
+import threading
+import time
 import numpy as np
 import matplotlib.pyplot as plt
 
+from collections import deque
 from numpy import linalg as LA
 from scipy.optimize import curve_fit
 from scipy.signal import argrelmax, argrelmin
@@ -14,6 +22,7 @@ from scipy.signal import argrelmax, argrelmin
 from .helper import Helper
 from .helper import Stupidity
 from .helper import Gradient
+from .helper import RingBuffer
 from .sample_dump import WINDOWLEN, STEP
 
 import pandas as pd
@@ -45,15 +54,11 @@ class Routines(object):
         """
 
         #: Overlapped x, y, and z axis data.
-        #  Data length -> 16
-        x_o = list(zip(*[x[_:] for _ in range(64)]))[::10]
-        y_o = list(zip(*[y[_:] for _ in range(64)]))[::10]
-        z_o = list(zip(*[z[_:] for _ in range(64)]))[::10]
-        #: Gathers row wise data.
-        row = zip(x_o, y_o, z_o)
+        #  Data length -> 64, shaped (windows, 64, 3)
+        row = Helper.sliding_window(np.column_stack([x, y, z]), 64, 10)
 
         for val_set in row:
-            yield Routines.sep_29_feature(val_set)
+            yield Routines.sep_29_feature(val_set.T)
 
     @staticmethod
     def sep_29_feature(val_set):
@@ -85,8 +90,8 @@ class Routines(object):
 
             wave_energy.append(Helper.discreet_wave_energy(col) / w_col)
 
-            curves   = [map(_[0],  range(w_col)) for _ in discreet_fit]
-            fre_dist = [Stupidity.frechet_dist(list(_), col) for _ in curves]
+            curves   = [list(map(_[0],  range(w_col))) for _ in discreet_fit]
+            fre_dist = list(Stupidity.frechet_dist_batch(curves, col))
 
             n_fre_dist = Stupidity.normalise_dist(fre_dist)
 
@@ -145,8 +150,8 @@ class Routines(object):
 
             wave_energy.append(Helper.discreet_wave_energy(col) / w_col)
 
-            curves   = [map(_[0],  range(w_col)) for _ in discreet_fit]
-            fre_dist = [Stupidity.frechet_dist(list(_), col) for _ in curves]
+            curves   = [list(map(_[0],  range(w_col))) for _ in discreet_fit]
+            fre_dist = list(Stupidity.frechet_dist_batch(curves, col))
 
             n_fre_dist = Stupidity.normalise_dist(fre_dist)
 
@@ -258,3 +263,461 @@ class Routines(object):
         v_rep = [Helper.pooled_variance(variance[_]) for _ in VAR_ORDERED]
 
         return [sum(wave_energy) / 3, sum(tssq)] + v_rep #+ tssq #+ wave_energy
+
+    @staticmethod
+    def feature_version():
+        """
+        Version of the features returned by `feature_vector_batch`.
+        This is a hash of the source of every routine the features depend on,
+        hence it changes whenever the features may.
+
+        Returns:
+            (str): Version hash.
+        """
+
+        routines = [Routines.feature_vector_batch,
+                    Routines._feature_block,
+                    Routines._gradient_variance,
+                    Helper.discreet_wave_energy,
+                    Gradient.gradient_boundaries,
+                    Gradient.remap]
+
+        source = "".join(inspect.getsource(_) for _ in routines) + str(WINDOWLEN)
+
+        return hashlib.sha1(source.encode()).hexdigest()[:16]
+
+    @staticmethod
+    def feature_vector_batch(windows, chunk_size = 1024):
+        """
+        Creates the Feature Vectors of a block of windows in one call.
+        The features are the same as the ones returned by `feature_vector`, in
+        the same order, hence the models trained on either are interchangeable.
+
+        Args:
+            windows (numpy.ndarray): Windows, shaped (N, window_len, 3).
+            chunk_size (int): Number of windows processed at once. Bounds the
+                memory used by the intermediate arrays.
+
+        Returns:
+            (numpy.ndarray): Feature Matrix, shaped (N, 5).
+        """
+
+        windows = np.asarray(windows, dtype = np.float64)
+
+        if windows.size == 0:
+            return np.empty((0, 5))
+        if windows.ndim != 3:
+            raise ValueError("windows should be shaped (N, window_len, axes)")
+
+        out = np.empty((windows.shape[0], 5))
+
+        for i in range(0, windows.shape[0], chunk_size):
+            out[i:i + chunk_size] = Routines._feature_block(windows[i:i + chunk_size])
+
+        return out
+
+    @staticmethod
+    def feature_vector_parallel(windows, jobs, chunk_size = 1024, label = "Features"):
+        """
+        Creates the Feature Vectors of a block of windows on `jobs` worker
+        processes. See `feature_vector_batch`.
+        The windows are sharded in chunks of `chunk_size`, and the results are
+        gathered in the order of the chunks, hence the output is the same as
+        that of `feature_vector_batch`. The progress of every worker is
+        reported as the chunks complete.
+
+        Args:
+            windows (numpy.ndarray): Windows, shaped (N, window_len, 3).
+            jobs (int): Number of worker processes.
+            chunk_size (int): Windows per chunk.
+            label (str): Progress label.
+
+        Returns:
+            (numpy.ndarray): Feature Matrix, shaped (N, 5).
+        """
+
+        windows = np.asarray(windows, dtype = np.float64)
+        chunks = [windows[_:_ + chunk_size] for _ in range(0, len(windows), chunk_size)]
+
+        if jobs < 2 or len(chunks) < 2:
+            return Routines.feature_vector_batch(windows, chunk_size)
+
+        out = []
+        done = {}
+
+        with multiprocessing.Pool(jobs) as pool:
+            for pid, ftr in pool.imap(_feature_chunk, chunks):
+                out.append(ftr)
+                done[pid] = done.get(pid, 0) + len(ftr)
+                Helper.worker_progress(label, done, len(windows))
+
+        click.echo("")
+
+        return np.vstack(out)
+
+    @staticmethod
+    def _feature_block(windows):
+        """
+        Supplementary method for method `feature_vector_batch`.
+        Every (window, axis) pair is treated as a row, and all the rows are
+        processed together.
+
+        Args:
+            windows (numpy.ndarray): Windows, shaped (N, window_len, axes).
+
+        Returns:
+            (numpy.ndarray): Feature Matrix, shaped (N, 5).
+        """
+
+        WINDOW_LEN = int(WINDOWLEN / 2)
+        n_win, w_len, n_ax = windows.shape
+        rows = windows.transpose(0, 2, 1).reshape(-1, w_len)
+        n_row = rows.shape[0]
+        gradient_bin = Gradient()
+
+        #: Wave Energy
+        wave_energy = Helper.discreet_wave_energy(rows)
+
+        #: Total Sum of Squares
+        tssq = ((rows - rows.mean(axis = 1)[:, np.newaxis]) ** 2).sum(axis = 1)
+
+        #: Variance of Gradient, raw and binned
+        variance = Routines._gradient_variance(rows, gradient_bin)
+
+        #: Variance of Moving Mean
+        c_sum = np.cumsum(np.hstack([np.zeros((n_row, 1)), rows]), axis = 1)
+        sm_ax = (c_sum[:, WINDOW_LEN:] - c_sum[:, :-WINDOW_LEN]) / WINDOW_LEN
+        variance.append((np.log(np.var(sm_ax, axis = 1)), np.full(n_row, sm_ax.shape[1])))
+
+        #: Pooled Variance, see `Helper.pooled_variance`.
+        v_rep = []
+        for var, cnt in variance:
+            var = var.reshape(n_win, n_ax)
+            cnt = cnt.reshape(n_win, n_ax) - 1
+            v_rep.append((var * cnt).sum(axis = 1) / cnt.sum(axis = 1))
+
+        return np.column_stack([wave_energy.reshape(n_win, n_ax).sum(axis = 1) / 3,
+                                tssq.reshape(n_win, n_ax).sum(axis = 1)] + v_rep)
+
+    @staticmethod
+    def _gradient_variance(rows, gradient_bin):
+        """
+        Variance of the keypoint polygon gradients of every row, raw and binned.
+        Supplementary method for `feature_vector_batch` and `FeatureStream`.
+
+        Args:
+            rows (numpy.ndarray): Axis data, shaped (rows, samples).
+            gradient_bin (Gradient): Gradient binning.
+
+        Returns:
+            (list): [variance, count] pairs of arrays, for the raw and the
+                binned gradients.
+        """
+
+        n_row, w_len = rows.shape
+
+        #: Keypoint Polygon, see `Stupidity.extrema_keypoints`. The last
+        #  keypoint sits one step after the end of the row.
+        is_key = np.zeros((n_row, w_len + 1), dtype = bool)
+        is_key[:, [0, w_len]] = True
+        is_key[argrelmax(rows, axis = 1, order = 3)] = True
+        is_key[argrelmin(rows, axis = 1, order = 3)] = True
+        key_y = np.hstack([rows, rows[:, -1:]])
+
+        key_r, key_x = np.nonzero(is_key)
+        key_y = key_y[key_r, key_x]
+        same_row = key_r[1:] == key_r[:-1]
+        slopes = (np.diff(key_y) / np.diff(key_x))[same_row]
+        slope_r = key_r[1:][same_row]
+        slope_binned = gradient_bin.remap(slopes)
+
+        def row_variance(val):
+            """
+            Population variance of `val`, grouped by `slope_r`.
+            """
+            cnt = np.bincount(slope_r, minlength = n_row)
+            mean = np.bincount(slope_r, val, n_row) / cnt
+            return np.bincount(slope_r, (val - mean[slope_r]) ** 2, n_row) / cnt, cnt
+
+        return [row_variance(slopes), row_variance(slope_binned)]
+
+def _feature_chunk(windows):
+    """
+    Worker of `Routines.feature_vector_parallel`. Module level, hence picklable.
+
+    Returns:
+        (tuple): Worker process id, and the Feature Matrix of `windows`.
+    """
+    return os.getpid(), Routines.feature_vector_batch(windows)
+
+class FeatureStream(object):
+    """
+    Incremental counterpart of `Routines.feature_vector` for live streams.
+
+    Samples are fed one at a time (`push`) or in blocks (`extend`). Once
+    `window_len` samples are in, a Feature Vector of the latest window is
+    emitted every `step` samples, the same as `feature_vector` would return
+    for the windows of `Helper.sliding_window(stream, window_len, step)`.
+
+    Consecutive windows overlap, hence the wave energy and the sum of squares
+    are kept per hop of `step` samples and combined on emit, and the moving
+    mean is advanced with a running sum. These cost O(step) per hop. The
+    keypoint polygon depends on the extrema of the whole window, so it's
+    evaluated on the window when it's emitted.
+    """
+
+    def __init__(self, window_len = WINDOWLEN, step = STEP, axes = 3):
+        """
+        Args:
+            window_len (int): Samples per window.
+            step (int): Samples between consecutive windows.
+            axes (int): Values per sample.
+        Raises:
+            ValueError: window_len is not a multiple of step, or is too short
+                to hold a moving mean window and a step.
+        """
+
+        #: (int) Moving mean window, see `feature_vector`.
+        self.mm_len = int(WINDOWLEN / 2)
+
+        if window_len % step or window_len < self.mm_len + step:
+            raise ValueError("window_len should be a multiple of step, and not lesser than {0}".format(
+                self.mm_len + step))
+
+        self.window_len = window_len
+        self.step = step
+        self.gradient_bin = Gradient()
+
+        self.samples = RingBuffer(window_len, axes)
+        self.moving_mean = RingBuffer(window_len - self.mm_len + 1, axes)
+        #: (deque) Per hop [wave energy, wave energy of the leading pair, mean, sum of squares].
+        self.hops = deque(maxlen = int(window_len / step))
+        self.pending = []
+        self.mm_sum = np.zeros(axes)
+
+    def push(self, sample):
+        """
+        Feeds a single sample.
+
+        Args:
+            sample (list): Values of the sample, one per axis.
+        Returns:
+            (list or None): Feature Vector, if a window was completed.
+        """
+
+        self.pending.append(sample)
+
+        if len(self.pending) == self.step:
+            hop, self.pending = self.pending, []
+            return self._hop(np.asarray(hop, dtype = np.float64))
+
+    def extend(self, block):
+        """
+        Feeds a block of samples.
+
+        Args:
+            block (list or numpy.ndarray): Samples, shaped (n, axes).
+        Returns:
+            (list): Feature Vectors of the windows completed by the block.
+        """
+
+        block = np.asarray(block, dtype = np.float64)
+        out = []
+
+        #: Tops up the pending hop, then takes the whole hops off the block as slices.
+        if self.pending:
+            fill = min(self.step - len(self.pending), len(block))
+            out += [self.push(_) for _ in block[:fill]]
+            block = block[fill:]
+
+        whole = len(block) - len(block) % self.step
+        for _ in range(0, whole, self.step):
+            out.append(self._hop(block[_:_ + self.step]))
+
+        self.pending += list(block[whole:])
+        return [_ for _ in out if _ is not None]
+
+    def _hop(self, hop):
+        """
+        Updates the running statistics with a hop of `step` samples.
+        """
+
+        last = self.samples.view()[-1:]
+        self.samples.extend(hop)
+
+        #: Wave Energy within the hop, and of the pair joining the previous hop.
+        lead = Helper.discreet_wave_energy(np.vstack([last, hop[:1]]).T) if len(last) else np.zeros(hop.shape[1])
+        mean = hop.mean(axis = 0)
+
+        self.hops.append([Helper.discreet_wave_energy(hop.T), lead, mean, ((hop - mean) ** 2).sum(axis = 0)])
+
+        #: Moving Mean. `tail` is zero padded until mm_len samples are in.
+        tail = self.samples.view()[-(self.mm_len + self.step):]
+        tail = np.vstack([np.zeros((self.mm_len + self.step - len(tail), hop.shape[1])), tail])
+        mm_sum = self.mm_sum + np.cumsum(tail[self.mm_len:] - tail[:self.step], axis = 0)
+
+        #: Re-anchors the running sum once per window, bounding the rounding drift.
+        if len(self.hops) == self.hops.maxlen and self.samples.total % self.window_len == 0:
+            mm_sum[-1] = tail[-self.mm_len:].sum(axis = 0)
+
+        self.mm_sum = mm_sum[-1]
+        position = np.arange(self.samples.total - self.step, self.samples.total)
+        self.moving_mean.extend(mm_sum[position >= self.mm_len - 1] / self.mm_len)
+
+        if self.samples.total >= self.window_len:
+            return self._emit()
+
+    def _emit(self):
+        """
+        Combines the running statistics into the Feature Vector of the latest window.
+        """
+
+        energy, lead, mean, sq = (np.array(_) for _ in zip(*self.hops))
+
+        wave_energy = energy.sum(axis = 0) + lead[1:].sum(axis = 0)
+        tssq = sq.sum(axis = 0) + self.step * ((mean - mean.mean(axis = 0)) ** 2).sum(axis = 0)
+
+        variance = Routines._gradient_variance(self.samples.view().T, self.gradient_bin)
+
+        sm_ax = self.moving_mean.view()
+        variance.append((np.log(np.var(sm_ax, axis = 0)), [len(sm_ax)] * sm_ax.shape[1]))
+
+        v_rep = [Helper.pooled_variance(list(zip(*_))) for _ in variance]
+
+        return [wave_energy.sum() / 3, tssq.sum()] + v_rep
+
+class Inference(object):
+    """
+    Runs the classifiers on the Feature Vectors of a live stream, off the
+    receive path.
+
+    The windows are queued by `put` and classified by `threads` background
+    threads, and every prediction is passed to `callback`. Up to
+    `max_pending` windows are held. When the classifiers do not keep up,
+    `put` waits for room by default. With `max_latency`, it never waits:
+    the oldest pending window is dropped to make room, and a window that
+    waited longer than `max_latency` seconds is dropped instead of being
+    classified, so the predictions stay current.
+    """
+
+    def __init__(self, classifiers, callback, max_pending = 1024, max_latency = None, threads = 1):
+        """
+        Args:
+            classifiers (list): Fitted classifiers, with `predict`.
+            callback (callable): Called with the key, the list of the
+                predictions and the seconds the window waited.
+            max_pending (int): Windows held.
+            max_latency (float): Seconds after which a pending window is
+                dropped. Default: None, every window is classified.
+            threads (int): Threads running the classifiers.
+        """
+        self.classifiers = classifiers
+        self.callback = callback
+        self.max_pending = max_pending
+        self.max_latency = max_latency
+
+        self.pending = deque()
+        self.closed = False
+        self.cond = threading.Condition()
+
+        self.stats = {
+            "windows": 0,
+            "predicted": 0,
+            "stale": 0,
+            "overflow": 0,
+            "errors": 0,
+            "latency_seconds": 0.0,
+            "max_latency_seconds": 0.0,
+        }
+
+        self.threads = [threading.Thread(target = self._run, name = "inference", daemon = True) for _ in range(threads)]
+        for _ in self.threads:
+            _.start()
+
+    def put(self, key, features):
+        """
+        Queues the Feature Vector of a window.
+
+        Args:
+            key: Passed on to `callback`, e.g. the device of the window.
+            features (list): Feature Vector.
+        Raises:
+            ValueError: If closed.
+        """
+        with self.cond:
+            if self.closed:
+                raise ValueError("Queueing to a closed Inference.")
+
+            if self.max_latency is None:
+                while len(self.pending) >= self.max_pending and not self.closed:
+                    self.cond.wait()
+            elif len(self.pending) >= self.max_pending:
+                self.pending.popleft()
+                self.stats["overflow"] += 1
+
+            self.pending.append((time.monotonic(), key, features))
+            self.stats["windows"] += 1
+            self.cond.notify_all()
+
+    def close(self, timeout = None):
+        """
+        Classifies the pending windows, and stops the threads.
+        """
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+        for _ in self.threads:
+            _.join(timeout)
+
+    def metrics(self):
+        """
+        Returns the inference metrics.
+
+        Returns:
+            (dict): Windows queued (`windows`), `predicted`, dropped for
+                waiting past `max_latency` (`stale`) or for a full queue
+                (`overflow`), the classifier `errors`, the queue `depth`,
+                and the mean and longest wait of the predicted windows.
+        """
+        with self.cond:
+            out = dict(self.stats)
+            out["depth"] = len(self.pending)
+
+        out["mean_latency_seconds"] = out.pop("latency_seconds") / max(out["predicted"], 1)
+        return out
+
+    def _run(self):
+        """
+        Classifier thread.
+        """
+        while True:
+            with self.cond:
+                while not self.pending and not self.closed:
+                    self.cond.wait()
+
+                if not self.pending:
+                    return
+
+                queued, key, features = self.pending.popleft()
+                self.cond.notify_all()
+
+                latency = time.monotonic() - queued
+                if self.max_latency is not None and latency > self.max_latency:
+                    self.stats["stale"] += 1
+                    continue
+
+            try:
+                out = [_.predict([features])[0] for _ in self.classifiers]
+            except Exception as e:
+                with self.cond:
+                    self.stats["errors"] += 1
+                click.echo("\nERR: {0}".format(e), err = True)
+                continue
+
+            with self.cond:
+                self.stats["predicted"] += 1
+                self.stats["latency_seconds"] += latency
+                self.stats["max_latency_seconds"] = max(self.stats["max_latency_seconds"], latency)
+
+            self.callback(key, out, latency)
@@ -1,15 +1,121 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import functools
 import linecache
 import json
+import os
+import queue
+import threading
 import click
+import numpy as np
 
 from .helper import Helper
 
 WINDOWLEN = 100
 STEP = 20
 
+class ColumnStore(object):
+    """
+    Binary columnar copy of a dataset, created once by `ColumnStore.convert`.
+
+    The labelled segments of the dataset are concatenated in a single float32
+    array of (x, y, z) samples, which is read back as a memory map. The index
+    keeps the range of every segment in that array, along with the source
+    file and line range it was read from. Probing a converted dataset is thus
+    bound by I/O only, as there's nothing left to parse.
+
+    This class assumes that the stores are located in /data/_inertial_db/_columnar
+    directory. This behaviour may be changed by changing the constant STORE_DIR.
+    """
+
+    STORE_DIR = "/data/_inertial_db/_columnar/"
+    SAMPLES = "samples.npy"
+    INDEX = "index.json"
+
+    def __init__(self, name, store_dir = None):
+        """
+        Opens the store of dataset `name`.
+
+        Args:
+            name (str): Dataset Name.
+            store_dir (str): Store directory. Default: STORE_DIR.
+        Raises:
+            ValueError: The dataset is not converted.
+        """
+
+        path = os.path.join(store_dir or self.STORE_DIR, name)
+
+        try:
+            with open(os.path.join(path, self.INDEX)) as minion:
+                self.index = json.loads(minion.read())
+            self.samples = np.load(os.path.join(path, self.SAMPLES), mmap_mode = 'r')
+
+        except FileNotFoundError:
+            raise ValueError
+
+    def tags(self):
+        """
+        Returns the label tags in the store.
+        """
+        return list(self.index)
+
+    def segments(self, tag):
+        """
+        Returns the labelled segments of `tag`. See `UCI.segments`.
+        """
+        for seg in self.index.get(tag, []):
+            samples = self.samples[seg["offset"]:seg["offset"] + seg["length"]]
+            yield seg["file"], seg["start"], seg["end"], samples
+
+    @classmethod
+    def convert(cls, dataset, store_dir = None):
+        """
+        Converts the raw files of a dataset into a store.
+
+        Args:
+            dataset (UCI or Twenté): Dataset probe, reading the raw files.
+            store_dir (str): Store directory. Default: STORE_DIR.
+        Returns:
+            (int): Number of samples stored.
+        """
+
+        path = os.path.join(store_dir or cls.STORE_DIR, dataset.NAME)
+        os.makedirs(path, exist_ok = True)
+
+        index = {}
+        blocks = []
+        offset = 0
+
+        for tag in dataset.tags():
+            index[tag] = []
+            for file_name, start, end, samples in dataset.segments(tag):
+                samples = np.asarray(samples, dtype = np.float32).reshape(-1, 3)
+                index[tag].append({
+                    "file": file_name,
+                    "start": start,
+                    "end": end,
+                    "offset": offset,
+                    "length": len(samples),
+                })
+                blocks.append(samples)
+                offset += len(samples)
+
+        #: Written aside and renamed, the samples first, as the index marks a store complete.
+        samples_path = os.path.join(path, cls.SAMPLES)
+        with open(samples_path + ".tmp", "wb") as minion:
+            np.save(minion, np.vstack([np.empty((0, 3), dtype = np.float32)] + blocks))
+        os.replace(samples_path + ".tmp", samples_path)
+
+        index_path = os.path.join(path, cls.INDEX)
+        with open(index_path + ".tmp", "w") as minion:
+            minion.write(json.dumps(index))
+        os.replace(index_path + ".tmp", index_path)
+
+        WindowIndex.invalidate(store_dir)
+
+        return offset
+
 class UCI(object):
     """
     Provides abstracted access to the raw dataset.
@@ -50,17 +156,51 @@ class UCI(object):
         #"LAYING":               "6",
     }
 
-    def __init__(self):
-        self._load_label()
+    NAME = "UCI"
 
-    def probe(self, tag, window_len = WINDOWLEN, step = STEP):
+    def __init__(self, columnar = True, store_dir = None):
+        """
+        Args:
+            columnar (bool): Reads from the converted `ColumnStore`, if there's one.
+            store_dir (str): Store directory. Default: ColumnStore.STORE_DIR.
+        """
+        self.store = _open_store(self.NAME, store_dir) if columnar else None
+        self.source = self.NAME if self.store is None else self.NAME + ":columnar"
+
+        if self.store is None:
+            self._load_label()
+
+    def provides(self, tag):
         """
+        Checks if the windows of `tag` are probed from this dataset.
         """
+        return tag in self.LABEL_DICT_USED
+
+    def tags(self):
+        """
+        Returns all the label tags of the dataset.
+        """
+        return list(self.LABEL_DICT) if self.store is None else self.store.tags()
+
+    def segments(self, tag):
+        """
+        Returns the labelled segments of `tag`.
+
+        Args:
+            tag (str): Label tag.
+        Returns:
+            (generator): Segments as [file_name, start_line, end_line, samples],
+                samples being a (len, 3) numpy.ndarray.
+        """
+
+        if self.store is not None:
+            yield from self.store.segments(tag)
+            return
 
         lz = lambda x: x.zfill(2)
         for meta in self.labels[self.LABEL_DICT[tag]]:
-            file_name = self.DATA_DIR + self.ACCEL_FILE_FMT.format(lz(meta[0]), lz(meta[1]))
-            line = lambda x: linecache.getline(file_name, x).rstrip().split(" ")
+            file_name = self.ACCEL_FILE_FMT.format(lz(meta[0]), lz(meta[1]))
+            line = lambda x: linecache.getline(self.DATA_DIR + file_name, x).rstrip().split(" ")
 
             conc_dat = []
 
@@ -69,9 +209,15 @@ class UCI(object):
                 if len(l) == 3:
                     conc_dat.append([float(_) for _ in l])
 
-            windows = Helper.sliding_window(conc_dat, window_len, step)
+            yield file_name, int(meta[2]), int(meta[3]), np.array(conc_dat)
+
+    def probe(self, tag, window_len = WINDOWLEN, step = STEP):
+        """
+        Returns the windows of `tag`, segment by segment.
+        """
 
-            yield from windows
+        for _, _, _, samples in self.segments(tag):
+            yield from Helper.sliding_window(samples, window_len, step)
 
     def _load_label(self):
         """
@@ -110,6 +256,7 @@ class Twenté(object):
 
     See `UCI` for more details.
     """
+    NAME = "Twente"
     DATA_DIR = "/data/_inertial_db/Twente/"
     LABLES = "labels.json"
 
@@ -124,30 +271,61 @@ class Twenté(object):
         "RUNNING":              "6",
     }
 
-    def __init__(self):
-        self._load_label()
+    def __init__(self, columnar = True, store_dir = None):
+        """
+        Args:
+            columnar (bool): Reads from the converted `ColumnStore`, if there's one.
+            store_dir (str): Store directory. Default: ColumnStore.STORE_DIR.
+        """
+        self.store = _open_store(self.NAME, store_dir) if columnar else None
+        self.source = self.NAME if self.store is None else self.NAME + ":columnar"
+
+        if self.store is None:
+            self._load_label()
 
     def _load_label(self):
         with open(self.DATA_DIR + self.LABLES) as minion:
             self.labels = json.loads(minion.read())
 
-    def probe(self, tag, window_len = WINDOWLEN, step = STEP):
+    def provides(self, tag):
+        """
+        Checks if the windows of `tag` are probed from this dataset.
+        """
+        return tag in self.LABELS
+
+    def tags(self):
+        """
+        Returns all the label tags of the dataset.
+        """
+        return list(self.labels) if self.store is None else self.store.tags()
+
+    def segments(self, tag):
         """
+        Returns the labelled segments of `tag`. See `UCI.segments`.
         """
-        conc_dat = []
+
+        if self.store is not None:
+            yield from self.store.segments(tag)
+            return
 
         for fdat, rng in self.labels[tag].items():
-            file_name = self.DATA_DIR + fdat
-            line = lambda x: linecache.getline(file_name, x).rstrip().split(",")[1:4]
+            line = lambda x: linecache.getline(self.DATA_DIR + fdat, x).rstrip().split(",")[1:4]
 
             for r in rng:
-                conc_dat[:] = []
+                conc_dat = []
                 for i in range(r[0], r[1] + 1):
                     l = line(i)
                     if len(l) == 3:
                         conc_dat.append([float(_) / 10 for _ in l])
-                windows = Helper.sliding_window(conc_dat, window_len, step)
-                yield from windows
+                yield fdat, r[0], r[1], np.array(conc_dat)
+
+    def probe(self, tag, window_len = WINDOWLEN, step = STEP):
+        """
+        Returns the windows of `tag`, segment by segment.
+        """
+
+        for _, _, _, samples in self.segments(tag):
+            yield from Helper.sliding_window(samples, window_len, step)
 
 class TwentéTwo(Twenté):
     """
@@ -156,6 +334,7 @@ class TwentéTwo(Twenté):
     See `Twenté` for more details.
     """
 
+    NAME = "TwenteTwo"
     DATA_DIR = "/data/_inertial_db/TwenteTwo/"
 
     LABELS = ["WALKING", "JOGGING", "SITTING", "STANDING", "WALKING_UPSTAIRS", "WALKING_DOWNSTAIRS", "BIKING"]
@@ -241,19 +420,339 @@ LabelsE = [
     "JOGGING",
 ]
 
-def ChainProbes(tag, **kwargs):
-    uci = UCI()
-    twn = Twenté()
-    twn2 = TwentéTwo()
+def _open_store(name, store_dir = None):
+    """
+    Opens the `ColumnStore` of dataset `name`.
+
+    Args:
+        name (str): Dataset Name.
+        store_dir (str): Store directory. Default: ColumnStore.STORE_DIR.
+    Returns:
+        (ColumnStore or None): None, if the dataset is not converted.
+    """
+    try:
+        return ColumnStore(name, store_dir)
+    except ValueError:
+        return None
+
+@functools.lru_cache(maxsize = None)
+def Datasets(store_dir = None):
+    """
+    Returns the dataset probes. They're created once per process and store
+    directory, hence the label metadata is loaded (and the stores are
+    opened) only once.
+
+    Args:
+        store_dir (str): Store directory. Default: ColumnStore.STORE_DIR.
+    Returns:
+        (tuple): UCI, Twenté, and TwentéTwo probes.
+    """
+    return UCI(store_dir = store_dir), Twenté(store_dir = store_dir), TwentéTwo(store_dir = store_dir)
+
+def ChainProbes(tag, window_len = WINDOWLEN, step = STEP, prefetch = 256, interleave = False, datasets = None,
+                store_dir = None):
+    """
+    Yields the windows of `tag` from all the datasets, UCI first, then Twenté,
+    then Twenté Two.
+
+    Every dataset is read on its own thread, which prefetches up to `prefetch`
+    windows in a bounded queue while the caller consumes the previous ones.
+    The order of the windows does not depend on the threads.
+
+    Args:
+        tag (str): Label tag.
+        window_len (int): Samples per window.
+        step (int): Samples between consecutive windows.
+        prefetch (int): Windows buffered per dataset. 0 reads the datasets
+            one after the other on the calling thread.
+        interleave (bool): Yields one window from each dataset in turn
+            (round-robin), instead of a dataset after the other.
+        datasets (list): Dataset probes read, a subset of `Datasets(store_dir)`.
+            Default: all of them.
+        store_dir (str): Store directory of the converted datasets.
+            Default: ColumnStore.STORE_DIR.
+    Returns:
+        (generator): Windows, shaped (window_len, 3).
+    """
+
+    names = ["UCI", "Twenté", "Twenté Two"]
+    sources = [(_, __) for _, __ in zip(names, Datasets(store_dir))
+               if __.provides(tag) and (datasets is None or __ in datasets)]
+
+    if not prefetch:
+        for name, probe in sources:
+            click.echo("Yielding {0}".format(name))
+            yield from probe.probe(tag, window_len, step)
+        return
+
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize = prefetch) for _ in sources]
+
+    def reader(probe, out):
+        """
+        Reads the windows of `probe` into `out`, followed by None. Any error
+        is passed on through the queue, in place of the None.
+        """
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    out.put(item, timeout = 0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            for _, _, _, samples in probe.segments(tag):
+                #: Copied here, so that the memory mapped samples are read off the disk on this thread.
+                for window in Helper.sliding_window(np.array(samples), window_len, step):
+                    if not put(window):
+                        return
+            put(None)
+        except Exception as e:
+            put(e)
+
+    threads = [threading.Thread(target = reader, args = (_[1], __), daemon = True) for _, __ in zip(sources, queues)]
+
+    for thread in threads:
+        thread.start()
+
+    def drain(out):
+        item = out.get()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    try:
+        if interleave:
+            click.echo("Yielding {0}".format(", ".join(_[0] for _ in sources)))
+            active = list(queues)
+            while active:
+                for out in list(active):
+                    window = drain(out)
+                    if window is None:
+                        active.remove(out)
+                    else:
+                        yield window
+        else:
+            for (name, _), out in zip(sources, queues):
+                click.echo("Yielding {0}".format(name))
+                window = drain(out)
+                while window is not None:
+                    yield window
+                    window = drain(out)
+    finally:
+        stop.set()
+
+class WindowIndex(object):
+    """
+    Persistent index of the windows of the converted datasets.
+
+    For every (dataset, tag) pair the index keeps the labelled segments as
+    [file_name, start_line, end_line, offset, windows]: the source of the
+    segment, its offset in the `ColumnStore` samples, and the number of
+    windows it yields. It's kept per window length and step, next to the
+    stores, and rebuilt from the store indexes when missing.
+    """
+
+    INDEX_FMT = "windows_{0}_{1}.json"
+
+    def __init__(self, window_len = WINDOWLEN, step = STEP, store_dir = None):
+        """
+        Loads the index, building it if needed.
+
+        Args:
+            window_len (int): Samples per window.
+            step (int): Samples between consecutive windows.
+            store_dir (str): Store directory. Default: ColumnStore.STORE_DIR.
+        Raises:
+            ValueError: A dataset is not converted.
+        """
+
+        self.window_len = window_len
+        self.step = step
+        self.store_dir = store_dir or ColumnStore.STORE_DIR
+        self.stores = {_.NAME: ColumnStore(_.NAME, self.store_dir) for _ in (UCI, Twenté, TwentéTwo)}
+
+        path = os.path.join(self.store_dir, self.INDEX_FMT.format(window_len, step))
+
+        try:
+            with open(path) as minion:
+                self.entries = json.loads(minion.read())
+        except (FileNotFoundError, ValueError):
+            self.entries = self._build()
+            with open(path + ".tmp", "w") as minion:
+                minion.write(json.dumps(self.entries))
+            os.replace(path + ".tmp", path)
+
+    def segments(self, dataset, tag):
+        """
+        Returns the indexed segments of `tag` in `dataset`.
+
+        Returns:
+            (list): Segments as [file_name, start_line, end_line, offset, windows].
+        """
+        return self.entries.get(dataset, {}).get(tag, [])
+
+    def count(self, dataset, tag):
+        """
+        Returns the number of windows of `tag` in `dataset`.
+        """
+        return sum(_[4] for _ in self.segments(dataset, tag))
+
+    @staticmethod
+    def invalidate(store_dir = None):
+        """
+        Removes the indexes of all the window lengths and steps. Called when
+        the stores change.
+        """
+        store_dir = store_dir or ColumnStore.STORE_DIR
+        prefix = WindowIndex.INDEX_FMT.split("{")[0]
+
+        for file_name in os.listdir(store_dir):
+            if file_name.startswith(prefix):
+                os.remove(os.path.join(store_dir, file_name))
+
+    def _build(self):
+        """
+        Builds the index from the store indexes.
+        """
+
+        windows = lambda x: int((x - self.window_len) / self.step) + 1 if x >= self.window_len else 0
+        entries = {}
+
+        for name, store in self.stores.items():
+            entries[name] = {}
+            for tag, segments in store.index.items():
+                entries[name][tag] = [[_["file"], _["start"], _["end"], _["offset"], windows(_["length"])]
+                                      for _ in segments]
+
+        return entries
+
+class WindowSampler(object):
+    """
+    Draws random windows of a tag from the converted datasets.
+
+    The windows of a tag are numbered across the datasets, in the order of
+    `ChainProbes` (and `ChainFeatures`, hence the numbers are also rows of the
+    cached features). A drawn number is located with a sorted search on the
+    cumulative window counts, and the window is a slice of the memory mapped
+    samples, so only the sampled windows are read from the disk.
+    """
+
+    def __init__(self, window_len = WINDOWLEN, step = STEP, seed = None, store_dir = None):
+        """
+        Args:
+            window_len (int): Samples per window.
+            step (int): Samples between consecutive windows.
+            seed (int): Random seed, for reproducible draws.
+            store_dir (str): Store directory. Default: ColumnStore.STORE_DIR.
+        Raises:
+            ValueError: A dataset is not converted.
+        """
+        self.index = WindowIndex(window_len, step, store_dir)
+        self.random = np.random.default_rng(seed)
+        self.datasets = Datasets(store_dir)
+
+    def draw(self, tag, count):
+        """
+        Draws `count` distinct window numbers of `tag`, or all of them if
+        there are fewer. The draw takes O(count), not O(windows of tag).
+
+        Args:
+            tag (str): Label tag.
+            count (int): Number of windows.
+        Returns:
+            (numpy.ndarray): Window numbers, in increasing order.
+        """
+        total = int(self._layout(tag)[0][-1])
+        return np.sort(self.random.choice(total, min(count, total), replace = False))
+
+    def windows(self, tag, ids):
+        """
+        Reads the windows of `tag` of the given numbers.
+
+        Args:
+            tag (str): Label tag.
+            ids (numpy.ndarray): Window numbers, see `draw`.
+        Returns:
+            (numpy.ndarray): The windows, shaped (len(ids), window_len, 3).
+        """
+
+        bounds, start, dataset = self._layout(tag)
+        ids = np.asarray(ids, dtype = np.int64)
+
+        #: Segment of every window, and the offset of the window in its store.
+        seg = np.searchsorted(bounds, ids, side = 'right') - 1
+        offset = start[seg] + (ids - bounds[seg]) * self.index.step
+        dataset = dataset[seg]
+
+        out = np.empty((len(ids), self.index.window_len, 3), dtype = np.float32)
+
+        for i, probe in enumerate(self.datasets):
+            if np.any(dataset == i):
+                view = Helper.sliding_window(self.index.stores[probe.NAME].samples, self.index.window_len)
+                out[dataset == i] = view[offset[dataset == i]]
+
+        return out
+
+    def split(self, tag, ids):
+        """
+        Splits window numbers of `tag` per dataset.
+
+        Args:
+            tag (str): Label tag.
+            ids (numpy.ndarray): Window numbers, see `draw`.
+        Returns:
+            (list): [probe, mask, rows] per dataset providing `tag`: the
+                mask of its numbers in `ids`, and their rows in its windows.
+        """
+
+        ids = np.asarray(ids, dtype = np.int64)
+        out = []
+        first = 0
+
+        for probe in self.datasets:
+            if not probe.provides(tag):
+                continue
+            count = self.index.count(probe.NAME, tag)
+            mask = (ids >= first) & (ids < first + count)
+            out.append([probe, mask, ids[mask] - first])
+            first += count
+
+        return out
+
+    def sample(self, tag, count):
+        """
+        Draws `count` distinct windows of `tag`, or all of them if there are fewer.
+
+        Args:
+            tag (str): Label tag.
+            count (int): Number of windows.
+        Returns:
+            (numpy.ndarray, numpy.ndarray): Window numbers in increasing order,
+                and the windows, shaped (count, window_len, 3).
+        """
+        ids = self.draw(tag, count)
+        return ids, self.windows(tag, ids)
+
+    def _layout(self, tag):
+        """
+        Cumulative window counts of the segments of `tag`, their offsets in
+        the stores, and the datasets they're of.
+        """
 
-    click.echo("Yielding UCI")
-    if tag in uci.LABEL_DICT_USED:
-        yield from uci.probe(tag, **kwargs)
+        start = []
+        windows = []
+        dataset = []
 
-    click.echo("Yielding Twenté")
-    if tag in twn.LABELS:
-        yield from twn.probe(tag, **kwargs)
+        for i, probe in enumerate(self.datasets):
+            if not probe.provides(tag):
+                continue
+            for segment in self.index.segments(probe.NAME, tag):
+                start.append(segment[3])
+                windows.append(segment[4])
+                dataset.append(i)
 
-    click.echo("Yielding Twenté Two")
-    if tag in twn2.LABELS:
-        yield from twn2.probe(tag, **kwargs)
+        return np.cumsum([0] + windows), np.array(start, dtype = np.int64), np.array(dataset, dtype = np.int64)
@@ -20,6 +20,8 @@ from itertools import chain
 
 from .udp import UDP
 from .influx import Influx
+from .cache import QueryCache
+from .entry import query_cache_options
 from .helper import Helper
 from .helper import Stupidity
 from .routines import Routines
@@ -60,7 +62,8 @@ def log_udp(port):
     UDP.start_routine('', port)
 
 @main.command()
-def scratch_3():
+@query_cache_options
+def scratch_3(query_cache_dir, no_query_cache):
 
     fig = plt.figure()
     ax = fig.add_subplot(221)
@@ -73,16 +76,16 @@ def scratch_3():
     # cy = fig.add_subplot(338)
     # cz = fig.add_subplot(339)
 
-    idb = Influx()
+    idb = Influx(query_cache = None if no_query_cache else QueryCache(query_cache_dir))
 
     click.echo("😐  Loading the data from influxdb.")
 
     lim = 400
     offset = 0
 
-    static = list(zip(*idb.probe('accelerometer', limit = lim, offset = offset, tag = 'static_9_sep_1534')))
-    walk   = list(zip(*idb.probe('accelerometer', limit = lim, offset = offset, tag = 'walk_9_sep_1511')))
-    run   = list(zip(*idb.probe('accelerometer', limit = lim, offset = offset, tag = 'run_9_sep_1505')))
+    static = idb.probe_columns('accelerometer', limit = lim, offset = offset, tag = 'static_9_sep_1534')[:, 1:].T
+    walk   = idb.probe_columns('accelerometer', limit = lim, offset = offset, tag = 'walk_9_sep_1511')[:, 1:].T
+    run   = idb.probe_columns('accelerometer', limit = lim, offset = offset, tag = 'run_9_sep_1505')[:, 1:].T
 
     static_ftr = list(Routines.sep_15_2332(*static))
     walk_ftr = list(Routines.sep_15_2332(*walk))
@@ -111,12 +114,13 @@ def scratch_3():
 
 
 @main.command()
+@query_cache_options
 @click.argument('annotation_db', type=str)
-def scratch(annotation_db):
+def scratch(annotation_db, query_cache_dir, no_query_cache):
 
     annotations = Annotation(annotation_db)
 
-    idb = Influx()
+    idb = Influx(query_cache = None if no_query_cache else QueryCache(query_cache_dir))
 
     fig = plt.figure()
     ax = fig.add_subplot(221)
@@ -135,7 +139,7 @@ def scratch(annotation_db):
     walk_x, walk_y, walk_z = zip(*next(run)) #: x, y, z
     walk_x, walk_y, walk_z = zip(*next(run)) #: x, y, z
     walk_x, walk_y, walk_z = zip(*next(trans)) #: x, y, z
-    walk_x_o = list(zip(*[walk_y[_:] for _ in range(16)]))
+    walk_x_o = Helper.sliding_window(walk_y, 16)
 
     tespar = walk_x_o[10][::-1]
 
@@ -175,12 +179,13 @@ def scratch(annotation_db):
     plt.show()
 
 @main.command()
+@query_cache_options
 @click.argument('annotation_db',     type = str)
 @click.argument('pickle_svm_object', type = click.File('wb'))
-def scratch_two(annotation_db, pickle_svm_object):
+def scratch_two(annotation_db, pickle_svm_object, query_cache_dir, no_query_cache):
 
     annotations = Annotation(annotation_db)
-    idb = Influx()
+    idb = Influx(query_cache = None if no_query_cache else QueryCache(query_cache_dir))
 
     click.echo("😐  Loading the annotated data from influxdb.")
 
@@ -227,12 +232,13 @@ def scratch_two(annotation_db, pickle_svm_object):
     pickle.dump(support_vector_classifier, pickle_svm_object)
 
 @main.command()
+@query_cache_options
 @click.argument('annotation_db',     type = str)
 @click.argument('pickled_svm_object', type = click.File('rb'))
-def scratch_three(annotation_db, pickled_svm_object):
+def scratch_three(annotation_db, pickled_svm_object, query_cache_dir, no_query_cache):
 
     annotations = Annotation(annotation_db)
-    idb = Influx()
+    idb = Influx(query_cache = None if no_query_cache else QueryCache(query_cache_dir))
 
     click.echo("😐  Loading the annotated data from influxdb.")
 
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import atexit
+import click
+import json
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+
+class Spool(object):
+    """
+    Write-ahead spool of the points bound to a slow or unreliable backend.
+
+    The points are appended to a binary log on disk and `put` returns, while
+    a background thread drains the log into `sink` in batches. A failing
+    batch is retried with an exponential backoff, and the log keeps growing
+    meanwhile. The position drained up to is saved after every batch, so the
+    points left in the spool at exit (or at a crash) are drained on the next
+    start. A batch may be written twice if a crash happens before its
+    position is saved.
+
+    The log is split in segment files of up to `segment_bytes`. Every record
+    is a header of its length, CRC32 and time, followed by a JSON list of
+    points. A torn record at the end of a segment (an interrupted write) is
+    skipped. A new segment is started on every open.
+
+    The `fsync` policy sets when the appended records are forced to disk:
+    "always" (on every `put`), "interval" (every `fsync_interval` seconds)
+    or "never" (left to the OS).
+    """
+
+    #: (struct) Record header: payload length, payload CRC32, time appended.
+    HEADER = struct.Struct("<IId")
+    SEGMENT_FMT = "spool_{0:08d}.log"
+    SEGMENT_RE = re.compile(r"^spool_(\d{8})\.log$")
+    CURSOR = "cursor.json"
+
+    def __init__(self, spool_dir, sink, batch_size = 5000, fsync = "interval", fsync_interval = 1.0,
+                 segment_bytes = 64 * 1024 ** 2, backoff = 0.5, max_backoff = 30.0):
+        """
+        Args:
+            spool_dir (str): Spool directory.
+            sink (callable): Writes a list of points, raising on failure.
+            batch_size (int): Most points passed to `sink` at once.
+            fsync (str): "always", "interval" or "never".
+            fsync_interval (float): Seconds between the syncs of "interval".
+            segment_bytes (int): Size at which a new segment is started.
+            backoff (float): First retry delay (seconds), doubled per failure.
+            max_backoff (float): Longest retry delay (seconds).
+        Raises:
+            ValueError: Unknown fsync policy.
+        """
+
+        if fsync not in ("always", "interval", "never"):
+            raise ValueError("fsync should be one of always, interval or never.")
+
+        self.spool_dir = spool_dir
+        self.sink = sink
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.segment_bytes = segment_bytes
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        os.makedirs(spool_dir, exist_ok = True)
+
+        self.cond = threading.Condition()
+        self.stop = threading.Event()
+        self.closed = False
+        self.dirty = False
+
+        self.stats = {
+            "points": 0,
+            "drained": 0,
+            "batches": 0,
+            "retries": 0,
+            "skipped_bytes": 0,
+            "last_error": None,
+            "flush_seconds": 0.0,
+            "last_flush_seconds": 0.0,
+        }
+
+        segments = self._segments()
+        self.cursor = self._load_cursor(segments)
+
+        #: (int) Points appended and not drained yet. Unknown for the records of the earlier runs,
+        #  hence counted when read.
+        self.depth = 0
+        self.oldest = None
+
+        self.write_seq = (segments[-1] + 1) if segments else self.cursor[0]
+        self.handle = open(self._path(self.write_seq), "ab")
+        self.write_pos = 0
+
+        self.thread = threading.Thread(target = self._run, name = "spool-drainer", daemon = True)
+        self.thread.start()
+
+        atexit.register(self.close)
+
+    def put(self, points):
+        """
+        Appends the points to the spool.
+
+        Args:
+            points (list): JSON serializable points, passed on to `sink`.
+        Raises:
+            ValueError: If the spool is closed.
+        """
+
+        payload = json.dumps(points, separators = (",", ":")).encode()
+        record = self.HEADER.pack(len(payload), zlib.crc32(payload), time.time()) + payload
+
+        with self.cond:
+            if self.closed:
+                raise ValueError("Writing to a closed Spool.")
+
+            if self.write_pos and self.write_pos + len(record) > self.segment_bytes:
+                self._rotate()
+
+            self.handle.write(record)
+            self.handle.flush()
+
+            if self.fsync == "always":
+                os.fsync(self.handle.fileno())
+            else:
+                self.dirty = True
+
+            self.write_pos += len(record)
+            self.depth += len(points)
+            self.stats["points"] += len(points)
+            self.cond.notify_all()
+
+    def flush(self, timeout = None):
+        """
+        Syncs the spool, and waits for the drainer to catch up.
+
+        Args:
+            timeout (float): Longest wait (seconds). Default: no limit.
+        Returns:
+            (bool): True if the spool was drained.
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self.cond:
+            self._sync()
+            while not self._drained():
+                left = None if deadline is None else deadline - time.monotonic()
+                if left is not None and left <= 0:
+                    return False
+                self.cond.wait(left)
+
+        return True
+
+    def close(self, timeout = 5.0):
+        """
+        Syncs the spool, gives the drainer up to `timeout` seconds to catch
+        up, and stops it. The points left are drained on the next open.
+        """
+
+        with self.cond:
+            if self.closed:
+                return
+
+        self.flush(timeout)
+
+        with self.cond:
+            self.closed = True
+            self.stop.set()
+            self.cond.notify_all()
+
+        self.thread.join()
+
+        with self.cond:
+            self._sync()
+            self.handle.close()
+
+        atexit.unregister(self.close)
+
+    def metrics(self):
+        """
+        Returns the spool metrics.
+
+        Returns:
+            (dict): `depth` (points appended in this run and not drained),
+                `spool_bytes` (bytes on disk not drained), `lag_seconds` (age
+                of the oldest record not drained), `points`, `drained`,
+                `batches`, `retries`, `skipped_bytes` (torn records),
+                `last_error`, and the last and mean drain latency.
+        """
+
+        with self.cond:
+            out = dict(self.stats)
+            out["depth"] = max(self.depth, 0)
+            out["lag_seconds"] = 0.0 if self.oldest is None or self._drained() else time.time() - self.oldest
+            out["spool_bytes"] = self._pending_bytes()
+
+        out["mean_flush_seconds"] = out["flush_seconds"] / max(out["batches"], 1)
+        return out
+
+    def _run(self):
+        """
+        Drainer thread. Reads the batches off the spool, and passes them to
+        the sink, retrying the failures.
+        """
+
+        last_sync = time.monotonic()
+
+        while not self.stop.is_set():
+            with self.cond:
+                if self.fsync == "interval" and time.monotonic() - last_sync >= self.fsync_interval:
+                    self._sync()
+                    last_sync = time.monotonic()
+
+                if self._drained():
+                    self.cond.notify_all()
+                    if self.stop.is_set():
+                        return
+                    self.cond.wait(self.fsync_interval if self.fsync == "interval" else None)
+                    continue
+
+            points, cursor, stamp = self._read_batch()
+
+            if not points:
+                with self.cond:
+                    self.cursor = cursor
+                    self._save_cursor()
+                    self._remove_drained()
+                continue
+
+            self.oldest = stamp
+            delay = self.backoff
+
+            while True:
+                start = time.monotonic()
+                try:
+                    self.sink(points)
+                    break
+                except Exception as e:
+                    with self.cond:
+                        self.stats["retries"] += 1
+                        self.stats["last_error"] = str(e)
+                    if self.stop.wait(delay):
+                        return
+                    delay = min(delay * 2, self.max_backoff)
+
+            elapsed = time.monotonic() - start
+
+            with self.cond:
+                self.cursor = cursor
+                self._save_cursor()
+                self._remove_drained()
+                self.depth -= len(points)
+                self.stats["drained"] += len(points)
+                self.stats["batches"] += 1
+                self.stats["flush_seconds"] += elapsed
+                self.stats["last_flush_seconds"] = elapsed
+                self.cond.notify_all()
+
+    def _read_batch(self):
+        """
+        Reads up to `batch_size` points from the cursor, up to the records
+        appended so far.
+
+        Returns:
+            (tuple): The points, the cursor past them, and the time the first
+                of them was appended.
+        """
+
+        with self.cond:
+            seq, pos = self.cursor
+            write_seq, write_pos = self.write_seq, self.write_pos
+
+        points = []
+        stamp = None
+
+        while len(points) < self.batch_size and (seq, pos) < (write_seq, write_pos):
+            end = write_pos if seq == write_seq else os.path.getsize(self._path(seq))
+
+            with open(self._path(seq), "rb") as minion:
+                minion.seek(pos)
+
+                while len(points) < self.batch_size and pos < end:
+                    header = minion.read(self.HEADER.size)
+                    whole = len(header) == self.HEADER.size
+                    length, crc, appended = self.HEADER.unpack(header) if whole else (end, 0, 0)
+                    payload = minion.read(length)
+
+                    if pos + self.HEADER.size + length > end or zlib.crc32(payload) != crc:
+                        #: A torn record, only the earlier runs leave them at the end of a segment.
+                        self.stats["skipped_bytes"] += end - pos
+                        pos = end
+                        break
+
+                    points += json.loads(payload.decode())
+                    stamp = appended if stamp is None else stamp
+                    pos += self.HEADER.size + length
+
+            if pos >= end and seq < write_seq:
+                seq, pos = self._next_segment(seq, write_seq), 0
+
+        return points, (seq, pos), stamp
+
+    def _drained(self):
+        return self.cursor >= (self.write_seq, self.write_pos)
+
+    def _pending_bytes(self):
+        """
+        Bytes of the segments not drained yet.
+        """
+        seq, pos = self.cursor
+        size = 0
+        for _ in self._segments():
+            if _ == self.write_seq:
+                size += self.write_pos
+            elif _ >= seq:
+                size += os.path.getsize(self._path(_))
+        return max(size - pos, 0)
+
+    def _rotate(self):
+        """
+        Starts a new segment. Called with the lock held.
+        """
+        self._sync()
+        self.handle.close()
+        self.write_seq += 1
+        self.handle = open(self._path(self.write_seq), "ab")
+        self.write_pos = 0
+
+    def _sync(self):
+        """
+        Forces the appended records to disk. Called with the lock held.
+        """
+        if self.dirty and self.fsync != "never" and not self.handle.closed:
+            os.fsync(self.handle.fileno())
+        self.dirty = False
+
+    def _next_segment(self, seq, write_seq):
+        """
+        Returns the segment following `seq`, skipping the missing ones.
+        """
+        later = [_ for _ in self._segments() if seq < _ <= write_seq]
+        return later[0] if later else write_seq
+
+    def _remove_drained(self):
+        """
+        Removes the segments before the cursor. Called with the lock held.
+        """
+        for seq in self._segments():
+            if seq < self.cursor[0]:
+                os.remove(self._path(seq))
+
+    def _segments(self):
+        """
+        Sequence numbers of the segments on disk, in order.
+        """
+        matches = (self.SEGMENT_RE.match(_) for _ in os.listdir(self.spool_dir))
+        return sorted(int(_.group(1)) for _ in matches if _)
+
+    def _path(self, seq):
+        return os.path.join(self.spool_dir, self.SEGMENT_FMT.format(seq))
+
+    def _load_cursor(self, segments):
+        """
+        Loads the saved cursor, or starts at the first segment.
+        """
+        try:
+            with open(os.path.join(self.spool_dir, self.CURSOR)) as minion:
+                seq, pos = json.loads(minion.read())
+        except (IOError, ValueError):
+            seq, pos = (segments[0] if segments else 0), 0
+
+        if segments and seq < segments[0]:
+            seq, pos = segments[0], 0
+
+        if segments and seq not in segments:
+            click.echo("Spool cursor past the segments, starting from the first.", err = True)
+            seq, pos = segments[0], 0
+
+        return (seq, pos)
+
+    def _save_cursor(self):
+        path = os.path.join(self.spool_dir, self.CURSOR)
+        with open(path + ".tmp", "w") as minion:
+            minion.write(json.dumps(list(self.cursor)))
+        os.replace(path + ".tmp", path)
@@ -0,0 +1,508 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import atexit
+import click
+import json
+import os
+import threading
+import time
+import numpy as np
+
+from itertools import chain
+from numpy.lib.format import open_memmap
+from .influx import Influx
+from .points import JSONSeries, BufferedWriter
+
+#: (str) Backend used by `Backend` when none is named: "influx", or "local"
+#: optionally followed by ":<store directory>".
+BACKEND = os.environ.get("INERTIAL_BACKEND", "influx")
+
+def Backend(spec = None, **kwargs):
+    """
+    Opens a time series backend. Both backends, `Influx` and `LocalStore`,
+    provide `write`, `flush`, `close`, `metrics`, `probe`, `probe_blocks`,
+    `probe_columns`, `probe_annotation` and `import_json`.
+
+    The serial loggers of Data-Store write to the InfluxDB client directly,
+    in their own host tagged schema, and are not opened through a backend.
+
+    Args:
+        spec (str): "influx", or "local" optionally followed by
+            ":<store directory>". Default: BACKEND, which is read from the
+            INERTIAL_BACKEND environment variable.
+        kwargs: Passed on to the backend. `query_cache`, `spool_dir` and
+            `fsync` are dropped for the `LocalStore`.
+    Returns:
+        (Influx or LocalStore): The backend.
+    Raises:
+        ValueError: Unknown backend.
+    """
+
+    name, _, path = (spec or BACKEND).partition(":")
+
+    if name == "influx":
+        return Influx(**kwargs)
+
+    if name == "local":
+        for _ in ["query_cache", "spool_dir", "fsync"]:
+            kwargs.pop(_, None)
+        return LocalStore(path or None, **kwargs)
+
+    raise ValueError("Unknown backend `{0}`.".format(name))
+
+class LocalStore(object):
+    """
+    Embedded, append-only time series store, implementing the `Influx` proxy
+    API without a server.
+
+    Every measurement is kept in a directory of segment files. A segment is a
+    .npy record array of up to SEGMENT_SIZE (time, tag, fields) records,
+    written and read back as a memory map. It's created with SEGMENT_MIN
+    records, and doubled in size as it fills up. The manifest keeps, per segment, the
+    number of records, their time range, and whether their times are in
+    order. It's the time index: the segments out of a queried range are
+    skipped, and the in order ones are binary searched. A measurement keeps
+    the three fields it was first written with, <x, y, z> or <yaw, pitch, roll>,
+    and the `mmt_class` tags are interned in the manifest.
+
+    Unlike the InfluxDB, a point written twice at the same time is stored
+    twice. The writes are buffered, and flushed every `batch_size` points,
+    every `flush_interval` seconds, on `flush`, on `close` and at exit.
+
+    This class assumes that the store is located in /data/_inertial_db/_timeseries
+    directory. This behaviour may be changed by changing the constant STORE_DIR.
+    """
+
+    STORE_DIR = "/data/_inertial_db/_timeseries/"
+    MANIFEST = "manifest.json"
+    #: (int) Records per full segment file.
+    SEGMENT_SIZE = 1 << 20
+    #: (int) Records a new segment file is created with.
+    SEGMENT_MIN = 1 << 12
+    #: (numpy.dtype) Segment record. `tag` is the index of the tag in the manifest, -1 if untagged.
+    RECORD = np.dtype([('time', '<i8'), ('tag', '<i4'), ('fields', '<f8', (3,))])
+
+    def __init__(self, store_dir = None, batch_size = BufferedWriter.BATCH_SIZE,
+                 flush_interval = BufferedWriter.FLUSH_INTERVAL):
+        """
+        Args:
+            store_dir (str): Store directory. Default: STORE_DIR.
+            batch_size (int): Points buffered before a flush.
+            flush_interval (float): Longest time (seconds) a point is kept
+                buffered, checked on every write.
+        """
+        self.store_dir = store_dir or self.STORE_DIR
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        os.makedirs(self.store_dir, exist_ok = True)
+
+        self.lock = threading.RLock()
+        self.maps = {}
+        self.pending = {}
+        self.depth = 0
+        self.last_flush = time.monotonic()
+        self.last_stamp = 0
+        self.stats = {
+            "points": 0,
+            "written": 0,
+            "flushes": 0,
+            "flush_seconds": 0.0,
+            "last_flush_seconds": 0.0,
+            "max_flush_seconds": 0.0,
+        }
+
+        self._load_manifest()
+        atexit.register(self.flush)
+
+    def write(self, dat, data_class, timestamp = None):
+        """
+        Logs `dat` to the store. See `Influx.write`.
+
+        Args:
+            dat (dict): Data dictionary.
+            data_class (str): The mmt_class tag attached to the measurement.
+            timestamp (float): Unix time (seconds) of the sample. Default:
+                None, the time it's written at.
+        """
+        xyz = ['x', 'y', 'z']
+        ypr = ['yaw', 'pitch', 'roll']
+
+        if timestamp is not None:
+            stamp = int(round(timestamp * 1e6)) * 1000
+        else:
+            with self.lock:
+                self.last_stamp = max(int(time.time() * 1e6) * 1000, self.last_stamp + 1000)
+                stamp = self.last_stamp
+
+        self.write_points([
+            {
+                "measurement": name,
+                "tags": {"mmt_class": data_class},
+                "time": stamp,
+                "fields": {_: __ for (_, __) in zip(keys, dat[name])}
+            } for name, keys in [('accelerometer', xyz), ('gyroscope', xyz), ('magnetometer', xyz), ('ahrs', ypr)]
+        ])
+
+    def write_points(self, points):
+        """
+        Appends InfluxDB JSON points. Points without a time are stamped with
+        the current time.
+
+        Args:
+            points (list): Points with a "measurement", the "mmt_class" of
+                their "tags", a "time" (see `JSONSeries.nanoseconds`) and
+                their "fields".
+        """
+        now = int(time.time() * 1e9)
+
+        with self.lock:
+            for point in points:
+                fields = point["fields"]
+                stamp = JSONSeries.nanoseconds(point["time"]) if "time" in point else now
+                tag = (point.get("tags") or {}).get("mmt_class")
+                self.pending.setdefault(point["measurement"], []).append((stamp, tag, fields))
+
+            self.depth += len(points)
+            self.stats["points"] += len(points)
+
+            if self.depth >= self.batch_size or time.monotonic() - self.last_flush > self.flush_interval:
+                self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered points to the segments, and saves the manifest.
+        """
+        with self.lock:
+            start = time.monotonic()
+            self.last_flush = start
+
+            if not self.depth:
+                return
+
+            for name, rows in self.pending.items():
+                self._append(name, rows)
+
+            for segment in self.maps.values():
+                segment.flush()
+
+            self._save_manifest()
+
+            elapsed = time.monotonic() - start
+            self.stats["written"] += self.depth
+            self.stats["flushes"] += 1
+            self.stats["flush_seconds"] += elapsed
+            self.stats["last_flush_seconds"] = elapsed
+            self.stats["max_flush_seconds"] = max(self.stats["max_flush_seconds"], elapsed)
+            self.pending = {}
+            self.depth = 0
+
+    def close(self):
+        """
+        Flushes the buffered points, and closes the segments.
+        """
+        with self.lock:
+            self.flush()
+            self.maps = {}
+        atexit.unregister(self.flush)
+
+    def metrics(self):
+        """
+        Returns the write metrics, as `BufferedWriter.metrics`.
+        """
+        with self.lock:
+            out = dict(self.stats)
+            out["depth"] = self.depth
+
+        out["mean_flush_seconds"] = out["flush_seconds"] / max(out["flushes"], 1)
+        return out
+
+    def probe(self, name, *args, **kwargs):
+        """
+        Returns the measurements taken on a particular "probe".
+        Args:
+            name (str): The name of the Probe.
+            tag (str): The mmt_class tag attached to the measurement.
+            time_lower (str or int): Lower limit of time, exclusive. See
+                `JSONSeries.nanoseconds`.
+            time_upper (str or int): Upper limit of time, exclusive.
+            limit (int): Limits the number of rows returned.
+            offset (int): Rows skipped, with a `limit`.
+        Returns:
+            generator: Generator of the probe columns.
+        """
+        return iter(self.probe_columns(name, **kwargs)[:, 1:].tolist())
+
+    def probe_blocks(self, name, chunk_size = 10000, *args, **kwargs):
+        """
+        Yields the measurements taken on a particular "probe" in blocks of
+        up to `chunk_size` rows. See `Influx.probe_blocks`. The matching
+        records of a segment are read at a time.
+        """
+        pending = np.empty(0, self.RECORD)
+
+        for records in self._select(name, kwargs):
+            pending = np.concatenate([pending, records])
+
+            while len(pending) >= chunk_size:
+                yield self._columns(pending[:chunk_size])
+                pending = pending[chunk_size:]
+
+        if len(pending):
+            yield self._columns(pending)
+
+    def probe_columns(self, name, *args, **kwargs):
+        """
+        Returns the measurements taken on a particular "probe" as one array.
+        See `Influx.probe_columns`.
+        """
+        return self._columns(np.concatenate([np.empty(0, self.RECORD)] + list(self._select(name, kwargs))))
+
+    def probe_annotation(self, name, annotation_dict, wouldchain = False, columns = False, *args, **kwargs):
+        """
+        Returns the measurements of every annotated time range. See
+        `Influx.probe_annotation`, whose query coalescing options are
+        accepted and ignored, as the ranges are looked up in the time index.
+        """
+        for _ in ['merge_gap', 'per_request', 'jobs']:
+            kwargs.pop(_, None)
+
+        out = []
+        for time_range in annotation_dict:
+            kwargs['time_lower'] = int(float(time_range[0]) // 1000) * 10 ** 9
+            kwargs['time_upper'] = int(float(time_range[1]) // 1000) * 10 ** 9
+            block = self.probe_columns(name, **kwargs)
+            out.append(block if columns else block[:, 1:].tolist())
+
+        if wouldchain is True:
+            yield chain(*out)
+        else:
+            yield from out
+
+    def import_json(self, file_handle, relative_time = True, batch_size = None, jobs = 1, checkpoint = None):
+        """
+        Imports an InfluxDB JSON query dump, parsed incrementally by
+        `JSONSeries`. The `mmt_class` is taken from the tags of a series, or
+        from its column. `jobs` and `checkpoint` are accepted for the `Influx`
+        API, and ignored.
+
+        Returns:
+            (bool): True if the import completed.
+        """
+        start = time.monotonic()
+        rows = 0
+
+        try:
+            for series, row in JSONSeries(file_handle):
+                columns = series["columns"]
+                values = dict(zip(columns, row))
+                tags = dict(series["tags"] or {})
+
+                if "mmt_class" in values:
+                    tags["mmt_class"] = values.pop("mmt_class")
+
+                self.write_points([{
+                    "measurement": series["name"],
+                    "tags": tags,
+                    "time": row[0],
+                    "fields": {_: float(__) for _, __ in values.items() if _ != "time" and __ is not None}
+                }])
+                rows += 1
+
+            self.flush()
+
+        except json.decoder.JSONDecodeError:
+            click.echo("Invalid JSON.")
+            return False
+
+        except Exception as e:
+            click.echo("ERR:" + str(e))
+            return False
+
+        elapsed = max(time.monotonic() - start, 1e-9)
+        click.echo("Imported {0} rows in {1:.1f}s, {2:.0f} rows/s.".format(rows, elapsed, rows / elapsed))
+        return True
+
+    def _append(self, name, rows):
+        """
+        Appends the (time, tag, fields) rows of a measurement to its segments.
+        """
+        meta = self.manifest["measurements"].setdefault(name, {"fields": None, "segments": []})
+
+        if meta["fields"] is None:
+            keys = rows[0][2]
+            meta["fields"] = (['x', 'y', 'z'] if 'x' in keys else
+                              ['yaw', 'pitch', 'roll'] if 'yaw' in keys else sorted(keys)[:3])
+
+        records = np.empty(len(rows), self.RECORD)
+        records['time'] = [_[0] for _ in rows]
+        records['tag'] = [-1 if _[1] is None else self._tag_id(_[1]) for _ in rows]
+        records['fields'] = [[fields.get(_, np.nan) for _ in meta["fields"]] for _, _, fields in rows]
+
+        while len(records):
+            if not meta["segments"] or meta["segments"][-1]["count"] == self.SEGMENT_SIZE:
+                meta["segments"].append({
+                    "file": "{0}/segment_{1:06d}.npy".format(name, len(meta["segments"])),
+                    "count": 0,
+                    "time_min": None,
+                    "time_max": None,
+                    "sorted": True,
+                })
+
+            seg = meta["segments"][-1]
+            taken, records = records[:self.SEGMENT_SIZE - seg["count"]], records[self.SEGMENT_SIZE - seg["count"]:]
+            times = taken['time']
+
+            end = seg["count"] + len(taken)
+            self._reserve(seg["file"], seg["count"], end)[seg["count"]:end] = taken
+
+            seg["sorted"] = bool(seg["sorted"] and np.all(np.diff(times) >= 0) and
+                                 (seg["time_max"] is None or times[0] >= seg["time_max"]))
+            seg["time_min"] = int(times.min()) if seg["time_min"] is None else min(seg["time_min"], int(times.min()))
+            seg["time_max"] = int(times.max()) if seg["time_max"] is None else max(seg["time_max"], int(times.max()))
+            seg["count"] += len(taken)
+
+    def _select(self, name, arguments):
+        """
+        Yields the records of a measurement matching the tag and the time
+        limits, in the order of time, past the `offset` and up to the `limit`.
+        """
+        self.flush()
+
+        meta = self.manifest["measurements"].get(name)
+        if meta is None:
+            return
+
+        tag = arguments.get('tag')
+        lower = JSONSeries.nanoseconds(arguments['time_lower']) if arguments.get('time_lower') else None
+        upper = JSONSeries.nanoseconds(arguments['time_upper']) if arguments.get('time_upper') else None
+        limit = arguments.get('limit') or None
+        offset = (arguments.get('offset') or 0) if limit else 0
+
+        if tag and tag not in self.manifest["tags"]:
+            return
+
+        segments = [_ for _ in meta["segments"] if _["count"] and
+                    (lower is None or _["time_max"] > lower) and
+                    (upper is None or _["time_min"] < upper)]
+
+        #: In order segments with disjoint time ranges are streamed, the others are merged and sorted.
+        ordered = (all(_["sorted"] for _ in segments) and
+                   all(_["time_max"] <= __["time_min"] for _, __ in zip(segments, segments[1:])))
+        parts = (self._match(_, tag, lower, upper) for _ in segments)
+
+        if not ordered:
+            merged = np.concatenate([np.empty(0, self.RECORD)] + list(parts))
+            parts = [merged[np.argsort(merged['time'], kind = 'stable')]]
+
+        for records in parts:
+            if offset:
+                skip = min(offset, len(records))
+                records, offset = records[skip:], offset - skip
+
+            if limit is not None:
+                records = records[:limit]
+                limit -= len(records)
+
+            if len(records):
+                yield records
+
+            if limit == 0:
+                return
+
+    def _match(self, seg, tag, lower, upper):
+        """
+        Returns the records of a segment matching the tag and the time limits.
+        """
+        records = self._segment(seg["file"], 'r')[:seg["count"]]
+        times = records['time']
+
+        if seg["sorted"]:
+            records = records[np.searchsorted(times, lower, 'right') if lower is not None else 0:
+                              np.searchsorted(times, upper, 'left') if upper is not None else len(records)]
+        else:
+            mask = np.ones(len(records), dtype = bool)
+            if lower is not None:
+                mask &= times > lower
+            if upper is not None:
+                mask &= times < upper
+            records = records[mask]
+
+        if tag:
+            records = records[records['tag'] == self.manifest["tags"].index(tag)]
+
+        return np.array(records)
+
+    def _columns(self, records):
+        """
+        Converts the records to the (n, 4) array of `Influx.probe_columns`.
+        """
+        out = np.empty((len(records), 4))
+        out[:, 0] = records['time'] / 1e9
+        out[:, 1:] = records['fields']
+        return out
+
+    def _tag_id(self, tag):
+        """
+        Index of the tag in the manifest, interning it.
+        """
+        tags = self.manifest["tags"]
+        if tag not in tags:
+            tags.append(tag)
+        return tags.index(tag)
+
+    def _segment(self, file_name, mode):
+        """
+        Opens a segment memory map. The maps are kept open, and reopened once
+        for writing.
+        """
+        if file_name in self.maps and (mode == 'r' or self.maps[file_name].mode != 'r'):
+            return self.maps[file_name]
+
+        segment = np.load(os.path.join(self.store_dir, file_name), mmap_mode = mode)
+        self.maps[file_name] = segment
+        return segment
+
+    def _reserve(self, file_name, count, size):
+        """
+        Opens a segment memory map for writing, holding at least `size`
+        records. A missing segment is created with SEGMENT_MIN records, and a
+        short one is doubled, up to SEGMENT_SIZE: its first `count` records
+        are copied to a larger file, which then replaces it.
+        """
+        path = os.path.join(self.store_dir, file_name)
+        segment = self._segment(file_name, 'r+') if os.path.exists(path) else None
+
+        if segment is not None and len(segment) >= size:
+            return segment
+
+        capacity = self.SEGMENT_MIN if segment is None else max(len(segment), 1)
+        while capacity < size:
+            capacity *= 2
+
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        grown = open_memmap(path + ".tmp", mode = 'w+', dtype = self.RECORD,
+                            shape = (min(capacity, self.SEGMENT_SIZE),))
+        if segment is not None:
+            grown[:count] = segment[:count]
+        grown.flush()
+        os.replace(path + ".tmp", path)
+
+        self.maps[file_name] = grown
+        return grown
+
+    def _load_manifest(self):
+        """
+        Loads the manifest, starting afresh if it's missing.
+        """
+        try:
+            with open(os.path.join(self.store_dir, self.MANIFEST)) as minion:
+                self.manifest = json.loads(minion.read())
+        except FileNotFoundError:
+            self.manifest = {"tags": [], "measurements": {}}
+
+    def _save_manifest(self):
+        path = os.path.join(self.store_dir, self.MANIFEST)
+        with open(path + ".tmp", "w") as minion:
+            minion.write(json.dumps(self.manifest))
+        os.replace(path + ".tmp", path)
@@ -1,7 +1,370 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import asyncio
+import click
+import functools
+import operator
+import os
+import socket
 import socketserver
+import struct
+import threading
+import time
+import numpy as np
+
+from collections import deque, namedtuple
+
+from concurrent.futures import ThreadPoolExecutor
+
+class ColumnParser(object):
+    """
+    Precompiled parser of the CSV datagrams, for a projection of the columns.
+
+    The column indices are resolved once, and only the projected fields of a
+    line are converted, straight from bytes. A line with the wrong number of
+    fields is rejected by counting its delimiters, before it's split.
+    """
+
+    def __init__(self, columns, header):
+        """
+        Args:
+            columns (list): Names of the columns parsed, in order.
+            header (list): Names of all the columns of a line.
+        Raises:
+            ValueError: A column is not in the header.
+        """
+        self.columns = list(columns)
+        self.delimiters = len(header) - 1
+        self.index = [header.index(_) for _ in columns]
+        self.pick = operator.itemgetter(*self.index)
+
+    def parse(self, line):
+        """
+        Parses a line.
+
+        Args:
+            line (bytes): The CSV line.
+        Returns:
+            (numpy.ndarray): The projected columns, float64.
+        Raises:
+            ValueError: Malformed line.
+        """
+        if line.count(b",") != self.delimiters:
+            raise ValueError("Expected {0} columns.".format(self.delimiters + 1))
+
+        return np.array(self.pick(line.split(b",")), dtype = np.float64)
+
+    def parse_into(self, lines, out):
+        """
+        Parses many lines into a preallocated array, skipping the malformed ones.
+
+        Args:
+            lines (list): The CSV lines, bytes.
+            out (numpy.ndarray): Array of at least len(lines) rows, and a
+                column per projected column.
+        Returns:
+            (int): Number of rows filled, from the top of `out`.
+        """
+        rows = [self.pick(_.split(b",")) for _ in lines if _.count(b",") == self.delimiters]
+
+        try:
+            out[:len(rows)] = np.array(rows, dtype = np.float64).reshape(len(rows), len(self.index))
+            return len(rows)
+        except ValueError:
+            pass
+
+        #: A field is not a number, the rows are converted one by one.
+        count = 0
+        for row in rows:
+            try:
+                out[count] = np.array(row, dtype = np.float64)
+                count += 1
+            except ValueError:
+                pass
+        return count
+
+class Sample(object):
+    """
+    Decoded sample, the probe data returned by `UDP.parse`.
+
+    The parsed columns are held in a single float array, and the probes are
+    sliced off it on access. `sample['accelerometer']` reads as it did on the
+    dict of lists.
+    """
+
+    __slots__ = ('values',)
+
+    #: (float) Earliest plausible Unix time (2001-01-01) of a device clock.
+    #: Earlier times are of an uptime clock, or of none.
+    MIN_UNIX_TIME = 978307200.0
+
+    #: (list) Columns parsed, in the order of `values`.
+    COLUMNS = ['Timestamp', 'Accel_X', 'Accel_Y', 'Accel_Z', 'RotRate_X', 'RotRate_Y', 'RotRate_Z',
+               'MagX', 'MagY', 'MagZ', 'Roll', 'Pitch', 'Yaw']
+    #: (dict) Probe name: slice of `values`.
+    PROBES = {
+        'accelerometer': slice(1, 4),
+        'gyroscope':     slice(4, 7),
+        'magnetometer':  slice(7, 10),
+        'ahrs':          slice(10, 13),
+    }
+
+    def __init__(self, values):
+        """
+        Args:
+            values (numpy.ndarray): Values of the COLUMNS.
+        """
+        self.values = values
+
+    def __getitem__(self, name):
+        return self.values[self.PROBES[name]].tolist()
+
+    def __contains__(self, name):
+        return name in self.PROBES
+
+    def keys(self):
+        return self.PROBES.keys()
+
+    @property
+    def timestamp(self):
+        """
+        The device time of the sample.
+        """
+        return float(self.values[0])
+
+    @property
+    def unix_time(self):
+        """
+        The device time of the sample as Unix time (seconds), None if the
+        device gave no plausible wall clock time.
+        """
+        stamp = float(self.values[0])
+        return stamp if np.isfinite(stamp) and stamp >= self.MIN_UNIX_TIME else None
+
+class Block(object):
+    """
+    Decoded samples of a receive batch, handed at once to a block handler.
+
+    The rows of `values` are samples, in the columns of `Sample`, and the
+    probes are sliced off it as (n, 3) arrays. Iterating yields the samples.
+    """
+
+    __slots__ = ('values',)
+
+    COLUMNS = Sample.COLUMNS
+    PROBES = Sample.PROBES
+
+    def __init__(self, values):
+        """
+        Args:
+            values (numpy.ndarray): Samples, shaped (n, len(COLUMNS)).
+        """
+        self.values = values
+
+    def __getitem__(self, name):
+        return self.values[:, self.PROBES[name]]
+
+    def __contains__(self, name):
+        return name in self.PROBES
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return (Sample(_) for _ in self.values)
+
+    def keys(self):
+        return self.PROBES.keys()
+
+    @property
+    def timestamps(self):
+        """
+        The device times of the samples.
+        """
+        return self.values[:, 0]
+
+class Packet(object):
+    """
+    Binary datagram format of the sensor stream, version 1.
+
+    A packet is a little-endian header followed by `count` samples:
+
+        magic      2s   b"IN"
+        version    B    1
+        count      B    Samples in the packet.
+        device     I    Device id.
+        sequence   I    Sequence number of the first sample, +1 per sample.
+        timestamp  d    Unix time (seconds) of the first sample, 0 if
+                        the device has no wall clock.
+        period     f    Seconds between consecutive samples.
+
+    Every sample is 12 float32, the `Sample.COLUMNS` past the timestamp:
+    accelerometer, gyroscope and magnetometer <x, y, z>, and roll, pitch, yaw.
+    A sample takes 48 bytes, against some 330 of its CSV line. The samples are
+    decoded as a view on the datagram, without copies. A gap in the sequence
+    numbers of a device shows the packets lost on the way.
+
+    CSV datagrams never start with the magic, and are parsed as before.
+    """
+
+    MAGIC = b"IN"
+    VERSION = 1
+    HEADER = struct.Struct("<2sBBIIdf")
+    #: (int) float32 values per sample.
+    WIDTH = 12
+    #: (int) Most samples per packet.
+    MAX_COUNT = 255
+
+    Header = namedtuple("Header", ["version", "count", "device", "sequence", "timestamp", "period"])
+
+    @staticmethod
+    def encode(device, sequence, timestamp, period, samples):
+        """
+        Encodes a packet.
+
+        Args:
+            device (int): Device id.
+            sequence (int): Sequence number of the first sample.
+            timestamp (float): Device time of the first sample.
+            period (float): Seconds between consecutive samples.
+            samples (numpy.ndarray): Samples, shaped (count, WIDTH).
+        Returns:
+            (bytes): The packet.
+        Raises:
+            ValueError: Too many samples, or of the wrong width.
+        """
+        samples = np.asarray(samples, dtype = '<f4').reshape(-1, Packet.WIDTH)
+
+        if len(samples) > Packet.MAX_COUNT:
+            raise ValueError("At most {0} samples per packet.".format(Packet.MAX_COUNT))
+
+        header = Packet.HEADER.pack(Packet.MAGIC, Packet.VERSION, len(samples), device, sequence & 0xFFFFFFFF,
+                                    timestamp, period)
+        return header + samples.tobytes()
+
+    @staticmethod
+    def is_packet(datagram):
+        """
+        Whether the datagram is a binary packet, rather than a CSV line.
+        """
+        return datagram[:2] == Packet.MAGIC
+
+    @staticmethod
+    def decode(datagram):
+        """
+        Decodes a packet.
+
+        Args:
+            datagram (bytes): The packet.
+        Returns:
+            (tuple): The `Header`, and the samples shaped (count, WIDTH), a
+                read-only float32 view on the datagram.
+        Raises:
+            ValueError: Malformed packet, or of an unknown version.
+        """
+        if len(datagram) < Packet.HEADER.size:
+            raise ValueError("Truncated packet header.")
+
+        header = Packet.Header(*Packet.HEADER.unpack_from(datagram)[1:])
+
+        if header.version != Packet.VERSION:
+            raise ValueError("Unknown packet version {0}.".format(header.version))
+
+        if len(datagram) != Packet.HEADER.size + header.count * Packet.WIDTH * 4:
+            raise ValueError("Packet of {0} bytes, expected {1} samples.".format(len(datagram), header.count))
+
+        samples = np.frombuffer(datagram, dtype = '<f4', count = header.count * Packet.WIDTH,
+                                offset = Packet.HEADER.size)
+        return header, samples.reshape(header.count, Packet.WIDTH)
+
+class Sessions(object):
+    """
+    Per-device state of a live stream, e.g. a `FeatureStream` per wearer.
+
+    A session is created by `factory` on the first data of a device, and
+    evicted once the device stays silent for `idle` seconds. The idle
+    sessions are swept on `get`, at most every `idle / 2` seconds, so that
+    no extra thread is needed. Every session carries a lock, to be held
+    while its state is updated from the handler threads.
+    """
+
+    class Session(object):
+        __slots__ = ('device', 'state', 'lock', 'last')
+
+        def __init__(self, device, state):
+            self.device = device
+            self.state = state
+            self.lock = threading.Lock()
+            self.last = time.monotonic()
+
+    def __init__(self, factory, idle = 60.0, on_evict = None):
+        """
+        Args:
+            factory (callable): Returns the state of a new session, called
+                with the device.
+            idle (float): Seconds of silence after which a session is evicted.
+            on_evict (callable): Called with every evicted `Session`.
+        """
+        self.factory = factory
+        self.idle = idle
+        self.on_evict = on_evict
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.swept = time.monotonic()
+        self.stats = {"created": 0, "evicted": 0}
+
+    def get(self, device):
+        """
+        Returns the session of the device, created if missing.
+
+        Args:
+            device: Device id, or address of the sender.
+        Returns:
+            (Sessions.Session): The session, `state` holds the device state.
+        """
+        now = time.monotonic()
+
+        with self.lock:
+            session = self.sessions.get(device)
+            if session is None:
+                session = self.sessions[device] = self.Session(device, self.factory(device))
+                self.stats["created"] += 1
+            session.last = now
+
+            evicted = self._sweep(now) if now - self.swept >= self.idle / 2 else []
+
+        if self.on_evict is not None:
+            for _ in evicted:
+                self.on_evict(_)
+
+        return session
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __contains__(self, device):
+        return device in self.sessions
+
+    def metrics(self):
+        """
+        Returns the `active`, `created` and `evicted` session counts.
+        """
+        with self.lock:
+            out = dict(self.stats)
+            out["active"] = len(self.sessions)
+        return out
+
+    def _sweep(self, now):
+        """
+        Removes the idle sessions. Called with the lock held.
+        """
+        self.swept = now
+        evicted = [_ for _ in self.sessions.values() if now - _.last > self.idle]
+        for _ in evicted:
+            del self.sessions[_.device]
+        self.stats["evicted"] += len(evicted)
+        return evicted
 
 class UDP(socketserver.DatagramRequestHandler):
     """
@@ -13,14 +376,18 @@ class UDP(socketserver.DatagramRequestHandler):
     #: (str) Pattern of the 
     COL_HEAD = "Timestamp,Accel_X,Accel_Y,Accel_Z,Roll,Pitch,Yaw,Quat.X,Quat.Y,Quat.Z,Quat.W,RM11,RM12,RM13,RM21,RM22,RM23,RM31,RM32,RM33,GravAcc_X,GravAcc_Y,GravAcc_Z,UserAcc_X,UserAcc_Y,UserAcc_Z,RotRate_X,RotRate_Y,RotRate_Z,MagHeading,TrueHeading,HeadingAccuracy,MagX,MagY,MagZ,Lat,Long,LocAccuracy,Course,Speed,Altitude".split(",")
 
-    def _transform_dict(self, data):
+    #: (ColumnParser) Parser of the columns of a `Sample`.
+    PARSER = ColumnParser(Sample.COLUMNS, COL_HEAD)
+
+    @classmethod
+    def _transform_dict(cls, data):
         """
         Creates a Dictionary of the incoming UDP data string.
         """
         column_data = data.split(",")
 
-        if len(column_data) == len(self.COL_HEAD):
-            return {self.COL_HEAD[_]: float(column_data[_]) for _ in range(0, len(self.COL_HEAD))}
+        if len(column_data) == len(cls.COL_HEAD):
+            return {cls.COL_HEAD[_]: float(column_data[_]) for _ in range(0, len(cls.COL_HEAD))}
 
         return dict()
 
@@ -28,20 +395,62 @@ class UDP(socketserver.DatagramRequestHandler):
         """
         Translates the dict to standard probe data.
         """
+        return self.parse(self.rfile.readline())
+
+    @classmethod
+    def parse(cls, datagram):
+        """
+        Translates a datagram to standard probe data.
 
-        data = self._transform_dict(self.rfile.readline().rstrip().decode())
+        Args:
+            datagram (bytes): The CSV line of a sample.
+        Returns:
+            (Sample): Probe data.
+        Raises:
+            ValueError: Malformed datagram.
+        """
 
-        acce = ['Accel_X', 'Accel_Y', 'Accel_Z']
-        gyro = ['RotRate_X', 'RotRate_Y', 'RotRate_Z']
-        magn = ['MagX', 'MagY', 'MagZ']
-        ahrs = ['Roll', 'Pitch', 'Yaw']
+        return Sample(cls.PARSER.parse(datagram))
 
-        return {
-            'accelerometer': [data[_] for _ in acce],
-            'gyroscope':     [data[_] for _ in gyro],
-            'magnetometer':  [data[_] for _ in magn],
-            'ahrs':          [data[_] for _ in ahrs]
-        }
+    @classmethod
+    def decode(cls, datagram):
+        """
+        Translates a datagram, binary `Packet` or CSV line, to standard probe data.
+
+        Args:
+            datagram (bytes): The datagram.
+        Returns:
+            (tuple): The packet `Header` (None for a CSV line), and the list
+                of `Sample` of the datagram.
+        Raises:
+            ValueError: Malformed datagram.
+        """
+        header, values = cls.values(datagram)
+        return header, [Sample(_) for _ in values]
+
+    @classmethod
+    def values(cls, datagram):
+        """
+        Translates a datagram, binary `Packet` or CSV line, to an array of samples.
+
+        Args:
+            datagram (bytes): The datagram.
+        Returns:
+            (tuple): The packet `Header` (None for a CSV line), and the
+                samples shaped (count, len(Sample.COLUMNS)).
+        Raises:
+            ValueError: Malformed datagram.
+        """
+        if not Packet.is_packet(datagram):
+            return None, cls.PARSER.parse(datagram).reshape(1, -1)
+
+        header, block = Packet.decode(datagram)
+
+        values = np.empty((header.count, len(Sample.COLUMNS)))
+        values[:, 0] = header.timestamp + header.period * np.arange(header.count)
+        values[:, 1:] = block
+
+        return header, values
 
     def handle(self):
         """
@@ -52,7 +461,8 @@ class UDP(socketserver.DatagramRequestHandler):
             if not UDP.handler:
                 raise
             else:
-                UDP.handler(dat = self.probe())
+                for sample in self.decode(self.packet)[1]:
+                    UDP.handler(dat = sample)
         except ValueError:
             pass
 
@@ -71,3 +481,381 @@ class UDP(socketserver.DatagramRequestHandler):
         c = socketserver.UDPServer((hostname, port), UDP)
         c.serve_forever()
 
+    @staticmethod
+    def start_async(hostname, port, **kwargs):
+        """
+        Helper function that starts the routine on an `AsyncUDP` server,
+        with the registered data handler.
+
+        Args:
+            hostname (str): Address to bind.
+            port (int): Port to bind.
+            kwargs: See `AsyncUDP`, and `AsyncUDP.serve` for `report`.
+        """
+        report = kwargs.pop('report', None)
+        server = AsyncUDP(UDP.handler, **kwargs)
+        try:
+            asyncio.run(server.serve(hostname, port, report))
+        finally:
+            click.echo("\n{0}".format(server.metrics()), err = True)
+
+class AsyncUDP(asyncio.DatagramProtocol):
+    """
+    asyncio counterpart of the `UDP` routine.
+
+    The datagrams are taken off the socket by the event loop and put in a
+    bounded queue, leaving the socket as soon as possible for the next ones.
+    On the selector loops, every wakeup of the socket drains it without
+    blocking, up to `budget` datagrams at once. Where the loop has no
+    readers (the Windows proactor), a datagram endpoint receives them one
+    at a time. A datagram arriving to a full queue is dropped and counted,
+    instead of stalling the receive path. Datagrams dropped by the kernel,
+    for a full socket buffer, are read off /proc/net/udp where there is one.
+
+    The queue is drained in batches of up to `budget` datagrams, all that
+    piled up while the previous batch was processed, without waiting for
+    more. A batch is decoded (`UDP.values`) and split per device, and the
+    samples of every device are passed to one of `workers` lanes, by
+    device. The lanes call the handler concurrently, while the samples of
+    a device stay in order.
+
+    The handler is called with `dat` for every sample as `UDP.handler` is,
+    or, with `blocks`, once per device in a batch with `block`, a `Block` of
+    the samples of the device. Either way `device` tells the sender apart:
+    the device id of a binary `Packet`, or the (host, port) address a CSV
+    datagram came from. An async handler is awaited. A plain handler is
+    called on the loop, or on a thread pool of `executor` threads if given,
+    so that a slow write or prediction keeps the loop free.
+    """
+
+    #: (int) Default socket receive buffer, bytes. Linux caps it to net.core.rmem_max.
+    RCVBUF = 8 * 1024 ** 2
+
+    def __init__(self, handler, queue_size = 4096, workers = None, executor = None, budget = 64, rcvbuf = RCVBUF,
+                 blocks = False):
+        """
+        Args:
+            handler (callable): Data handler, plain or async.
+            queue_size (int): Datagrams held between receive and processing.
+            workers (int): Lanes calling the handler. Default: one per
+                `executor` thread.
+            executor (int): Threads running a plain handler. Default: None,
+                it runs on the loop.
+            budget (int): Most datagrams received per wakeup of the socket,
+                and processed as a batch.
+            rcvbuf (int): Socket receive buffer (SO_RCVBUF), bytes. None
+                keeps the system default.
+            blocks (bool): Calls the handler with a `Block` per device in a
+                batch, rather than per sample.
+        """
+        self.handler = handler
+        self.queue_size = queue_size
+        self.workers = workers or executor or 1
+        self.executor = ThreadPoolExecutor(executor) if executor else None
+        self.budget = budget
+        self.rcvbuf = rcvbuf
+        self.blocks = blocks
+        #: (deque) Datagrams received and not processed yet, set when they're in.
+        self.queue = None
+        self.ready = None
+        self.lanes = []
+        self.sock = None
+        #: Set once the server stops receiving, the batching task returns once the queue is empty.
+        self.closing = False
+        #: Guards the counts updated by the handler threads of the lanes.
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.last = (self.started, 0)
+
+        #: (dict) Device id: next expected sequence number, of the binary packets.
+        self.sequences = {}
+
+        self.stats = {
+            "received": 0,
+            "batches": 0,
+            "dropped": 0,
+            "kernel_dropped": None,
+            "rcvbuf": None,
+            "malformed": 0,
+            "handled": 0,
+            "errors": 0,
+            "packets": 0,
+            "lost": 0,
+            "late": 0,
+        }
+
+    def datagram_received(self, data, addr):
+        self.stats["received"] += 1
+
+        if len(self.queue) >= self.queue_size:
+            self.stats["dropped"] += 1
+            return
+
+        self.queue.append((data, addr))
+        if not self.ready.is_set():
+            self.ready.set()
+
+    def error_received(self, exc):
+        self.stats["errors"] += 1
+
+    def _receive(self):
+        """
+        Reader of the socket, on the selector loops. Takes up to `budget`
+        datagrams off it without blocking, and leaves the rest to the next
+        wakeup, so that the loop also gets to the batches.
+        """
+        for _ in range(self.budget):
+            try:
+                data, addr = self.sock.recvfrom(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                self.error_received(e)
+                return
+
+            self.datagram_received(data, addr)
+
+    async def serve(self, hostname, port, report = None):
+        """
+        Receives and processes the datagrams, until cancelled.
+
+        Args:
+            hostname (str): Address to bind.
+            port (int): Port to bind.
+            report (float): Seconds between the metrics printed on stderr.
+                Default: None, nothing is printed.
+        """
+        loop = asyncio.get_running_loop()
+        self.queue = deque()
+        self.ready = asyncio.Event()
+        self.lanes = [asyncio.Queue(maxsize = self.budget) for _ in range(self.workers)]
+
+        #: The socket is set up here, for the buffer size, and handed to the endpoint.
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.rcvbuf:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        self.sock.bind((hostname, port))
+
+        #: The kernel may round the size up, Linux doubles it for its bookkeeping.
+        self.stats["rcvbuf"] = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+
+        try:
+            self.sock.setblocking(False)
+            loop.add_reader(self.sock.fileno(), self._receive)
+            transport = None
+        except NotImplementedError:
+            transport, _ = await loop.create_datagram_endpoint(lambda: self, sock = self.sock)
+
+        work = asyncio.ensure_future(self._work())
+        lanes = [asyncio.ensure_future(self._lane(_)) for _ in self.lanes]
+
+        try:
+            while True:
+                await asyncio.sleep(report or 3600)
+                if report:
+                    click.echo("\r{0}".format(self._summary()), err = True, nl = False)
+        finally:
+            self.stats["kernel_dropped"] = self._kernel_drops()
+            if transport is None:
+                loop.remove_reader(self.sock.fileno())
+                self.sock.close()
+            else:
+                transport.close()
+
+            #: Stops receiving, and hands the datagrams already in to the handler before stopping.
+            self.closing = True
+            self.ready.set()
+            await work
+            for lane in self.lanes:
+                await lane.join()
+
+            for task in lanes:
+                task.cancel()
+            if self.executor is not None:
+                self.executor.shutdown(wait = True)
+
+    def metrics(self):
+        """
+        Returns the server metrics.
+
+        Returns:
+            (dict): Datagrams `received` (in `batches`), `dropped` (queue
+                full), `kernel_dropped` (socket buffer full, None where
+                unknown) and `malformed`, the socket buffer size `rcvbuf`,
+                samples `handled` and the handler `errors`, binary `packets`,
+                samples `lost` and `late` packets (see `Packet`), the queue
+                `depth`, and the datagrams per second since the last call
+                (`pps`) and overall (`mean_pps`).
+        """
+        now = time.monotonic()
+        out = dict(self.stats)
+        if self.sock is not None and self.sock.fileno() >= 0:
+            out["kernel_dropped"] = self._kernel_drops()
+        out["depth"] = len(self.queue) if self.queue is not None else 0
+        out["pps"] = (out["received"] - self.last[1]) / max(now - self.last[0], 1e-9)
+        out["mean_pps"] = out["received"] / max(now - self.started, 1e-9)
+        self.last = (now, out["received"])
+        return out
+
+    def _summary(self):
+        """
+        One line summary of the metrics.
+        """
+        m = self.metrics()
+        return ("{pps:.0f} pps, {received} received, {dropped} dropped, {kernel_dropped} kernel dropped, "
+                "{malformed} malformed, {lost} lost, {depth} queued").format(**m)
+
+    def _kernel_drops(self):
+        """
+        Datagrams dropped by the kernel on the socket, from /proc/net/udp.
+
+        Returns:
+            (int): The drops, None off Linux.
+        """
+        try:
+            inode = str(os.fstat(self.sock.fileno()).st_ino)
+        except OSError:
+            return None
+
+        for table in ("/proc/net/udp", "/proc/net/udp6"):
+            try:
+                with open(table) as minion:
+                    next(minion)
+                    for line in minion:
+                        fields = line.split()
+                        if fields[9] == inode:
+                            return int(fields[-1])
+            except (IOError, IndexError, StopIteration):
+                pass
+
+        return None
+
+    async def _work(self):
+        """
+        Batching task. Takes the queued datagrams in batches of up to `budget`,
+        until the server is closing and the queue is empty.
+        """
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+
+            while self.queue:
+                batch = [self.queue.popleft() for _ in range(min(self.budget, len(self.queue)))]
+                await self._batch(batch)
+
+            if self.closing:
+                return
+
+    async def _batch(self, batch):
+        """
+        Decodes a batch, and passes the samples of every device to its lane.
+        """
+        loop = asyncio.get_running_loop()
+        self.stats["batches"] += 1
+
+        if self.executor is not None:
+            decoded = await loop.run_in_executor(self.executor, self._decode, batch)
+        else:
+            decoded = self._decode(batch)
+
+        for (device, values) in decoded.items():
+            values = np.concatenate(values) if len(values) > 1 else values[0]
+            if self.blocks:
+                calls = [({"block": Block(values), "device": device}, len(values))]
+            else:
+                calls = [({"dat": Sample(_), "device": device}, 1) for _ in values]
+
+            #: Waits for room in the lane, holding the next datagrams in the queue meanwhile.
+            await self.lanes[hash(device) % len(self.lanes)].put(calls)
+
+    def _decode(self, batch):
+        """
+        Decodes a batch of datagrams. Runs on the thread pool, if there's
+        one, hence the counts are updated with the lock held.
+
+        Returns:
+            (dict): Device: list of the sample arrays of the device, in order.
+        """
+        decoded = {}
+        headers = []
+        malformed = 0
+
+        for (data, addr) in batch:
+            try:
+                header, values = UDP.values(data)
+            except ValueError:
+                malformed += 1
+                continue
+
+            if header is not None:
+                headers.append(header)
+            decoded.setdefault(addr if header is None else header.device, []).append(values)
+
+        with self.lock:
+            self.stats["malformed"] += malformed
+            for header in headers:
+                self._track(header)
+
+        return decoded
+
+    async def _lane(self, lane):
+        """
+        Lane task. Calls the handler on the samples, or the blocks, passed
+        to the lane, one call after the other.
+        """
+        loop = asyncio.get_running_loop()
+        is_async = asyncio.iscoroutinefunction(self.handler)
+
+        while True:
+            calls = await lane.get()
+
+            try:
+                if is_async:
+                    for (kwargs, count) in calls:
+                        try:
+                            await self.handler(**kwargs)
+                            with self.lock:
+                                self.stats["handled"] += count
+                        except Exception as e:
+                            self._error(e)
+                elif self.executor is not None:
+                    await loop.run_in_executor(self.executor, self._dispatch, calls)
+                else:
+                    self._dispatch(calls)
+            finally:
+                lane.task_done()
+
+    def _dispatch(self, calls):
+        """
+        Calls the plain handler on the samples, or the blocks, of a device.
+        """
+        for (kwargs, count) in calls:
+            try:
+                self.handler(**kwargs)
+                with self.lock:
+                    self.stats["handled"] += count
+            except Exception as e:
+                self._error(e)
+
+    def _error(self, e):
+        with self.lock:
+            self.stats["errors"] += 1
+        click.echo("\nERR: {0}".format(e), err = True)
+
+    def _track(self, header):
+        """
+        Follows the sequence numbers of every device. A gap counts the
+        samples lost, a sequence number behind the expected one counts a
+        late (or duplicate) packet. Called with the lock held.
+        """
+        expected = self.sequences.get(header.device)
+        self.stats["packets"] += 1
+
+        if expected is not None:
+            gap = (header.sequence - expected) & 0xFFFFFFFF
+            if gap >= 0x80000000:
+                self.stats["late"] += 1
+                return
+            self.stats["lost"] += gap
+
+        self.sequences[header.device] = (header.sequence + header.count) & 0xFFFFFFFF
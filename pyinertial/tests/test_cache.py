@@ -0,0 +1,226 @@
+import time
+
+import numpy as np
+import pytest
+
+from inertial import cache as cache_module
+from inertial import sample_dump
+from inertial.cache import FeatureCache, QueryCache, ChainFeatures, SampledFeatures
+from inertial.helper import Helper
+from inertial.routines import Routines
+from inertial.sample_dump import ColumnStore, WindowSampler
+
+
+class FakeProbe(object):
+    """
+    Dataset probe over random samples, in place of the files under /data.
+    """
+
+    def __init__(self, name, tags, length = 700, seed = 0):
+        self.NAME = name
+        self.source = name
+        self.samples = {_: np.random.RandomState(seed + i).rand(length, 3) for i, _ in enumerate(tags)}
+
+    def provides(self, tag):
+        return tag in self.samples
+
+    def tags(self):
+        return list(self.samples)
+
+    def segments(self, tag):
+        yield self.NAME, 0, len(self.samples[tag]), self.samples[tag]
+
+    def probe(self, tag, window_len, step):
+        yield from Helper.sliding_window(self.samples[tag], window_len, step)
+
+
+@pytest.fixture
+def datasets(monkeypatch):
+    probes = (
+        FakeProbe("UCI", ["WALKING"], seed = 0),
+        FakeProbe("Twente", ["WALKING", "BIKING"], seed = 10),
+        FakeProbe("TwenteTwo", ["BIKING"], seed = 20),
+    )
+    monkeypatch.setattr(sample_dump, "Datasets", lambda store_dir = None: probes)
+    monkeypatch.setattr(cache_module, "Datasets", lambda store_dir = None: probes)
+    return probes
+
+
+@pytest.fixture
+def chain_calls(monkeypatch):
+    calls = []
+    original = cache_module.ChainProbes
+
+    def spy(*args, **kwargs):
+        calls.append((args, kwargs))
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(cache_module, "ChainProbes", spy)
+    return calls
+
+
+def expected(probes, tag):
+    windows = [w for p in probes if p.provides(tag) for w in p.probe(tag, 100, 20)]
+    return Routines.feature_vector_batch(np.array(windows))
+
+
+def test_chain_features_reads_through_chain_probes(datasets, chain_calls):
+    out = ChainFeatures("WALKING")
+
+    assert len(chain_calls) == 1
+    np.testing.assert_allclose(out, expected(datasets, "WALKING"))
+
+
+def test_chain_features_cached_per_dataset(datasets, chain_calls, tmp_path):
+    cache = FeatureCache(str(tmp_path))
+
+    first = ChainFeatures("WALKING", cache)
+    assert [_[1]["datasets"] for _ in chain_calls] == [[datasets[0]], [datasets[1]]]
+
+    second = ChainFeatures("WALKING", cache)
+    assert len(chain_calls) == 2
+    np.testing.assert_allclose(first, second)
+    np.testing.assert_allclose(first, expected(datasets, "WALKING"))
+
+
+def test_feature_cache_version_replaces_stale(tmp_path):
+    cache = FeatureCache(str(tmp_path))
+    cache.put("UCI", "WALKING", 100, 20, "a", np.ones((3, 5)))
+    cache.put("UCI", "WALKING", 100, 20, "b", np.zeros((2, 5)))
+
+    assert cache.get("UCI", "WALKING", 100, 20, "a") is None
+    assert cache.get("UCI", "WALKING", 100, 20, "b").shape == (2, 5)
+    assert cache.invalidate(tag = "WALKING") == 1
+
+
+def test_feature_cache_get_or_compute(tmp_path):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return np.arange(10.0).reshape(2, 5)
+
+    cache = FeatureCache(str(tmp_path))
+    first = cache.get_or_compute("UCI", "WALKING", 100, 20, "a", compute)
+    again = FeatureCache(str(tmp_path)).get_or_compute("UCI", "WALKING", 100, 20, "a", compute)
+
+    assert calls == [1]
+    assert again.tolist() == first.tolist() == np.arange(10.0).reshape(2, 5).tolist()
+
+
+def test_feature_cache_evicts_least_recently_used(tmp_path):
+    features = np.ones((4, 5))
+    cache = FeatureCache(str(tmp_path), max_bytes = 2 * features.nbytes)
+
+    cache.put("UCI", "WALKING", 100, 20, "a", features)
+    cache.put("UCI", "RUNNING", 100, 20, "a", features)
+    cache.entries[cache._key("UCI", "RUNNING", 100, 20, "a")]["accessed"] = 0
+    cache.put("UCI", "SITTING", 100, 20, "a", features)
+
+    assert cache.get("UCI", "RUNNING", 100, 20, "a") is None
+    assert cache.get("UCI", "WALKING", 100, 20, "a") is not None
+    assert cache.get("UCI", "SITTING", 100, 20, "a") is not None
+
+
+def test_feature_cache_drops_unreadable_shard(tmp_path):
+    cache = FeatureCache(str(tmp_path))
+    cache.put("UCI", "WALKING", 100, 20, "a", np.ones((3, 5)))
+
+    with open(str(tmp_path / (cache._key("UCI", "WALKING", 100, 20, "a") + ".npy")), "wb") as minion:
+        minion.write(b"torn")
+
+    assert cache.get("UCI", "WALKING", 100, 20, "a") is None
+    assert FeatureCache(str(tmp_path)).entries == {}
+
+
+@pytest.mark.parametrize("cast", [int, np.int64])
+def test_query_cache_closed_epoch_bounds(tmp_path, cast):
+    cache = QueryCache(str(tmp_path), settle = 300)
+    now = time.time()
+
+    assert cache._closed(cast(int((now - 3600) * 1e9)))
+    assert not cache._closed(cast(int(now * 1e9)))
+    assert cache._closed("2016-09-09T15:11:00Z")
+
+
+def test_chain_features_limit_stops_reading(datasets, monkeypatch):
+    read = []
+    original = FakeProbe.probe
+
+    def probe(self, tag, window_len, step):
+        read.append(self.NAME)
+        yield from original(self, tag, window_len, step)
+
+    monkeypatch.setattr(FakeProbe, "probe", probe)
+
+    out = ChainFeatures("WALKING", limit = 7, prefetch = 0)
+
+    assert read == ["UCI"]
+    np.testing.assert_allclose(out, expected(datasets, "WALKING")[:7])
+
+
+def test_chain_features_limit_skips_later_datasets_when_cached(datasets, chain_calls, tmp_path):
+    cache = FeatureCache(str(tmp_path))
+    count = len(list(datasets[0].probe("WALKING", 100, 20)))
+
+    out = ChainFeatures("WALKING", cache, limit = count)
+
+    assert [_[1]["datasets"] for _ in chain_calls] == [[datasets[0]]]
+    assert len(out) == count
+
+
+@pytest.fixture
+def sampler(datasets, tmp_path):
+    store_dir = str(tmp_path / "columnar")
+    for probe in datasets:
+        ColumnStore.convert(probe, store_dir)
+    return WindowSampler(seed = 1, store_dir = store_dir)
+
+
+def test_dataset_reads_the_given_store(datasets, tmp_path):
+    store_dir = str(tmp_path / "columnar")
+    ColumnStore.convert(datasets[0], store_dir)
+
+    probe = sample_dump.UCI(store_dir = store_dir)
+
+    assert probe.source == "UCI:columnar"
+    np.testing.assert_allclose(np.array(list(probe.probe("WALKING", 100, 20))),
+                               np.array(list(datasets[0].probe("WALKING", 100, 20))), rtol = 1e-6)
+
+
+def test_window_sampler_draw(sampler):
+    total = sum(sampler.index.count(_.NAME, "WALKING") for _ in sampler.datasets)
+    ids = sampler.draw("WALKING", 10)
+
+    assert len(set(ids)) == 10
+    assert list(ids) == sorted(ids)
+    assert ids.min() >= 0 and ids.max() < total
+    assert list(sampler.draw("WALKING", total + 5)) == list(range(total))
+
+
+def test_sampled_features_reads_only_sampled_windows(sampler, monkeypatch):
+    ids = sampler.draw("WALKING", 12)
+    windows = sampler.windows("WALKING", ids)
+    read = []
+    original = WindowSampler.windows
+
+    def spy(self, tag, ids):
+        read.append(len(ids))
+        return original(self, tag, ids)
+
+    monkeypatch.setattr(WindowSampler, "windows", spy)
+
+    out = SampledFeatures("WALKING", sampler, ids)
+
+    assert read == [12]
+    np.testing.assert_allclose(out, Routines.feature_vector_batch(windows.astype(np.float64)))
+
+
+def test_sampled_features_looks_up_cached_rows(sampler, datasets, tmp_path, monkeypatch):
+    cache = FeatureCache(str(tmp_path / "features"))
+    full = ChainFeatures("WALKING", cache)
+    ids = sampler.draw("WALKING", 12)
+
+    monkeypatch.setattr(WindowSampler, "windows", lambda *args: pytest.fail("read a cached window"))
+
+    np.testing.assert_allclose(SampledFeatures("WALKING", sampler, ids, cache), full[ids])
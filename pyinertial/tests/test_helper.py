@@ -0,0 +1,134 @@
+import numpy as np
+import pytest
+
+from inertial.helper import Helper, Stupidity, Gradient, RingBuffer
+
+
+def stepped_wave_energy(l):
+    """
+    The left Riemann sum `Helper.discreet_wave_energy` evaluates in closed form.
+    """
+    steps = np.arange(100) / 100
+    return sum(np.abs((b - a) * steps - a).sum() / 100 for a, b in zip(l, l[1:]))
+
+
+def recursive_frechet(P, Q):
+    P = [(i, _) for i, _ in enumerate(P)]
+    Q = [(i, _) for i, _ in enumerate(Q)]
+    ca = {}
+
+    def c(i, j):
+        if (i, j) not in ca:
+            d = Stupidity.euc_dist(P[i], Q[j])
+            if i == 0 and j == 0:
+                ca[i, j] = d
+            elif i == 0:
+                ca[i, j] = max(c(0, j - 1), d)
+            elif j == 0:
+                ca[i, j] = max(c(i - 1, 0), d)
+            else:
+                ca[i, j] = max(min(c(i - 1, j), c(i - 1, j - 1), c(i, j - 1)), d)
+        return ca[i, j]
+
+    return c(len(P) - 1, len(Q) - 1)
+
+
+@pytest.mark.parametrize("l", [
+    [0.0, 1.0, -1.0, 2.5, 2.5, -3.0],
+    [0.3, 0.3, 0.3],
+    list(np.random.default_rng(0).normal(size = 50)),
+])
+def test_discreet_wave_energy_matches_stepped_sum(l):
+    assert Helper.discreet_wave_energy(l) == pytest.approx(stepped_wave_energy(l), rel = 1e-12)
+
+
+def test_discreet_wave_energy_per_window():
+    windows = np.random.default_rng(1).normal(size = (4, 20))
+
+    out = Helper.discreet_wave_energy(windows)
+
+    assert out.shape == (4,)
+    assert out == pytest.approx([stepped_wave_energy(_) for _ in windows], rel = 1e-12)
+
+
+def test_sliding_window():
+    sequence = np.arange(10)
+
+    windows = Helper.sliding_window(sequence, 4, 2)
+
+    assert windows.tolist() == [[0, 1, 2, 3], [2, 3, 4, 5], [4, 5, 6, 7], [6, 7, 8, 9]]
+    assert np.shares_memory(windows, sequence)
+    assert not windows.flags.writeable
+
+
+def test_sliding_window_channels():
+    windows = Helper.sliding_window(np.arange(12).reshape(6, 2), 3, 3)
+
+    assert windows.shape == (2, 3, 2)
+    assert windows[1].tolist() == [[6, 7], [8, 9], [10, 11]]
+
+
+@pytest.mark.parametrize("win_size, step", [(4, 5), (11, 1)])
+def test_sliding_window_rejects(win_size, step):
+    with pytest.raises(ValueError):
+        Helper.sliding_window(range(10), win_size, step)
+
+
+def test_frechet_dist_batch_matches_recursion():
+    rng = np.random.default_rng(2)
+    Ps = rng.normal(size = (5, 12))
+    Q = rng.normal(size = 9)
+
+    out = Stupidity.frechet_dist_batch(Ps, Q)
+
+    assert out == pytest.approx([recursive_frechet(list(_), list(Q)) for _ in Ps])
+    assert Stupidity.frechet_dist(Ps[0], Q) == pytest.approx(out[0])
+
+
+def test_frechet_dist_batch_rejects():
+    with pytest.raises(ValueError):
+        Stupidity.frechet_dist_batch([[(0, 1), (1, 2)]], [(0, 1, 2)], remap = False)
+
+
+@pytest.mark.parametrize("r", [3, 10])
+def test_gradient_remap_matches_rules(r):
+    gradient = Gradient(r)
+    bins = Gradient.gradient_bin(r)
+    slopes = [-1e9, -3.0, -1.0, -0.1, 0.0, 0.05, 1.0, np.tan(np.radians(r)), 1e9]
+
+    for absolute in (False, True):
+        expected = [next(_[0] for _ in bins if _[2 if absolute else 1](m)) for m in slopes]
+        assert gradient.remap(slopes, absolute).tolist() == expected
+
+    assert gradient.bin(float("-inf")) == bins[0][0]
+
+
+def test_gradient_remap_rejects():
+    with pytest.raises(ValueError):
+        Gradient().remap([0.0, float("nan")])
+    with pytest.raises(ValueError):
+        Gradient().remap([float("inf")])
+
+
+def test_ring_buffer_keeps_latest():
+    ring = RingBuffer(4, 2)
+    samples = np.arange(20, dtype = float).reshape(10, 2)
+
+    ring.extend(samples[:3])
+    assert ring.view().tolist() == samples[:3].tolist()
+
+    for _ in samples[3:6]:
+        ring.append(_)
+    ring.extend(samples[6:])
+
+    assert len(ring) == 4
+    assert ring.total == 10
+    assert ring.view().tolist() == samples[-4:].tolist()
+
+
+def test_ring_buffer_block_past_capacity():
+    ring = RingBuffer(3, 1)
+    ring.extend([[1.0]])
+    ring.extend([[_] for _ in range(2, 9)])
+
+    assert ring.view().ravel().tolist() == [6.0, 7.0, 8.0]
@@ -0,0 +1,93 @@
+import re
+
+import numpy as np
+import pytest
+
+from inertial.influx import Influx
+
+
+class Result(object):
+    def __init__(self, raw):
+        self.raw = raw
+
+
+class FakeClient(object):
+    """
+    InfluxDB client answering the queries of `Influx._query` from rows in
+    memory, ordered by time then series, as the server does.
+    """
+
+    def __init__(self, rows = ()):
+        self.rows = list(rows)
+        self.written = []
+        self.queries = []
+
+    def write_points(self, points, *args, **kwargs):
+        self.written.append((list(points), kwargs))
+
+    def create_database(self, name):
+        pass
+
+    def query(self, q, epoch = None):
+        self.queries.append(q)
+        rows = self.rows
+
+        for op, test in ((">=", lambda a, b: a >= b), (">", lambda a, b: a > b), ("<", lambda a, b: a < b)):
+            match = re.search(r"time {0} (\d+)".format(op), q)
+            if match:
+                rows = [_ for _ in rows if test(_[0], int(match.group(1)))]
+
+        offset = re.search(r"offset (\d+)", q)
+        limit = re.search(r"limit (\d+)", q)
+        rows = rows[int(offset.group(1)) if offset else 0:]
+        rows = rows[:int(limit.group(1))] if limit else rows
+
+        if not rows:
+            return Result({})
+        columns = ["time", "mmt_class", "x", "y", "z"]
+        return Result({"series": [{"name": "accelerometer", "columns": columns, "values": rows}]})
+
+
+@pytest.fixture
+def client(monkeypatch):
+    #: Three series share every time, as the classes of a recording would.
+    rows = [[10 ** 18 + (i // 3) * 10 ** 7, "class{0}".format(i % 3), float(i), 0.0, 0.0] for i in range(100)]
+    fake = FakeClient(rows)
+    monkeypatch.setattr(Influx, "_connect", lambda self: fake)
+    return fake
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 1000])
+def test_probe_blocks_keeps_the_rows_of_shared_times(client, chunk_size):
+    blocks = list(Influx().probe_blocks("accelerometer", chunk_size = chunk_size))
+
+    assert np.concatenate(blocks)[:, 1].tolist() == [float(_) for _ in range(100)]
+
+
+def test_probe_blocks_limit(client):
+    blocks = list(Influx().probe_blocks("accelerometer", chunk_size = 4, limit = 10))
+
+    assert np.concatenate(blocks)[:, 1].tolist() == [float(_) for _ in range(10)]
+
+
+def test_line_fields_leaves_out_non_finite_values():
+    fields, skipped = Influx._line_fields(["x", "y", "z", "w"], [1.5, float("nan"), None, float("-inf")])
+
+    assert fields == "x=1.5"
+    assert skipped == 2
+    assert Influx._line_fields(["x"], [float("inf")]) == ("", 1)
+
+
+def test_import_json_writes_no_non_finite_values(client, tmp_path):
+    dump = tmp_path / "dump.json"
+    dump.write_text('{"results": [{"series": [{"name": "accelerometer", "tags": {"mmt_class": "walk"}, '
+                    '"columns": ["time", "x", "y", "z"], '
+                    '"values": [[1000, 1.0, NaN, 2.0], [2000, Infinity, -Infinity, NaN], [3000, 3.0, 4.0, 5.0]]}]}]}')
+
+    with open(str(dump)) as minion:
+        assert Influx().import_json(minion, checkpoint = None)
+
+    lines = [_ for points, kwargs in client.written if kwargs.get("protocol") == "line" for _ in points]
+
+    assert lines == ["accelerometer,mmt_class=walk x=1.0,z=2.0 1000",
+                     "accelerometer,mmt_class=walk x=3.0,y=4.0,z=5.0 3000"]
@@ -0,0 +1,122 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from inertial.helper import Helper
+from inertial.routines import Routines, FeatureStream, Inference
+from inertial.sample_dump import WINDOWLEN, STEP
+
+
+@pytest.fixture
+def stream():
+    rng = np.random.default_rng(3)
+    return np.cumsum(rng.normal(size = (WINDOWLEN * 4 + STEP // 2, 3)), axis = 0)
+
+
+def test_feature_vector_batch_chunks(stream):
+    windows = Helper.sliding_window(stream, WINDOWLEN, STEP)
+
+    out = Routines.feature_vector_batch(windows)
+
+    assert out.shape == (len(windows), 5)
+    assert np.allclose(Routines.feature_vector_batch(windows, chunk_size = 3), out)
+    assert Routines.feature_vector_batch(np.empty((0, WINDOWLEN, 3))).shape == (0, 5)
+
+
+def test_feature_vector_batch_rejects():
+    with pytest.raises(ValueError):
+        Routines.feature_vector_batch(np.zeros((2, WINDOWLEN)))
+
+
+def test_feature_stream_matches_batch(stream):
+    expected = Routines.feature_vector_batch(Helper.sliding_window(stream, WINDOWLEN, STEP))
+
+    out = FeatureStream().extend(stream)
+
+    assert np.allclose(out, expected)
+
+
+def test_feature_stream_push_matches_extend(stream):
+    pushed = FeatureStream()
+    out = [pushed.push(_) for _ in stream]
+
+    extended = FeatureStream()
+    blocks = [extended.extend(stream[_:_ + 7]) for _ in range(0, len(stream), 7)]
+
+    assert np.allclose([_ for _ in out if _ is not None], sum(blocks, []))
+
+
+def test_feature_stream_rejects():
+    with pytest.raises(ValueError):
+        FeatureStream(window_len = WINDOWLEN, step = WINDOWLEN - 1)
+
+
+class Classifier(object):
+
+    def __init__(self, gate = None):
+        self.gate = gate
+
+    def predict(self, rows):
+        if self.gate is not None:
+            self.gate.wait()
+        return [sum(rows[0])]
+
+
+def test_inference_predicts_every_window():
+    out = []
+    inference = Inference([Classifier()], lambda key, predictions, latency: out.append((key, predictions)))
+
+    for i in range(10):
+        inference.put(i, [i, 1.0])
+    inference.close()
+
+    assert sorted(out) == [(i, [i + 1.0]) for i in range(10)]
+    assert inference.metrics()["predicted"] == 10
+
+
+def test_inference_drops_oldest_on_overflow():
+    gate = threading.Event()
+    out = []
+    inference = Inference([Classifier(gate)], lambda key, predictions, latency: out.append(key),
+                          max_pending = 2, max_latency = 60)
+
+    inference.put(0, [0.0])
+    while inference.metrics()["depth"]:
+        time.sleep(0.001)
+
+    for i in range(1, 6):
+        inference.put(i, [0.0])
+    gate.set()
+    inference.close()
+
+    assert out == [0, 4, 5]
+    assert inference.metrics()["overflow"] == 3
+
+
+def test_inference_drops_stale_windows():
+    gate = threading.Event()
+    out = []
+    inference = Inference([Classifier(gate)], lambda key, predictions, latency: out.append(key),
+                          max_latency = 0.05)
+
+    inference.put(0, [0.0])
+    while inference.metrics()["depth"]:
+        time.sleep(0.001)
+
+    inference.put(1, [0.0])
+    time.sleep(0.1)
+    gate.set()
+    inference.close()
+
+    assert out == [0]
+    assert inference.metrics()["stale"] == 1
+
+
+def test_inference_rejects_when_closed():
+    inference = Inference([Classifier()], lambda *args: None)
+    inference.close()
+
+    with pytest.raises(ValueError):
+        inference.put(0, [0.0])
@@ -0,0 +1,126 @@
+import os
+import threading
+
+import pytest
+
+from inertial.spool import Spool
+
+
+class Sink(object):
+    """
+    Records the batches, failing the first `failures` calls.
+    """
+
+    def __init__(self, failures = 0):
+        self.failures = failures
+        self.batches = []
+
+    def __call__(self, points):
+        if self.failures:
+            self.failures -= 1
+            raise IOError("backend down")
+        self.batches.append(points)
+
+    @property
+    def points(self):
+        return [_ for batch in self.batches for _ in batch]
+
+
+def test_spool_drains_in_order(tmp_path):
+    sink = Sink()
+    spool = Spool(str(tmp_path), sink, batch_size = 3)
+
+    for i in range(10):
+        spool.put([{"i": i}])
+
+    assert spool.flush(5)
+    spool.close()
+
+    assert sink.points == [{"i": i} for i in range(10)]
+    assert max(len(_) for _ in sink.batches) <= 3
+    assert spool.metrics()["drained"] == 10
+
+
+def test_spool_retries_failed_batches(tmp_path):
+    sink = Sink(failures = 2)
+    spool = Spool(str(tmp_path), sink, backoff = 0.01)
+
+    spool.put([{"i": 0}, {"i": 1}])
+
+    assert spool.flush(5)
+    spool.close()
+
+    assert sink.points == [{"i": 0}, {"i": 1}]
+    assert spool.metrics()["retries"] == 2
+    assert spool.metrics()["last_error"] == "backend down"
+
+
+def test_spool_resumes_after_close(tmp_path):
+    down = Sink(failures = 1 << 30)
+    spool = Spool(str(tmp_path), down, backoff = 0.01)
+    spool.put([{"i": 0}])
+    spool.put([{"i": 1}])
+    spool.close(timeout = 0.05)
+
+    assert down.points == []
+
+    sink = Sink()
+    spool = Spool(str(tmp_path), sink)
+    spool.put([{"i": 2}])
+
+    assert spool.flush(5)
+    spool.close()
+
+    assert sink.points == [{"i": 0}, {"i": 1}, {"i": 2}]
+
+
+def test_spool_skips_torn_record(tmp_path):
+    spool = Spool(str(tmp_path), Sink(failures = 1 << 30), backoff = 0.01)
+    spool.put([{"i": 0}])
+    spool.close(timeout = 0.05)
+
+    segment = sorted(_ for _ in os.listdir(str(tmp_path)) if _.endswith(".log"))[0]
+    torn = Spool.HEADER.pack(100, 0, 0.0) + b'[{"i"'
+    with open(str(tmp_path / segment), "ab") as minion:
+        minion.write(torn)
+
+    sink = Sink()
+    spool = Spool(str(tmp_path), sink)
+    spool.put([{"i": 1}])
+
+    assert spool.flush(5)
+    spool.close()
+
+    assert sink.points == [{"i": 0}, {"i": 1}]
+    assert spool.metrics()["skipped_bytes"] == len(torn)
+
+
+def test_spool_rotates_and_removes_drained_segments(tmp_path):
+    gate = threading.Event()
+    sink = Sink()
+    spool = Spool(str(tmp_path), lambda points: gate.wait() and sink(points), segment_bytes = 64)
+
+    for i in range(10):
+        spool.put([{"i": i}])
+
+    assert len([_ for _ in os.listdir(str(tmp_path)) if _.endswith(".log")]) > 1
+
+    gate.set()
+    assert spool.flush(5)
+    spool.close()
+
+    assert sink.points == [{"i": i} for i in range(10)]
+    assert len([_ for _ in os.listdir(str(tmp_path)) if _.endswith(".log")]) == 1
+
+
+def test_spool_rejects():
+    with pytest.raises(ValueError):
+        Spool("unused", Sink(), fsync = "sometimes")
+
+
+def test_spool_put_after_close(tmp_path):
+    spool = Spool(str(tmp_path), Sink())
+    spool.close()
+
+    with pytest.raises(ValueError):
+        spool.put([{"i": 0}])
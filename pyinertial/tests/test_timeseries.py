@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+import pytest
+
+from inertial.timeseries import LocalStore
+
+
+def points(start, count, tag = "walk"):
+    return [{
+        "measurement": "accelerometer",
+        "tags": {"mmt_class": tag},
+        "time": (start + i) * 10 ** 9,
+        "fields": {"x": float(start + i), "y": 0.0, "z": 1.0}
+    } for i in range(count)]
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(LocalStore, "SEGMENT_MIN", 4)
+    monkeypatch.setattr(LocalStore, "SEGMENT_SIZE", 16)
+    store = LocalStore(str(tmp_path), batch_size = 1 << 30)
+    yield store
+    store.close()
+
+
+def segment_sizes(store):
+    return [len(np.load(os.path.join(store.store_dir, _["file"]), mmap_mode = 'r'))
+            for _ in store.manifest["measurements"]["accelerometer"]["segments"]]
+
+
+def test_small_write_allocates_small_segment(store):
+    store.write_points(points(0, 3))
+    store.flush()
+
+    assert segment_sizes(store) == [4]
+
+
+def test_segment_grows_by_doubling(store):
+    for start in range(11):
+        store.write_points(points(start, 1))
+        store.flush()
+
+    assert segment_sizes(store) == [16]
+    assert store.probe_columns("accelerometer")[:, 1].tolist() == list(range(11))
+
+
+def test_full_segment_starts_another(store):
+    store.write_points(points(0, 20))
+    store.flush()
+
+    assert segment_sizes(store) == [16, 4]
+    assert store.probe_columns("accelerometer")[:, 1].tolist() == list(range(20))
+
+
+def test_grown_segment_reopens(store, tmp_path):
+    store.write_points(points(0, 5))
+    store.close()
+
+    again = LocalStore(str(tmp_path), batch_size = 1 << 30)
+    again.write_points(points(5, 5))
+    again.flush()
+
+    assert again.probe_columns("accelerometer", tag = "walk")[:, 1].tolist() == list(range(10))
+    again.close()
@@ -0,0 +1,200 @@
+import asyncio
+import socket
+import threading
+import time
+
+from collections import deque
+
+import numpy as np
+import pytest
+
+from inertial import udp
+from inertial.udp import AsyncUDP, ColumnParser, Packet, Sample, Sessions, UDP
+
+
+def serve(server, datagrams, settle = 0.5):
+    """
+    Runs `server` on an ephemeral port, sends it the datagrams, and stops it
+    once their samples are handled or `settle` seconds after the last one.
+    """
+    samples = sum(Packet.decode(_)[0].count if Packet.is_packet(_) else 1 for _ in datagrams)
+
+    async def main():
+        task = asyncio.ensure_future(server.serve("127.0.0.1", 0))
+        while server.sock is None or server.stats["rcvbuf"] is None:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for data in datagrams:
+            sender.sendto(data, server.sock.getsockname())
+        sender.close()
+
+        deadline = time.monotonic() + settle
+        while server.stats["handled"] < samples and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(main())
+
+
+def test_async_udp_lanes_run_the_handler_concurrently():
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def handler(**kwargs):
+        with lock:
+            active.append(kwargs["device"])
+            peak.append(len(active))
+        time.sleep(0.2)
+        with lock:
+            active.remove(kwargs["device"])
+
+    server = AsyncUDP(handler, executor = 2, blocks = True)
+    serve(server, [Packet.encode(_, 0, 0, 0.01, np.ones((1, 12))) for _ in (0, 1)], settle = 2)
+
+    assert server.stats["handled"] == 2
+    assert max(peak) == 2
+
+
+def test_async_udp_keeps_the_order_of_a_device():
+    seen = []
+    handler = lambda **kwargs: seen.extend(kwargs["block"].timestamps.tolist())
+
+    datagrams = [Packet.encode(7, _ * 2, 1e9 + _, 0.5, np.zeros((2, 12))) for _ in range(50)]
+    server = AsyncUDP(handler, executor = 3, blocks = True, budget = 4)
+    serve(server, datagrams)
+
+    assert seen == sorted(seen) and len(seen) == 100
+    assert server.stats["lost"] == 0
+
+
+def test_async_udp_handles_the_queue_on_cancel():
+    seen = []
+
+    def handler(**kwargs):
+        time.sleep(0.05)
+        seen.append(kwargs["device"])
+
+    datagrams = [Packet.encode(_ % 4, _ // 4, 1e9, 0.5, np.zeros((1, 12))) for _ in range(40)]
+    server = AsyncUDP(handler, executor = 2, blocks = True, budget = 4)
+    #: Cancelled with most of the datagrams received and still queued.
+    serve(server, datagrams, settle = 0.1)
+
+    assert len(seen) == server.stats["handled"] == 40
+    assert server.metrics()["depth"] == 0
+
+
+def test_async_udp_receives_up_to_the_budget_per_wakeup():
+    server = AsyncUDP(lambda **kwargs: None, budget = 4)
+    server.queue = deque()
+    server.ready = asyncio.Event()
+    server.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.sock.bind(("127.0.0.1", 0))
+    server.sock.setblocking(False)
+
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for _ in range(6):
+        sender.sendto(b"x", server.sock.getsockname())
+    sender.close()
+    time.sleep(0.05)
+
+    server._receive()
+    assert len(server.queue) == 4 and server.ready.is_set()
+
+    server._receive()
+    server._receive()
+    assert len(server.queue) == 6 and server.stats["received"] == 6
+    server.sock.close()
+
+
+def test_column_parser_projects_columns():
+    parser = ColumnParser(["c", "a"], ["a", "b", "c"])
+
+    assert parser.parse(b"1,2,3").tolist() == [3.0, 1.0]
+    with pytest.raises(ValueError):
+        parser.parse(b"1,2")
+
+
+def test_column_parser_parse_into_skips_malformed():
+    parser = ColumnParser(["a", "c"], ["a", "b", "c"])
+    out = np.zeros((4, 2))
+
+    count = parser.parse_into([b"1,2,3", b"1,2", b"4,x,6", b"7,8,nope", b"9,9,9"], out)
+
+    assert count == 3
+    assert out[:count].tolist() == [[1.0, 3.0], [4.0, 6.0], [9.0, 9.0]]
+
+
+def test_packet_round_trip():
+    samples = np.arange(3 * Packet.WIDTH, dtype = np.float32).reshape(3, Packet.WIDTH)
+
+    header, block = Packet.decode(Packet.encode(7, 41, 1.5e9, 0.01, samples))
+
+    assert (header.device, header.sequence, header.count, header.timestamp) == (7, 41, 3, 1.5e9)
+    assert header.period == pytest.approx(0.01)
+    assert block.tolist() == samples.tolist()
+    assert not block.flags.writeable
+
+
+@pytest.mark.parametrize("mangle", [
+    lambda _: _[:10],
+    lambda _: _[:-4],
+    lambda _: _[:2] + bytes([2]) + _[3:],
+])
+def test_packet_decode_rejects(mangle):
+    with pytest.raises(ValueError):
+        Packet.decode(mangle(Packet.encode(1, 0, 0.0, 0.01, np.zeros((2, Packet.WIDTH)))))
+
+
+def test_packet_encode_rejects_oversized():
+    with pytest.raises(ValueError):
+        Packet.encode(1, 0, 0.0, 0.01, np.zeros((Packet.MAX_COUNT + 1, Packet.WIDTH)))
+
+
+def csv_line(values):
+    return ",".join(str(values.get(_, 0.5)) for _ in UDP.COL_HEAD).encode()
+
+
+def test_values_of_packet_and_csv():
+    samples = np.arange(2 * Packet.WIDTH, dtype = np.float32).reshape(2, Packet.WIDTH)
+    header, values = UDP.values(Packet.encode(1, 0, 1.5e9, 0.5, samples))
+
+    assert values[:, 0].tolist() == [1.5e9, 1.5e9 + 0.5]
+    assert values[:, 1:].tolist() == samples.tolist()
+
+    header, values = UDP.values(csv_line({"Timestamp": 1.5e9, "Accel_X": 1.0, "MagZ": 9.0, "Yaw": 12.0}))
+    sample = Sample(values[0])
+
+    assert header is None
+    assert sample.unix_time == 1.5e9
+    assert sample["accelerometer"] == [1.0, 0.5, 0.5]
+    assert sample["magnetometer"] == [0.5, 0.5, 9.0]
+    assert sample["ahrs"] == [0.5, 0.5, 12.0]
+
+
+def test_sample_unix_time_without_wall_clock():
+    assert Sample(UDP.values(csv_line({"Timestamp": 3600.0}))[1][0]).unix_time is None
+
+
+def test_sessions_evict_idle_devices(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(udp.time, "monotonic", lambda: clock[0])
+    evicted = []
+    sessions = Sessions(lambda device: [device], idle = 10, on_evict = evicted.append)
+
+    assert sessions.get("a").state == ["a"]
+    clock[0] = 6
+    assert sessions.get("b") is sessions.get("b")
+    clock[0] = 12
+    sessions.get("b")
+
+    assert "a" not in sessions and "b" in sessions
+    assert [_.device for _ in evicted] == ["a"]
+    assert sessions.metrics() == {"created": 2, "evicted": 1, "active": 1}